@@ -3,29 +3,50 @@ Gunicorn configuration for AI-PsychDoodle-Analyzer server
 """
 
 import os
+import shutil
 import multiprocessing
 import json
 
 # Import server configuration
 import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from server_config import ServerConfig
-
-# Load configuration
-config = ServerConfig()
-server_config = config.get_server_config()
+from server_config import (ServerConfig, load_environment_variables, plan_resources,
+                           apply_resource_plan, format_resource_plan)
+
+# Load configuration, with the same environment overrides as the workers
+# (e.g. RESOURCES_PIN_WORKERS for the resource plan)
+app_config = ServerConfig()
+load_environment_variables(app_config)
+server_config = app_config.get_server_config()
+monitoring_config = app_config.get_monitoring_config()
+
+# Prometheus multiprocess mode: every worker writes its metrics to files in
+# this directory, and the master aggregates them. The variable must be set
+# before prometheus_client is imported anywhere, so it is set here.
+prometheus_enabled = monitoring_config.get('enabled', True) and monitoring_config.get('prometheus_enabled', True)
+if prometheus_enabled:
+    os.environ.setdefault(
+        "PROMETHEUS_MULTIPROC_DIR",
+        monitoring_config.get('prometheus_multiproc_dir', '/tmp/psychdoodle_prometheus')
+    )
 
 # Server socket
 bind = f"{server_config['host']}:{server_config['port']}"
 backlog = 2048
 
 # Worker processes
-workers = server_config.get('workers', (multiprocessing.cpu_count() * 2) + 1)
+workers = server_config.get('workers', multiprocessing.cpu_count())
 worker_class = 'uvicorn.workers.UvicornWorker'
 worker_connections = 1000
 timeout = server_config.get('timeout', 60)
 keepalive = 2
 
+# Per-worker CPU and thread budget, so TensorFlow, PyTorch and OpenCV in
+# all workers together use the available CPUs once instead of each sizing
+# its thread pools to every core
+resources_config = app_config.get_resources_config()
+resource_plan = plan_resources(app_config, workers) if resources_config.get('enabled', True) else None
+
 # Server mechanics
 daemon = False
 raw_env = [
@@ -33,8 +54,8 @@ raw_env = [
     f"SERVER_PORT={server_config['port']}",
     f"SERVER_WORKERS={workers}",
     f"SERVER_LOG_LEVEL={server_config['log_level']}",
-    f"API_REQUIRE_KEY={json.dumps(config.get_api_config()['require_api_key'])}",
-    f"USE_GPU={json.dumps(config.get_models_config()['use_gpu'])}"
+    f"API_REQUIRE_KEY={json.dumps(app_config.get_api_config()['require_api_key'])}",
+    f"USE_GPU={json.dumps(app_config.get_models_config()['use_gpu'])}"
 ]
 
 # Logging
@@ -52,6 +73,17 @@ def on_starting(server):
     Log server start
     """
     print(f"Starting AI-PsychDoodle-Analyzer server on {bind}")
+    
+    # Plan for the actual number of workers (which may be set on the command line)
+    global resource_plan
+    if resource_plan is not None:
+        resource_plan = plan_resources(app_config, server.cfg.workers)
+    
+    # Remove metric files left over from a previous run
+    if prometheus_enabled:
+        multiproc_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
 
 def on_reload(server):
     """
@@ -64,12 +96,25 @@ def post_fork(server, worker):
     Setup after worker fork
     """
     server.log.info(f"Worker spawned (pid: {worker.pid})")
+    
+    # Before the application (and with it TensorFlow and PyTorch) is imported
+    if resource_plan is not None:
+        slot = resource_plan["slots"][worker.resource_slot % len(resource_plan["slots"])]
+        try:
+            effective = apply_resource_plan(slot)
+            server.log.info(f"Worker {worker.pid} resources: slot {worker.resource_slot}, "
+                            f"cpus {effective['cpus']}, threads {slot['threads']}")
+        except Exception as e:
+            server.log.warning(f"Could not apply resource plan in worker {worker.pid}: {e}")
 
 def pre_fork(server, worker):
     """
     Setup before worker fork
     """
-    pass
+    # Give the new worker the slot of the resource plan no live worker
+    # holds (a restarted worker takes over its predecessor's CPUs)
+    used = {getattr(w, "resource_slot", None) for w in server.WORKERS.values()}
+    worker.resource_slot = next(index for index in range(len(used) + 1) if index not in used)
 
 def pre_exec(server):
     """
@@ -82,6 +127,20 @@ def when_ready(server):
     Executed when server is ready
     """
     server.log.info(f"Server is ready. Listening on: {bind}")
+    if resource_plan is not None:
+        for line in format_resource_plan(resource_plan).splitlines():
+            server.log.info(line)
+    
+    # Serve metrics aggregated across all workers from the master process
+    if prometheus_enabled:
+        try:
+            from prometheus_client import CollectorRegistry, start_http_server, multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            start_http_server(monitoring_config.get('prometheus_port', 8001), registry=registry)
+            server.log.info(f"Prometheus metrics on port {monitoring_config.get('prometheus_port', 8001)}")
+        except Exception as e:
+            server.log.warning(f"Could not start Prometheus exporter: {e}")
 
 def worker_int(worker):
     """
@@ -99,4 +158,16 @@ def worker_exit(server, worker):
     """
     Executed when worker exits
     """
-    server.log.info(f"Worker exited (pid: {worker.pid})")
\ No newline at end of file
+    server.log.info(f"Worker exited (pid: {worker.pid})")
+
+def child_exit(server, worker):
+    """
+    Executed in the master when a worker exits
+    """
+    # Drop the live gauges of the dead worker
+    if prometheus_enabled:
+        try:
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(worker.pid)
+        except Exception as e:
+            server.log.warning(f"Could not clean up metrics of worker {worker.pid}: {e}")
\ No newline at end of file
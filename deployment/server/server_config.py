@@ -4,9 +4,11 @@ Server Deployment Configuration for AI-PsychDoodle-Analyzer
 """
 
 import os
+import sys
+import math
 import logging
 import yaml
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 # Configure logging
 logging.basicConfig(
@@ -50,27 +52,108 @@ class ServerConfig:
                 "require_api_key": False,
                 "api_keys": [],
                 "rate_limit_enabled": True,
-                "rate_limit": 100  # requests per minute
+                "rate_limit": 100,  # requests per minute
+                "rate_limit_burst": 20,  # requests allowed at once
+                "rate_limit_state_path": "",  # shared bucket table (default: /dev/shm)
+                "trust_forwarded_for": False,  # key clients by X-Forwarded-For
+                "load_shedding": True,  # 503 while the target queue is full
+                "admin_api_keys": []  # keys allowed to call /admin endpoints
             },
             "models": {
                 "shape_analyzer_path": "models/weights/shape_analyzer_model.h5",
                 "drawing_analyzer_path": "models/weights/drawing_analyzer_model.h5",
                 "gaugan_model_path": "models/weights/gaugan_model.pth",
+                "shape_heuristics_path": "",  # heuristic spec files ("" for the defaults)
+                "drawing_heuristics_path": "",
                 "use_gpu": True,
-                "gpu_memory_limit": 2048  # MB
+                "gpu_memory_limit": 2048,  # MB
+                "drawing_early_exit": {
+                    "enabled": False,  # coarse results approximate the full scores
+                    "pyramid_levels": [56, 112],
+                    "confidence_margin": 0.01  # DEFAULT_CONFIDENCE_MARGIN of the DrawingAnalyzer
+                },
+                "hot_reload": {
+                    "enabled": True,
+                    "poll_interval": 5,  # seconds between weight file checks
+                    "trigger_path": "data/models.reload"  # touched to reload all workers
+                }
             },
             "storage": {
                 "type": "local",  # "local", "s3", or "azure"
                 "path": "data/",
+                "persist_images": False,  # store uploaded and generated images (opt-in)
+                "retention_days": 30,  # delete stored images after this many days (0 keeps them)
+                "writer_threads": 2,
+                "max_pending_writes": 256,  # images are returned inline only beyond this
                 "s3_bucket": "",
                 "s3_region": "",
+                "s3_endpoint_url": "",  # e.g. a local MinIO instance
                 "azure_container": "",
                 "azure_connection_string": ""
             },
+            "history": {
+                "database": "data/sessions.db",
+                "ewma_alpha": 0.3,
+                "daily_rollup_days": 30
+            },
+            "buffer_pool": {
+                "enabled": True,
+                "max_buffers_per_shape": 16,
+                "max_megabytes": 256
+            },
+            "warmup": {
+                "enabled": True,
+                "rounds": 2,  # the first pays one-time initialization costs
+                "shape_size": 256,
+                "doodle_size": 512
+            },
+            "scheduler": {
+                "enabled": True,
+                "max_workers": 4,  # pipeline threads per server worker
+                "lanes": {
+                    # Shape analysis: a few OpenCV passes, latency-sensitive
+                    "interactive": {"weight": 4, "max_concurrency": 4, "max_queue": 256},
+                    # Doodle analysis: GauGAN transform, analysis and encoding
+                    "heavy": {"weight": 1, "max_concurrency": 2, "max_queue": 64}
+                }
+            },
+            "jobs": {
+                "enabled": True,
+                "workers": 2,  # jobs processed concurrently per server worker
+                "max_queue": 64,
+                "result_ttl": 600,  # seconds finished jobs are kept
+                "state_dir": "data/jobs",  # shared by all server workers
+                "sse_keepalive": 15  # seconds
+            },
+            "profiling": {
+                "server_timing": True,  # stage durations in a Server-Timing header
+                "enabled": True,  # profiles requested with X-Profile (admin API keys only)
+                "sample_hz": 200,
+                "max_seconds": 60,
+                "output_dir": "data/profiles",
+                "formats": ["collapsed", "speedscope"]
+            },
+            "tracing": {
+                "enabled": True,
+                "service_name": "psychdoodle-api",
+                "exporter": "file",  # "file", "otlp" or "none"
+                "file_path": "logs/traces.jsonl",
+                "otlp_endpoint": "http://localhost:4318/v1/traces",
+                "sample_ratio": 0.1,  # of traces without a sampled caller
+                "exempt_paths": ["/metrics", "/health", "/health/live", "/health/ready"]
+            },
+            "resources": {
+                "enabled": True,
+                "intra_op_threads": 0,  # per worker (0 = from the CPU budget)
+                "inter_op_threads": 0,
+                "opencv_threads": 0,
+                "pin_workers": False  # restrict each worker to its own CPUs
+            },
             "monitoring": {
                 "enabled": True,
                 "prometheus_enabled": True,
                 "prometheus_port": 8001,
+                "prometheus_multiproc_dir": "/tmp/psychdoodle_prometheus",
                 "health_check_interval": 60  # seconds
             }
         }
@@ -173,6 +256,78 @@ class ServerConfig:
         """
         return self.config["storage"]
     
+    def get_history_config(self) -> Dict[str, Any]:
+        """
+        Get session history configuration
+        
+        Returns:
+            History configuration dictionary
+        """
+        return self.config["history"]
+    
+    def get_buffer_pool_config(self) -> Dict[str, Any]:
+        """
+        Get image buffer pool configuration
+        
+        Returns:
+            Buffer pool configuration dictionary
+        """
+        return self.config["buffer_pool"]
+    
+    def get_warmup_config(self) -> Dict[str, Any]:
+        """
+        Get model warm-up configuration
+        
+        Returns:
+            Warm-up configuration dictionary
+        """
+        return self.config["warmup"]
+    
+    def get_scheduler_config(self) -> Dict[str, Any]:
+        """
+        Get request scheduler configuration
+        
+        Returns:
+            Scheduler configuration dictionary
+        """
+        return self.config["scheduler"]
+    
+    def get_jobs_config(self) -> Dict[str, Any]:
+        """
+        Get asynchronous job configuration
+        
+        Returns:
+            Jobs configuration dictionary
+        """
+        return self.config["jobs"]
+    
+    def get_profiling_config(self) -> Dict[str, Any]:
+        """
+        Get request profiling configuration
+        
+        Returns:
+            Profiling configuration dictionary
+        """
+        return self.config["profiling"]
+    
+    def get_tracing_config(self) -> Dict[str, Any]:
+        """
+        Get distributed tracing configuration
+        
+        Returns:
+            Tracing configuration dictionary
+        """
+        return self.config["tracing"]
+    
+    def get_resources_config(self) -> Dict[str, Any]:
+        """
+        Get per-worker CPU thread budget configuration
+        
+        Returns:
+            Resources configuration dictionary
+        """
+        return self.config["resources"]
+    
     def get_monitoring_config(self) -> Dict[str, Any]:
         """
         Get monitoring configuration
@@ -235,6 +390,29 @@ def load_environment_variables(config: ServerConfig):
     if os.getenv("API_KEYS"):
         config.override_config("api", "api_keys", os.getenv("API_KEYS").split(","))
     
+    if os.getenv("API_RATE_LIMIT_ENABLED"):
+        config.override_config("api", "rate_limit_enabled", os.getenv("API_RATE_LIMIT_ENABLED").lower() == "true")
+    
+    if os.getenv("API_RATE_LIMIT"):
+        config.override_config("api", "rate_limit", int(os.getenv("API_RATE_LIMIT")))
+
+    if os.getenv("ADMIN_API_KEYS"):
+        config.override_config("api", "admin_api_keys", os.getenv("ADMIN_API_KEYS").split(","))
+
+    # Tracing settings
+    if os.getenv("TRACING_EXPORTER"):
+        config.override_config("tracing", "exporter", os.getenv("TRACING_EXPORTER"))
+    
+    if os.getenv("TRACING_OTLP_ENDPOINT"):
+        config.override_config("tracing", "otlp_endpoint", os.getenv("TRACING_OTLP_ENDPOINT"))
+    
+    if os.getenv("TRACING_SAMPLE_RATIO"):
+        config.override_config("tracing", "sample_ratio", float(os.getenv("TRACING_SAMPLE_RATIO")))
+    
+    # Resource settings
+    if os.getenv("RESOURCES_PIN_WORKERS"):
+        config.override_config("resources", "pin_workers", os.getenv("RESOURCES_PIN_WORKERS").lower() == "true")
+    
     # Model settings
     if os.getenv("USE_GPU"):
         config.override_config("models", "use_gpu", os.getenv("USE_GPU").lower() == "true")
@@ -246,11 +424,269 @@ def load_environment_variables(config: ServerConfig):
     if os.getenv("STORAGE_TYPE"):
         config.override_config("storage", "type", os.getenv("STORAGE_TYPE"))
     
+    if os.getenv("STORAGE_PERSIST_IMAGES"):
+        config.override_config("storage", "persist_images", os.getenv("STORAGE_PERSIST_IMAGES").lower() == "true")
+    
+    if os.getenv("STORAGE_RETENTION_DAYS"):
+        config.override_config("storage", "retention_days", int(os.getenv("STORAGE_RETENTION_DAYS")))
+    
     if os.getenv("S3_BUCKET"):
         config.override_config("storage", "s3_bucket", os.getenv("S3_BUCKET"))
     
     if os.getenv("S3_REGION"):
         config.override_config("storage", "s3_region", os.getenv("S3_REGION"))
+    
+    if os.getenv("S3_ENDPOINT_URL"):
+        config.override_config("storage", "s3_endpoint_url", os.getenv("S3_ENDPOINT_URL"))
+
+
+# Thread pool sizes read by OpenMP, BLAS libraries and TensorFlow when they
+# start, so they must be set before the libraries are imported
+INTRA_OP_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                     "NUMEXPR_NUM_THREADS", "TF_NUM_INTRAOP_THREADS")
+INTER_OP_ENV_VARS = ("TF_NUM_INTEROP_THREADS",)
+
+
+def _read_int(path: str) -> int:
+    with open(path) as f:
+        return int(f.read().strip())
+
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    """
+    CPUs granted by the container's cgroup CPU quota (None if unlimited)
+    """
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        quota = _read_int("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+        period = _read_int("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def detect_cpu_topology() -> Dict[str, Any]:
+    """
+    CPUs this process may run on, grouped by physical core
+    
+    Returns:
+        Dictionary with the usable logical CPUs, the physical cores (lists of
+        sibling hyperthreads), the cgroup CPU quota and the effective number
+        of CPUs (the smaller of the usable CPUs and the quota)
+    """
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        # Not available on macOS
+        cpus = list(range(os.cpu_count() or 1))
+    
+    cores = {}
+    for cpu in cpus:
+        topology = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        try:
+            key = (_read_int(f"{topology}/physical_package_id"), _read_int(f"{topology}/core_id"))
+        except (OSError, ValueError):
+            key = (0, cpu)
+        cores.setdefault(key, []).append(cpu)
+    
+    quota = _cgroup_cpu_quota()
+    effective = len(cpus) if quota is None else max(1, min(len(cpus), math.floor(quota)))
+    return {
+        "logical_cpus": cpus,
+        "physical_cores": sorted(cores.values()),
+        "cgroup_cpu_quota": quota,
+        "effective_cpus": effective
+    }
+
+
+def plan_resources(config: ServerConfig, workers: int = None,
+                   topology: Dict[str, Any] = None, model_concurrency: int = None) -> Dict[str, Any]:
+    """
+    Split the CPU budget between the server workers
+    
+    Each of the `workers` processes gets an equal share of the effective
+    CPUs. OpenCV uses the whole share (its thread pool runs one parallel
+    region at a time); the TensorFlow and PyTorch intra-op pools get the
+    share divided by the number of model inferences a worker runs at once
+    (the heavy scheduler lane's max_concurrency), so concurrent requests
+    do not oversubscribe the worker's CPUs. With pin_workers, each worker
+    is restricted to its own CPUs, filled physical core by physical core.
+    
+    Args:
+        config: ServerConfig instance
+        workers: Number of server worker processes (default: server.workers)
+        topology: CPU topology (default: detect_cpu_topology())
+        model_concurrency: Model inferences a worker runs at once (default:
+            the heavy lane's max_concurrency)
+        
+    Returns:
+        Resource plan with the topology, the per-worker CPU share and one
+        slot (CPUs and thread counts) per worker
+    """
+    resources = config.get_resources_config()
+    scheduler = config.get_scheduler_config()
+    topology = topology or detect_cpu_topology()
+    workers = max(1, workers or config.get_server_config().get("workers") or topology["effective_cpus"])
+    
+    if model_concurrency is None:
+        model_concurrency = 1
+        if scheduler.get("enabled", True):
+            model_concurrency = max(1, scheduler.get("lanes", {}).get("heavy", {}).get("max_concurrency", 1))
+    
+    # CPUs ordered so that a contiguous range covers whole physical cores
+    ordered = [cpu for core in topology["physical_cores"] for cpu in core][:topology["effective_cpus"]]
+    share = max(1, len(ordered) // workers)
+    
+    slots = []
+    for index in range(workers):
+        cpus = None
+        cpu_count = share
+        if resources.get("pin_workers", False):
+            # Spread the remainder over the first workers; wrap around if
+            # there are more workers than CPUs
+            start = index * len(ordered) // workers
+            end = max(start + 1, (index + 1) * len(ordered) // workers)
+            cpus = [ordered[i % len(ordered)] for i in range(start, end)]
+            cpu_count = len(cpus)
+        slots.append({
+            "cpus": cpus,
+            "threads": {
+                "intra_op": resources.get("intra_op_threads") or max(1, cpu_count // model_concurrency),
+                "inter_op": resources.get("inter_op_threads") or min(model_concurrency, cpu_count),
+                "opencv": resources.get("opencv_threads") or cpu_count
+            }
+        })
+    
+    return {
+        "topology": topology,
+        "workers": workers,
+        "cpus_per_worker": share,
+        "model_concurrency": model_concurrency,
+        "pin_workers": bool(resources.get("pin_workers", False)),
+        "oversubscribed": workers > topology["effective_cpus"],
+        "slots": slots
+    }
+
+
+def apply_resource_plan(slot: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Apply a worker's CPUs and thread counts in the current process
+    
+    Must run in the worker before the application is imported (e.g. in
+    gunicorn's post_fork), since some libraries only read their thread
+    settings once at startup.
+    
+    Args:
+        slot: One slot of a resource plan
+        
+    Returns:
+        The effective settings (see effective_resources)
+    """
+    threads = slot["threads"]
+    for name in INTRA_OP_ENV_VARS:
+        os.environ[name] = str(threads["intra_op"])
+    for name in INTER_OP_ENV_VARS:
+        os.environ[name] = str(threads["inter_op"])
+    
+    if slot.get("cpus") and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, slot["cpus"])
+    
+    try:
+        import cv2
+        cv2.setNumThreads(threads["opencv"])
+    except ImportError:
+        pass
+    
+    try:
+        import torch
+        torch.set_num_threads(threads["intra_op"])
+        try:
+            torch.set_num_interop_threads(threads["inter_op"])
+        except RuntimeError:
+            # Only possible before the first parallel work
+            pass
+    except ImportError:
+        pass
+    
+    try:
+        import tensorflow as tf
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(threads["intra_op"])
+            tf.config.threading.set_inter_op_parallelism_threads(threads["inter_op"])
+        except RuntimeError:
+            # Only possible before the TensorFlow runtime is initialized; the
+            # environment variables above still apply
+            pass
+    except ImportError:
+        pass
+    
+    return effective_resources()
+
+
+def effective_resources() -> Dict[str, Any]:
+    """
+    CPU affinity and thread pool sizes in effect in the current process
+    
+    Only libraries that are already imported are queried.
+    
+    Returns:
+        Dictionary with the CPUs the process may run on and the thread
+        counts of OpenCV, PyTorch and TensorFlow
+    """
+    report: Dict[str, Any] = {
+        "pid": os.getpid(),
+        "cpus": sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None,
+        "env": {name: os.environ.get(name) for name in INTRA_OP_ENV_VARS + INTER_OP_ENV_VARS}
+    }
+    cv2 = sys.modules.get("cv2")
+    if cv2 is not None:
+        report["opencv_threads"] = cv2.getNumThreads()
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        try:
+            report["torch_threads"] = {"intra_op": torch.get_num_threads(),
+                                       "inter_op": torch.get_num_interop_threads()}
+        except AttributeError:
+            pass
+    tf = sys.modules.get("tensorflow")
+    if tf is not None:
+        try:
+            report["tensorflow_threads"] = {
+                "intra_op": tf.config.threading.get_intra_op_parallelism_threads(),
+                "inter_op": tf.config.threading.get_inter_op_parallelism_threads()
+            }
+        except AttributeError:
+            pass
+    return report
+
+
+def format_resource_plan(plan: Dict[str, Any]) -> str:
+    """
+    Human-readable summary of a resource plan
+    """
+    topology = plan["topology"]
+    quota = topology["cgroup_cpu_quota"]
+    lines = [
+        f"CPUs: {len(topology['logical_cpus'])} logical on {len(topology['physical_cores'])} physical cores"
+        + (f", cgroup quota {quota:g}" if quota is not None else "")
+        + f" -> {topology['effective_cpus']} effective",
+        f"Workers: {plan['workers']} x {plan['cpus_per_worker']} CPUs"
+        + (" (OVERSUBSCRIBED: more workers than CPUs)" if plan["oversubscribed"] else ""),
+        f"Model inferences per worker: {plan['model_concurrency']}"
+    ]
+    for index, slot in enumerate(plan["slots"]):
+        threads = slot["threads"]
+        cpus = ",".join(str(cpu) for cpu in slot["cpus"]) if slot["cpus"] else "any"
+        lines.append(f"  worker {index}: cpus {cpus}, intra-op {threads['intra_op']}, "
+                     f"inter-op {threads['inter_op']}, opencv {threads['opencv']}")
+    return "\n".join(lines)
 
 
 def generate_default_config(output_path: str = None):
@@ -273,6 +709,7 @@ if __name__ == "__main__":
     parser.add_argument("--output", help="Output path for generated configuration")
     parser.add_argument("--validate", action="store_true", help="Validate existing configuration")
     parser.add_argument("--config", help="Path to configuration file")
+    parser.add_argument("--resources", action="store_true", help="Show the per-worker CPU and thread layout")
     
     args = parser.parse_args()
     
@@ -289,4 +726,9 @@ if __name__ == "__main__":
         logger.info("Configuration validation successful")
         logger.info(f"Server will run on {config.get_server_config()['host']}:{config.get_server_config()['port']}")
         logger.info(f"API key required: {config.get_api_config()['require_api_key']}")
-        logger.info(f"Using GPU: {config.get_models_config()['use_gpu']}")
\ No newline at end of file
+        logger.info(f"Using GPU: {config.get_models_config()['use_gpu']}")
+    
+    if args.resources:
+        config = ServerConfig(args.config)
+        load_environment_variables(config)
+        print(format_resource_plan(plan_resources(config)))
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Asynchronous Jobs for AI-PsychDoodle-Analyzer
+Bounded in-process job queue with worker tasks, result TTL and server-sent events
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from api.responses import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Job states; SUCCEEDED and FAILED are final
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINAL_STATES = (SUCCEEDED, FAILED)
+
+
+class JobQueueFull(Exception):
+    """
+    Raised when a job is submitted while the queue is at capacity
+    """
+    pass
+
+
+class Job:
+    """
+    One submitted job and its current state
+    """
+
+    def __init__(self, job_id: str, kind: str, payload: Any = None):
+        """
+        Initialize the job
+
+        Args:
+            job_id: Job identifier
+            kind: Job type (e.g. "doodle-analysis")
+            payload: Handler input; dropped once the job has finished
+        """
+        self.job_id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINAL_STATES
+
+    def _notify(self):
+        # Wake up current waiters and give later ones a fresh event
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Job state as a JSON-serializable dictionary
+        """
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error
+        }
+
+
+class JobManager:
+    """
+    Runs submitted jobs on a fixed number of worker tasks.
+
+    The queue is bounded, so submit() fails fast with JobQueueFull instead of
+    accepting more work than the workers can finish. Handlers are blocking
+    functions and run on a thread pool (or through a runner such as
+    LaneScheduler.run), keeping the event loop free to accept submissions,
+    answer polls and stream events while a job is running. Finished jobs are
+    kept for result_ttl seconds.
+
+    Jobs live in the worker process that accepted them. When state_dir is
+    set (e.g. a directory shared by all gunicorn workers), every state change
+    is also written there, so any worker can answer polls and event streams.
+    The state records the owner's pid: unfinished jobs of a process that is
+    gone are reported as failed, so the processes must share a host.
+    """
+
+    def __init__(self, handlers: Dict[str, Callable[[Any], Any]], workers: int = 2,
+                 max_queue: int = 64, result_ttl: float = 600.0,
+                 state_dir: Optional[str] = None, poll_interval: float = 0.5,
+                 on_change: Optional[Callable[[str, str], None]] = None,
+                 runner: Optional[Callable[[Callable[[Any], Any], Any], Awaitable[Any]]] = None):
+        """
+        Initialize the manager
+
+        Args:
+            handlers: Blocking handler per job kind, returning a
+                JSON-serializable result
+            workers: Number of jobs processed concurrently
+            max_queue: Maximum number of jobs waiting to start
+            result_ttl: Seconds finished jobs are kept
+            state_dir: Directory for job state shared between processes
+                (optional)
+            poll_interval: Seconds between checks of jobs owned by other
+                processes while streaming their events
+            on_change: Called with (kind, status) on every state change
+                (e.g. to export metrics)
+            runner: Coroutine function called with (handler, payload) to run
+                a job (defaults to the manager's own thread pool)
+        """
+        self.handlers = handlers
+        self.workers = workers
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self.state_dir = state_dir
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+        self.runner = runner
+
+        self._jobs: Dict[str, Job] = {}
+        self._expiry: Deque[Tuple[float, str]] = deque()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """
+        Start the worker tasks (must be called from the running event loop,
+        e.g. in a startup handler)
+        """
+        if self.running:
+            return
+        self._remove_stale_state()
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        if self.runner is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job-worker")
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        Cancel the worker tasks; queued and running jobs are abandoned
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    @property
+    def full(self) -> bool:
+        return self.queue_depth() >= self.max_queue
+
+    def queue_depth(self) -> int:
+        """
+        Number of jobs waiting to start
+        """
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, kind: str, payload: Any) -> Job:
+        """
+        Queue a job
+
+        Args:
+            kind: Job type (a key of handlers)
+            payload: Handler input
+
+        Returns:
+            The queued job
+
+        Raises:
+            JobQueueFull: If the queue is at capacity
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if not self.running:
+            self.start()
+        self._expire()
+
+        job = Job(uuid.uuid4().hex, kind, payload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"Job queue is full ({self.max_queue} jobs waiting)") from None
+        self._jobs[job.job_id] = job
+        self._changed(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Current state of a job
+
+        Args:
+            job_id: Job identifier
+
+        Returns:
+            Job state dictionary (see Job.to_dict), or None if the job is
+            unknown or has expired
+        """
+        self._expire()
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self._load(job_id)
+
+    async def events(self, job_id: str, keepalive: float = 15.0) -> AsyncIterator[str]:
+        """
+        Stream a job's state changes as server-sent events
+
+        A "status" event is sent for the current state and every change, and
+        a final "result" event with the complete job state once it has
+        finished. Comment lines are sent while nothing changes so proxies
+        keep the connection open.
+
+        Args:
+            job_id: Job identifier
+            keepalive: Seconds between keep-alive comments
+        """
+        last_status = None
+        last_sent = time.monotonic()
+        while True:
+            job = self._jobs.get(job_id)
+            state = job.to_dict() if job is not None else self._load(job_id)
+            if state is None:
+                yield _sse("error", {"job_id": job_id, "error": "Job not found"})
+                return
+            if state["status"] in FINAL_STATES:
+                yield _sse("result", state)
+                return
+            if state["status"] != last_status:
+                last_status = state["status"]
+                last_sent = time.monotonic()
+                yield _sse("status", {k: state[k] for k in ("job_id", "status", "created_at", "started_at")})
+
+            # Wait for a local state change, or poll the shared state of jobs
+            # owned by other processes
+            if job is not None:
+                try:
+                    await asyncio.wait_for(job._changed.wait(), timeout=keepalive)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(self.poll_interval, keepalive))
+                if time.monotonic() - last_sent < keepalive:
+                    continue
+            last_sent = time.monotonic()
+            yield ": keepalive\n\n"
+
+    async def _worker(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            job = await self._queue.get()
+            try:
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._changed(job)
+                try:
+                    handler = self.handlers[job.kind]
+                    if self.runner is not None:
+                        job.result = await self.runner(handler, job.payload)
+                    else:
+                        job.result = await loop.run_in_executor(self._executor, handler, job.payload)
+                    job.status = SUCCEEDED
+                except Exception as e:
+                    logger.warning(f"Job {job.job_id} ({job.kind}) failed: {e}")
+                    job.error = str(e)
+                    job.status = FAILED
+                job.finished_at = time.time()
+                job.payload = None
+                self._expiry.append((job.finished_at + self.result_ttl, job.job_id))
+                self._changed(job)
+            finally:
+                self._queue.task_done()
+
+    def _changed(self, job: Job):
+        job._notify()
+        self._store(job)
+        if self.on_change is not None:
+            self.on_change(job.kind, job.status)
+
+    def _expire(self):
+        """
+        Drop finished jobs whose TTL has passed
+        """
+        now = time.time()
+        while self._expiry and self._expiry[0][0] <= now:
+            _, job_id = self._expiry.popleft()
+            self._jobs.pop(job_id, None)
+            if self.state_dir:
+                try:
+                    os.remove(self._state_path(job_id))
+                except OSError:
+                    pass
+
+    def _remove_stale_state(self):
+        """
+        Remove shared state files older than the TTL (e.g. left behind by
+        processes that exited before their jobs expired)
+        """
+        if not self.state_dir:
+            return
+        cutoff = time.time() - self.result_ttl
+        for name in os.listdir(self.state_dir):
+            path = os.path.join(self.state_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _state_path(self, job_id: str) -> str:
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _store(self, job: Job):
+        """
+        Write a job's state to the shared state directory (atomically, so
+        readers never see a partial file)
+        """
+        if not self.state_dir:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(dumps(dict(job.to_dict(), owner_pid=os.getpid())))
+            os.replace(tmp_path, self._state_path(job.job_id))
+        except OSError as e:
+            logger.warning(f"Could not store state of job {job.job_id}: {e}")
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Read the state of a job owned by another process
+        """
+        if not self.state_dir or not _is_job_id(job_id):
+            return None
+        path = self._state_path(job_id)
+        try:
+            with open(path, "rb") as f:
+                state = loads(f.read())
+            stored_at = os.path.getmtime(path)
+        except (OSError, ValueError):
+            return None
+        owner_pid = state.pop("owner_pid", None)
+        if state["status"] not in FINAL_STATES and owner_pid is not None and not _process_alive(owner_pid):
+            # The owner exited (or was killed) before finishing the job
+            state.update(status=FAILED, finished_at=stored_at,
+                         error=f"Worker process {owner_pid} exited before the job finished")
+        finished_at = state.get("finished_at")
+        if finished_at is not None and finished_at + self.result_ttl <= time.time():
+            return None
+        return state
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _is_job_id(job_id: str) -> bool:
+    return len(job_id) == 32 and all(c in "0123456789abcdef" for c in job_id)
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """
+    Format one server-sent event
+    """
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Prometheus Metrics for AI-PsychDoodle-Analyzer
+Exports per-stage latency histograms, in-flight gauges, cache and model-path counters
+
+Under gunicorn the metrics are aggregated across workers with
+prometheus_client's multiprocess mode: gunicorn_conf.py sets
+PROMETHEUS_MULTIPROC_DIR before any worker imports prometheus_client.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+from utils.stage_timing import StageObserver, add_stage_observer
+
+try:
+    from prometheus_client import (Counter, Gauge, Histogram, CollectorRegistry,
+                                   CONTENT_TYPE_LATEST, REGISTRY, generate_latest)
+    from prometheus_client import multiprocess
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets covering cheap OpenCV passes up to slow model transforms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+if PROMETHEUS_AVAILABLE:
+    REQUEST_DURATION = Histogram(
+        "psychdoodle_request_duration_seconds",
+        "End-to-end request latency",
+        ["endpoint", "status"],
+        buckets=LATENCY_BUCKETS
+    )
+    REQUESTS_IN_FLIGHT = Gauge(
+        "psychdoodle_requests_in_flight",
+        "Requests currently being processed",
+        ["endpoint"],
+        multiprocess_mode="livesum"
+    )
+    STAGE_DURATION = Histogram(
+        "psychdoodle_stage_duration_seconds",
+        "Latency of individual pipeline stages",
+        ["stage"],
+        buckets=LATENCY_BUCKETS
+    )
+    STAGES_IN_FLIGHT = Gauge(
+        "psychdoodle_stages_in_flight",
+        "Pipeline stages currently executing",
+        ["stage"],
+        multiprocess_mode="livesum"
+    )
+    STAGE_ERRORS = Counter(
+        "psychdoodle_stage_errors_total",
+        "Pipeline stages that raised an exception",
+        ["stage"]
+    )
+    REQUESTS_REJECTED = Counter(
+        "psychdoodle_requests_rejected_total",
+        "Requests rejected before processing (429 rate limited, 503 shed under overload)",
+        ["endpoint", "status"]
+    )
+    CACHE_REQUESTS = Counter(
+        "psychdoodle_cache_requests_total",
+        "Cache lookups by result (hit ratio = hit / (hit + miss))",
+        ["cache", "result"]
+    )
+    ANALYSIS_PATH = Counter(
+        "psychdoodle_analysis_path_total",
+        "Analyses served by the trained model or the heuristic fallback",
+        ["component", "path"]
+    )
+    ANALYSIS_RESOLUTION = Counter(
+        "psychdoodle_analysis_resolution_total",
+        "Analyses by the resolution they finished at (coarse-to-fine early exit)",
+        ["component", "resolution"]
+    )
+    SCHEDULER_QUEUE_TIME = Histogram(
+        "psychdoodle_scheduler_queue_seconds",
+        "Time requests waited in a scheduler lane before starting",
+        ["lane"],
+        buckets=LATENCY_BUCKETS
+    )
+    SCHEDULER_QUEUED = Gauge(
+        "psychdoodle_scheduler_queued",
+        "Requests currently waiting in a scheduler lane",
+        ["lane"],
+        multiprocess_mode="livesum"
+    )
+    JOB_TRANSITIONS = Counter(
+        "psychdoodle_jobs_total",
+        "Asynchronous job state changes (queue depth = queued - running)",
+        ["kind", "status"]
+    )
+
+
+class PrometheusStageObserver(StageObserver):
+    """
+    Records every pipeline stage in the stage latency histogram
+    """
+
+    def on_stage_start(self, name: str):
+        STAGES_IN_FLIGHT.labels(stage=name).inc()
+
+    def on_stage_end(self, name: str, duration: float, error: bool = False):
+        STAGES_IN_FLIGHT.labels(stage=name).dec()
+        STAGE_DURATION.labels(stage=name).observe(duration)
+        if error:
+            STAGE_ERRORS.labels(stage=name).inc()
+
+
+def is_multiprocess() -> bool:
+    """
+    Check whether metrics are collected in prometheus multiprocess mode
+    """
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR") or
+                os.environ.get("prometheus_multiproc_dir"))
+
+
+def setup_metrics(monitoring_config: dict) -> bool:
+    """
+    Enable stage metrics according to the monitoring configuration
+
+    Args:
+        monitoring_config: The "monitoring" section of the server configuration
+
+    Returns:
+        True if metrics are being collected
+    """
+    if not PROMETHEUS_AVAILABLE:
+        return False
+    if not (monitoring_config.get("enabled", True) and
+            monitoring_config.get("prometheus_enabled", True)):
+        return False
+
+    add_stage_observer(PrometheusStageObserver())
+    return True
+
+
+@contextmanager
+def track_request(endpoint: str):
+    """
+    Track latency and concurrency of a request
+
+    Args:
+        endpoint: Endpoint label (e.g. "/doodle-analysis")
+    """
+    if not PROMETHEUS_AVAILABLE:
+        yield
+        return
+
+    REQUESTS_IN_FLIGHT.labels(endpoint=endpoint).inc()
+    start = time.perf_counter()
+    status = "success"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        REQUESTS_IN_FLIGHT.labels(endpoint=endpoint).dec()
+        REQUEST_DURATION.labels(endpoint=endpoint, status=status).observe(time.perf_counter() - start)
+
+
+def record_rejected_request(endpoint: str, status: int):
+    """
+    Count a request rejected by the rate limiter or load shedding
+
+    Args:
+        endpoint: Endpoint label (a known route, never a raw request path)
+        status: HTTP status of the rejection (429 or 503)
+    """
+    if PROMETHEUS_AVAILABLE:
+        REQUESTS_REJECTED.labels(endpoint=endpoint, status=str(status)).inc()
+
+
+def record_cache_access(cache: str, hit: bool, count: int = 1):
+    """
+    Count cache lookups
+
+    Args:
+        cache: Cache name
+        hit: Whether the lookups were hits
+        count: Number of lookups
+    """
+    if PROMETHEUS_AVAILABLE and count > 0:
+        CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc(count)
+
+
+def record_analysis_path(component: str, model_loaded: bool):
+    """
+    Count whether a component used its trained model or the heuristic fallback
+
+    Args:
+        component: Component name (e.g. "shape_analyzer", "gaugan_adapter")
+        model_loaded: Whether the trained model was used
+    """
+    if PROMETHEUS_AVAILABLE:
+        ANALYSIS_PATH.labels(component=component,
+                             path="model" if model_loaded else "heuristic").inc()
+
+
+def record_analysis_resolution(component: str, resolution: int):
+    """
+    Count the resolution a coarse-to-fine analysis finished at
+
+    Args:
+        component: Component name (e.g. "drawing_analyzer")
+        resolution: Analysis resolution in pixels
+    """
+    if PROMETHEUS_AVAILABLE:
+        ANALYSIS_RESOLUTION.labels(component=component, resolution=str(resolution)).inc()
+
+
+def record_lane_queue_change(lane: str, delta: int):
+    """
+    Track the number of requests waiting in a scheduler lane
+
+    Args:
+        lane: Lane name (e.g. "interactive")
+        delta: +1 when a request starts waiting, -1 when it stops
+    """
+    if PROMETHEUS_AVAILABLE:
+        SCHEDULER_QUEUED.labels(lane=lane).inc(delta)
+
+
+def record_lane_queue_time(lane: str, seconds: float):
+    """
+    Record how long a request waited in a scheduler lane
+
+    Args:
+        lane: Lane name
+        seconds: Time from queueing to start
+    """
+    if PROMETHEUS_AVAILABLE:
+        SCHEDULER_QUEUE_TIME.labels(lane=lane).observe(seconds)
+
+
+def record_job_state(kind: str, status: str):
+    """
+    Count an asynchronous job entering a state
+
+    Args:
+        kind: Job type (e.g. "doodle-analysis")
+        status: New job status (queued, running, succeeded or failed)
+    """
+    if PROMETHEUS_AVAILABLE:
+        JOB_TRANSITIONS.labels(kind=kind, status=status).inc()
+
+
+def collect_metrics() -> bytes:
+    """
+    Render all metrics in the Prometheus text format, aggregated across
+    worker processes when running in multiprocess mode
+    """
+    if not PROMETHEUS_AVAILABLE:
+        return b""
+
+    if is_multiprocess():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+
+    return generate_latest(REGISTRY)
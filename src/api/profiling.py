@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Request Profiling for AI-PsychDoodle-Analyzer
+Server-Timing headers from pipeline stages and opt-in sampled profiles of single requests
+
+Profiles are written as collapsed stacks (for flamegraph.pl, inferno and
+most flame graph viewers) and in the speedscope JSON format
+(https://www.speedscope.app).
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import asyncio
+import threading
+import contextvars
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from utils.stage_timing import StageObserver, add_stage_observer
+
+# Stage timings of the current request (None when they are not collected)
+_timings: contextvars.ContextVar = contextvars.ContextVar("stage_timings", default=None)
+
+# Sampling profile of the current request (None unless requested)
+_profile: contextvars.ContextVar = contextvars.ContextVar("sampling_profile", default=None)
+
+# Pseudo-frame for samples taken while none of the request's threads was
+# running pipeline code (waiting in a scheduler lane, or on the event loop)
+WAITING_FRAME = "(waiting)"
+
+PROFILE_FORMATS = ("collapsed", "speedscope")
+PROFILE_EXTENSIONS = {"collapsed": ".collapsed.txt", "speedscope": ".speedscope.json"}
+
+_TOKEN_INVALID = re.compile(r"[^A-Za-z0-9!#$%&'*+.^_`|~-]")
+
+
+class ServerTimingObserver(StageObserver):
+    """
+    Collects the stages of the current request for its Server-Timing header
+    """
+
+    def on_stage_end(self, name: str, duration: float, error: bool = False):
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((name, duration))
+
+
+def record_timing(name: str, duration: float):
+    """
+    Add a duration measured outside any stage (e.g. queueing) to the
+    current request's Server-Timing header
+    """
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, duration))
+
+
+def format_server_timing(timings: Iterable[Tuple[str, float]], total: Optional[float] = None) -> str:
+    """
+    Format stage timings as a Server-Timing header value
+
+    Repeated stages are summed; nested stages are listed separately (their
+    durations overlap their parents').
+
+    Args:
+        timings: (stage name, seconds) pairs in the order they finished
+        total: Duration of the whole request (seconds)
+
+    Returns:
+        e.g. "decode;dur=3.1, segmentation;dur=12.4, total;dur=20.0"
+    """
+    durations: Dict[str, float] = {}
+    for name, duration in timings:
+        name = _TOKEN_INVALID.sub("_", name)
+        durations[name] = durations.get(name, 0.0) + duration
+    if total is not None:
+        durations["total"] = total
+    return ", ".join(f"{name};dur={duration * 1000:.1f}" for name, duration in durations.items())
+
+
+def run_profiled(fn, *args):
+    """
+    Run a pipeline function, sampling its thread if the request is profiled
+
+    Call this on the thread that runs the work (e.g. through the scheduler);
+    frames above it (thread pool machinery) are left out of the profile.
+    """
+    profile = _profile.get()
+    if profile is None:
+        return fn(*args)
+    thread_id = threading.get_ident()
+    profile.threads.add(thread_id)
+    try:
+        return fn(*args)
+    finally:
+        profile.threads.discard(thread_id)
+
+
+_ROOT_CODE = run_profiled.__code__
+
+
+class SamplingProfile:
+    """
+    Statistical profile of one request.
+
+    A sampler thread periodically captures the Python stacks of the
+    threads currently running the request's pipeline functions. Each
+    sample is weighted by the time since the previous one.
+    """
+
+    def __init__(self, interval: float = 0.005, max_seconds: float = 60.0, name: str = ""):
+        """
+        Initialize the profile
+
+        Args:
+            interval: Seconds between samples
+            max_seconds: Stop sampling after this long
+            name: Description (e.g. "POST /doodle-analysis")
+        """
+        self.profile_id = uuid.uuid4().hex
+        self.name = name
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.threads = set()
+        self.samples: List[Tuple[Tuple[Any, ...], float]] = []
+        self.started_at = None
+        self.duration = 0.0
+        self._start = None
+        self._last = None
+        self._active = False
+
+    def start(self):
+        self.started_at = time.time()
+        self._start = self._last = time.perf_counter()
+        self._active = True
+        _sampler.add(self)
+
+    def stop(self):
+        if self._active:
+            self._active = False
+            self.duration = time.perf_counter() - self._start
+            _sampler.remove(self)
+
+    def sample(self, frames: Dict[int, Any], now: float):
+        """
+        Record the current stacks of the request's threads (sampler thread)
+        """
+        if now - self._start > self.max_seconds:
+            self.stop()
+            return
+        weight = now - self._last
+        self._last = now
+        stacks = [_stack(frames[thread_id]) for thread_id in list(self.threads) if thread_id in frames]
+        if not stacks:
+            stacks = [(WAITING_FRAME,)]
+        for stack in stacks:
+            self.samples.append((stack, weight))
+
+    def collapsed(self) -> str:
+        """
+        Collapsed stack lines ("frame;frame;frame count"), one per distinct stack
+        """
+        counts = Counter(";".join(_label(frame).replace(";", ":") for frame in stack)
+                         for stack, _ in self.samples)
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+    def speedscope(self) -> Dict[str, Any]:
+        """
+        Profile in the speedscope file format (samples in time order)
+        """
+        frames: List[Dict[str, Any]] = []
+        index: Dict[Any, int] = {}
+        samples = []
+        for stack, _ in self.samples:
+            indices = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append(_frame_info(frame))
+                indices.append(index[frame])
+            samples.append(indices)
+        weights = [weight for _, weight in self.samples]
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "psychdoodle-profiler",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": self.name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights
+            }]
+        }
+
+    def save(self, output_dir: str, formats: Iterable[str] = PROFILE_FORMATS) -> List[str]:
+        """
+        Write the profile files
+
+        Args:
+            output_dir: Directory for the files (created if missing)
+            formats: Any of "collapsed" and "speedscope"
+
+        Returns:
+            Paths of the written files
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        paths = []
+        for profile_format in formats:
+            path = profile_path(output_dir, self.profile_id, profile_format)
+            if profile_format == "collapsed":
+                content = self.collapsed()
+            else:
+                content = json.dumps(self.speedscope())
+            with open(path, "w") as f:
+                f.write(content)
+            paths.append(path)
+        return paths
+
+
+def _stack(frame) -> Tuple[Any, ...]:
+    """
+    Code objects of a thread's stack, outermost first, starting below
+    run_profiled
+    """
+    codes = []
+    while frame is not None:
+        code = frame.f_code
+        if code is _ROOT_CODE:
+            break
+        codes.append(code)
+        frame = frame.f_back
+    codes.reverse()
+    return tuple(codes)
+
+
+def _label(frame) -> str:
+    if isinstance(frame, str):
+        return frame
+    return f"{frame.co_name} ({os.path.basename(frame.co_filename)}:{frame.co_firstlineno})"
+
+
+def _frame_info(frame) -> Dict[str, Any]:
+    if isinstance(frame, str):
+        return {"name": frame}
+    return {"name": frame.co_name, "file": frame.co_filename, "line": frame.co_firstlineno}
+
+
+def profile_path(output_dir: str, profile_id: str, profile_format: str) -> str:
+    """
+    File of a stored profile
+    """
+    return os.path.join(output_dir, profile_id + PROFILE_EXTENSIONS[profile_format])
+
+
+class _Sampler:
+    """
+    Process-wide sampler thread, running while any profile is active
+    """
+
+    def __init__(self):
+        self._profiles = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, profile: SamplingProfile):
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: SamplingProfile):
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                profiles = list(self._profiles)
+            time.sleep(min(profile.interval for profile in profiles))
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            for profile in profiles:
+                if profile._active:
+                    profile.sample(frames, now)
+            del frames
+
+
+_sampler = _Sampler()
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that adds a Server-Timing header with the pipeline
+    stage durations to every response, and profiles requests that ask for
+    it with an "X-Profile: 1" header or a "profile=1" query parameter and
+    carry an admin API key.
+
+    A profiled response has an X-Profile-Id header naming the stored
+    profile files. Work queued as asynchronous jobs is not profiled.
+    """
+
+    def __init__(self, app, server_timing: bool = True, admin_keys: Iterable[str] = (),
+                 sample_hz: float = 200.0, max_seconds: float = 60.0,
+                 output_dir: str = "data/profiles", formats: Iterable[str] = PROFILE_FORMATS):
+        """
+        Initialize the middleware
+
+        Args:
+            app: ASGI application
+            server_timing: Add Server-Timing headers
+            admin_keys: API keys allowed to request profiles (none: disabled)
+            sample_hz: Stack samples per second of a profiled request
+            max_seconds: Longest time a request is sampled
+            output_dir: Directory for the profile files
+            formats: Profile file formats ("collapsed", "speedscope")
+        """
+        self.app = app
+        self.server_timing = server_timing
+        self.admin_keys = set(admin_keys)
+        self.interval = 1.0 / sample_hz
+        self.max_seconds = max_seconds
+        self.output_dir = output_dir
+        self.formats = [profile_format for profile_format in formats if profile_format in PROFILE_FORMATS]
+        if server_timing:
+            add_stage_observer(ServerTimingObserver())
+
+    def _profile_requested(self, scope) -> bool:
+        headers = dict(scope["headers"])
+        requested = headers.get(b"x-profile", b"").strip() in (b"1", b"true")
+        if not requested and scope.get("query_string"):
+            values = parse_qs(scope["query_string"].decode("latin-1")).get("profile", [])
+            requested = any(value in ("1", "true") for value in values)
+        api_key = headers.get(b"x-api-key")
+        return requested and api_key is not None and api_key.decode("latin-1") in self.admin_keys
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = None
+        if self.admin_keys and self.formats and self._profile_requested(scope):
+            profile = SamplingProfile(self.interval, self.max_seconds,
+                                      name=f"{scope['method']} {scope['path']}")
+        if profile is None and not self.server_timing:
+            await self.app(scope, receive, send)
+            return
+
+        timings = [] if self.server_timing else None
+        timings_token = _timings.set(timings)
+        profile_token = _profile.set(profile)
+        start = time.perf_counter()
+        if profile is not None:
+            profile.start()
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                extra_headers = []
+                if timings is not None:
+                    value = format_server_timing(timings, time.perf_counter() - start)
+                    extra_headers.append((b"server-timing", value.encode("latin-1")))
+                if profile is not None:
+                    profile.stop()
+                    extra_headers.append((b"x-profile-id", profile.profile_id.encode("latin-1")))
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + extra_headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _timings.reset(timings_token)
+            _profile.reset(profile_token)
+            if profile is not None:
+                profile.stop()
+                await asyncio.get_event_loop().run_in_executor(
+                    None, profile.save, self.output_dir, self.formats)
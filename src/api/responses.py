@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Fast JSON Serialization for AI-PsychDoodle-Analyzer
+orjson-backed request parsing and responses, and streamed base64 image fields
+"""
+
+import base64
+import json
+from typing import Any, Callable, Dict, Iterator
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Raw bytes per streamed base64 chunk (multiple of 3 so chunks concatenate cleanly)
+STREAM_CHUNK_BYTES = 3 * 64 * 1024
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Serialize content to compact JSON bytes
+
+    numpy scalars and arrays are serialized natively when orjson is installed.
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes) -> Any:
+    """
+    Parse JSON bytes
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response rendered with orjson (falls back to the stdlib encoder).
+
+    Returning a Response from an endpoint bypasses FastAPI's response_model
+    validation, so endpoints should only use it for content they built
+    themselves from trusted internal objects.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class StreamedBase64JSONResponse(Response):
+    """
+    JSON response whose largest field is base64-encoded from raw bytes while
+    the body is being written, instead of first building one large Python
+    string for the encoded image and a second one for the JSON document.
+
+    The body is produced in chunks of at most STREAM_CHUNK_BYTES of input, and
+    the exact Content-Length is known up front, so no chunked transfer
+    encoding is needed.
+    """
+
+    media_type = "application/json"
+
+    def __init__(self, content: Dict[str, Any], field: str, data: bytes,
+                 prefix: str = "", status_code: int = 200, headers: Dict[str, str] = None):
+        """
+        Initialize the response
+
+        Args:
+            content: JSON fields other than the streamed one
+            field: Name of the streamed field
+            data: Raw bytes to base64-encode into the field
+            prefix: Text placed before the base64 data (e.g. a data URI prefix)
+            status_code: HTTP status code
+            headers: Additional response headers
+        """
+        super().__init__(content=None, status_code=status_code, headers=headers,
+                         media_type=self.media_type)
+        self.head, self.data, self.tail = self._split(content, field, prefix, data)
+        encoded_length = 4 * ((len(self.data) + 2) // 3)
+        self.headers["content-length"] = str(len(self.head) + encoded_length + len(self.tail))
+
+    @staticmethod
+    def _split(content: Dict[str, Any], field: str, prefix: str, data: bytes):
+        document = dumps({k: v for k, v in content.items() if k != field})
+        separator = b"," if len(document) > 2 else b""
+        head = document[:-1] + separator + dumps(field) + b":" + dumps(prefix)[:-1]
+        return head, data, b'"}'
+
+    def iter_body(self) -> Iterator[bytes]:
+        """
+        Iterate over the body chunks
+        """
+        yield self.head
+        view = memoryview(self.data)
+        for offset in range(0, len(view), STREAM_CHUNK_BYTES):
+            yield base64.b64encode(view[offset:offset + STREAM_CHUNK_BYTES])
+        yield self.tail
+
+    async def __call__(self, scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers
+        })
+        for chunk in self.iter_body():
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class FastJSONRequest(Request):
+    """
+    Request whose JSON body is parsed with orjson
+    """
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = loads(await self.body())
+        return self._json
+
+
+class FastJSONRoute(APIRoute):
+    """
+    Route class that parses request bodies with FastJSONRequest.
+
+    Request models are still validated by pydantic; only the JSON decoding of
+    the (mostly base64) body is replaced.
+    """
+
+    def get_route_handler(self) -> Callable:
+        original_handler = super().get_route_handler()
+
+        async def handler(request: Request) -> Response:
+            return await original_handler(FastJSONRequest(request.scope, request.receive))
+
+        return handler
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Request Scheduler for AI-PsychDoodle-Analyzer
+Weighted fair sharing of pipeline threads between request lanes
+"""
+
+import time
+import asyncio
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+# Smoothing factor of the per-lane job duration estimate
+COST_EWMA_ALPHA = 0.2
+
+
+class LaneQueueFull(Exception):
+    """
+    Raised when a job is submitted to a lane whose queue is at capacity
+    """
+    pass
+
+
+class Lane:
+    """
+    Queue and accounting of one class of work
+    """
+
+    def __init__(self, name: str, weight: float = 1.0, max_concurrency: int = 1,
+                 max_queue: int = 64, initial_cost: float = 0.01):
+        """
+        Initialize the lane
+
+        Args:
+            name: Lane name (e.g. "interactive")
+            weight: Share of worker time relative to the other lanes
+            max_concurrency: Maximum jobs of this lane running at once
+            max_queue: Maximum jobs of this lane waiting to start
+            initial_cost: Job duration estimate (seconds) before the first
+                job has finished
+        """
+        self.name = name
+        self.weight = float(weight)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.cost = initial_cost
+        self.running = 0
+        self.waiting: Deque[Tuple[asyncio.Future, float]] = deque()
+        # Virtual finish time of the lane's dispatched work (stride scheduling)
+        self.virtual_time = 0.0
+
+    @property
+    def dispatchable(self) -> bool:
+        return bool(self.waiting) and self.running < self.max_concurrency
+
+    @property
+    def full(self) -> bool:
+        return len(self.waiting) >= self.max_queue
+
+    def backlog_seconds(self) -> float:
+        """
+        Estimated time until a newly queued job would start
+        """
+        return len(self.waiting) * self.cost / max(1, self.max_concurrency)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "weight": self.weight,
+            "max_concurrency": self.max_concurrency,
+            "running": self.running,
+            "queued": len(self.waiting),
+            "cost_estimate": self.cost
+        }
+
+
+class LaneScheduler:
+    """
+    Runs blocking pipeline functions on a shared thread pool, dispatching
+    waiting jobs from several lanes by weighted fair sharing.
+
+    Each lane is charged its estimated job duration divided by its weight
+    whenever one of its jobs starts, and the free thread goes to the waiting
+    lane that has been charged least, so lanes share worker time in
+    proportion to their weights however expensive their individual jobs are.
+    Per-lane concurrency limits additionally keep some threads available for
+    cheap interactive work while expensive jobs are running.
+
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, lanes: Dict[str, Dict[str, Any]], max_workers: int = 4,
+                 on_queue_change: Optional[Callable[[str, int], None]] = None,
+                 on_dispatch: Optional[Callable[[str, float], None]] = None):
+        """
+        Initialize the scheduler
+
+        Args:
+            lanes: Lane settings by name (keyword arguments of Lane)
+            max_workers: Total number of jobs running at once
+            on_queue_change: Called with (lane, +1/-1) when a job starts or
+                stops waiting
+            on_dispatch: Called with (lane, seconds waited) when a job starts
+        """
+        self.lanes = {name: Lane(name, **settings) for name, settings in lanes.items()}
+        self.max_workers = max_workers
+        self.on_queue_change = on_queue_change
+        self.on_dispatch = on_dispatch
+
+        self._running = 0
+        self._virtual_time = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline")
+
+    async def run(self, lane_name: str, fn: Callable, *args) -> Any:
+        """
+        Run a blocking function in a lane once the scheduler grants it a thread
+
+        The caller's context variables are copied to the worker thread.
+
+        Args:
+            lane_name: Lane to queue the job in
+            fn: Function to run
+            *args: Positional arguments for fn
+
+        Returns:
+            The function's result
+
+        Raises:
+            LaneQueueFull: If the lane's queue is at capacity
+        """
+        lane = self.lanes[lane_name]
+        loop = asyncio.get_event_loop()
+        if lane.full:
+            raise LaneQueueFull(f"Lane {lane_name} is full ({lane.max_queue} requests waiting)")
+
+        entry = (loop.create_future(), time.perf_counter())
+        lane.waiting.append(entry)
+        self._queue_changed(lane, 1)
+        self._dispatch()
+        granted = entry[0]
+        try:
+            await granted
+        except asyncio.CancelledError:
+            if granted.done() and not granted.cancelled():
+                # Cancelled after being granted a thread: pass it on
+                self._finish(lane, None)
+            elif entry in lane.waiting:
+                lane.waiting.remove(entry)
+                self._queue_changed(lane, -1)
+            raise
+
+        context = contextvars.copy_context()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, context.run, fn, *args)
+        finally:
+            self._finish(lane, time.perf_counter() - started)
+
+    def _start(self, lane: Lane, enqueued: float):
+        self._running += 1
+        lane.running += 1
+        # A lane that has been idle cannot claim the time it left unused
+        lane.virtual_time = max(lane.virtual_time, self._virtual_time) + lane.cost / lane.weight
+        if self.on_dispatch is not None:
+            self.on_dispatch(lane.name, time.perf_counter() - enqueued)
+
+    def _finish(self, lane: Lane, duration: Optional[float]):
+        self._running -= 1
+        lane.running -= 1
+        if duration is not None:
+            lane.cost += COST_EWMA_ALPHA * (duration - lane.cost)
+        self._dispatch()
+
+    def _dispatch(self):
+        """
+        Hand free threads to the waiting lanes that have been charged least
+        """
+        while self._running < self.max_workers:
+            candidates = [lane for lane in self.lanes.values() if lane.dispatchable]
+            if not candidates:
+                return
+            lane = min(candidates, key=lambda l: max(l.virtual_time, self._virtual_time))
+            granted, enqueued = lane.waiting.popleft()
+            self._queue_changed(lane, -1)
+            if granted.done():
+                continue
+            self._virtual_time = max(lane.virtual_time, self._virtual_time)
+            self._start(lane, enqueued)
+            granted.set_result(None)
+
+    def _queue_changed(self, lane: Lane, delta: int):
+        if self.on_queue_change is not None:
+            self.on_queue_change(lane.name, delta)
+
+    def shutdown(self):
+        """
+        Stop the worker threads once running jobs have finished
+        """
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Running and queued jobs per lane
+        """
+        return {
+            "max_workers": self.max_workers,
+            "running": self._running,
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()}
+        }
@@ -5,41 +5,171 @@ Provides endpoints for drawing analysis and doodle transformation
 """
 
 import os
+import re
+import time
 import uuid
 import json
 import base64
-from typing import Dict, Any, List, Optional
+import asyncio
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
-from fastapi import FastAPI, File, UploadFile, Form, Query, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, Query, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "deployment", "server"
+))
 
 from models.shape_analyzer import ShapeAnalyzer
-from models.drawing_analyzer import DrawingAnalyzer
+from models.drawing_analyzer import DrawingAnalyzer, DEFAULT_CONFIDENCE_MARGIN
 from models.gaugan_adapter import GauGANAdapter
-from utils.image_processing import decode_base64_image, encode_base64_image
+from models.model_manager import ModelManager
+from utils.image_processing import (decode_base64_image, decode_base64_bytes,
+                                    decode_image_bytes, encode_image,
+                                    negotiate_image_format)
+from utils.image_context import ImageContext
+from utils.buffer_pool import BufferPool, set_buffer_pool
+from utils.emotion_trends import SessionHistoryStore
+from utils.storage import (AsyncBlobWriter, create_storage, content_type_for_key,
+                           extension_for_bytes, is_valid_key)
+from utils.stage_timing import stage
+from utils.tracing import create_tracer, trace_stages, set_span_attribute
+from api.responses import FastJSONResponse, FastJSONRoute, StreamedBase64JSONResponse
+from api.jobs import JobManager, JobQueueFull
+from api.scheduler import LaneScheduler, LaneQueueFull
+from api.rate_limit import SharedTokenBucket, RateLimitMiddleware
+from api.tracing import TracingMiddleware, run_queued
+from api.profiling import (ProfilingMiddleware, run_profiled, profile_path,
+                           PROFILE_EXTENSIONS)
+from api.warmup import warm_up, validate_models, model_status
+from api.metrics import (setup_metrics, track_request, record_cache_access,
+                         record_analysis_path, record_analysis_resolution,
+                         record_lane_queue_change, record_lane_queue_time,
+                         record_rejected_request,
+                         record_job_state, collect_metrics, CONTENT_TYPE_LATEST)
+from server_config import ServerConfig, load_environment_variables, effective_resources
 
 app = FastAPI(title="AI-PsychDoodle-Analyzer API", 
              description="API for analyzing psychological state through drawings",
              version="1.0.0")
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+# Parse request bodies with orjson
+app.router.route_class = FastJSONRoute
+
+# Load server configuration
+server_config = ServerConfig()
+load_environment_variables(server_config)
+
+# Export pipeline metrics to Prometheus
+metrics_enabled = setup_metrics(server_config.get_monitoring_config())
+
+# Reuse per-request image temporaries across requests
+pool_config = server_config.get_buffer_pool_config()
+buffer_pool = BufferPool(
+    max_buffers_per_key=pool_config["max_buffers_per_shape"] if pool_config.get("enabled", True) else 0,
+    max_bytes=int(pool_config["max_megabytes"] * 1024 * 1024),
+    on_acquire=lambda reused: record_cache_access("buffer_pool", reused)
+)
+set_buffer_pool(buffer_pool)
+
+# Initialize models (weight paths in the config are relative to src/)
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+models_config = server_config.get_models_config()
+early_exit_config = models_config.get("drawing_early_exit", {})
+hot_reload_config = models_config.get("hot_reload", {})
+warmup_config = server_config.get_warmup_config()
+
+def resolve_path(path: str) -> str:
+    return path if os.path.isabs(path) else os.path.join(SRC_DIR, path)
+
+heuristics_paths = {
+    analyzer: resolve_path(models_config[f"{analyzer}_heuristics_path"])
+    if models_config.get(f"{analyzer}_heuristics_path") else None
+    for analyzer in ("shape", "drawing")
+}
+
+def create_models(paths: Dict[str, str]) -> Tuple[ShapeAnalyzer, DrawingAnalyzer, GauGANAdapter]:
+    """
+    Construct the analysis components from their weight files
+    """
+    shape_analyzer = ShapeAnalyzer(paths["shape_analyzer"], heuristics_path=heuristics_paths["shape"])
+    drawing_analyzer = DrawingAnalyzer(
+        paths["drawing_analyzer"],
+        pyramid_levels=early_exit_config.get("pyramid_levels") if early_exit_config.get("enabled") else None,
+        confidence_margin=early_exit_config.get("confidence_margin", DEFAULT_CONFIDENCE_MARGIN),
+        on_level_used=lambda size: record_analysis_resolution("drawing_analyzer", size),
+        heuristics_path=heuristics_paths["drawing"]
+    )
+    gaugan_adapter = GauGANAdapter(paths["gaugan_adapter"])
+    return shape_analyzer, drawing_analyzer, gaugan_adapter
+
+def check_models(bundle):
+    """
+    Canary check and warm-up of a newly loaded model bundle before it is
+    swapped in, so its first requests do not pay the one-time costs
+    """
+    validate_models(bundle.shape_analyzer, bundle.drawing_analyzer, bundle.gaugan_adapter)
+    warm_up(bundle.shape_analyzer, bundle.drawing_analyzer, bundle.gaugan_adapter,
+            rounds=warmup_config.get("rounds", 2),
+            shape_size=warmup_config.get("shape_size", 256),
+            doodle_size=warmup_config.get("doodle_size", 512))
+
+model_manager = ModelManager(
+    {
+        "shape_analyzer": resolve_path(models_config["shape_analyzer_path"]),
+        "drawing_analyzer": resolve_path(models_config["drawing_analyzer_path"]),
+        "gaugan_adapter": resolve_path(models_config["gaugan_model_path"])
+    },
+    factory=create_models,
+    canary=check_models,
+    trigger_path=hot_reload_config.get("trigger_path") or None
+)
+
+# Initialize session history with precomputed per-user trend aggregates
+history_config = server_config.get_history_config()
+history_store = SessionHistoryStore(
+    db_path=history_config["database"],
+    emotion_categories={
+        "shape": model_manager.current.shape_analyzer.emotion_categories,
+        "doodle": model_manager.current.drawing_analyzer.emotion_categories
+    },
+    ewma_alpha=history_config["ewma_alpha"],
+    max_daily_rollups=history_config["daily_rollup_days"]
 )
 
-# Initialize models
-shape_analyzer = ShapeAnalyzer()
-drawing_analyzer = DrawingAnalyzer()
-gaugan_adapter = GauGANAdapter()
+# Initialize blob storage for uploaded and generated images
+STORAGE_PRUNE_INTERVAL = 3600  # seconds between retention checks
+storage_config = server_config.get_storage_config()
+blob_writer = None
+if storage_config.get("persist_images", False):
+    try:
+        blob_writer = AsyncBlobWriter(
+            create_storage(storage_config),
+            max_workers=storage_config.get("writer_threads", 2),
+            on_lookup=lambda hit: record_cache_access("blob_storage", hit),
+            max_pending=storage_config.get("max_pending_writes", 256)
+        )
+    except Exception as e:
+        print(f"Warning: Could not initialize {storage_config.get('type')} storage: {e}")
+        print("Generated images will only be returned inline.")
+
+# Schedule pipeline work in lanes, so bursts of doodle transforms cannot
+# delay the interactive shape analysis
+scheduler_config = server_config.get_scheduler_config()
+scheduler = None
+if scheduler_config.get("enabled", True):
+    scheduler = LaneScheduler(
+        scheduler_config["lanes"],
+        max_workers=scheduler_config["max_workers"],
+        on_queue_change=record_lane_queue_change,
+        on_dispatch=record_lane_queue_time
+    )
 
 # API Models
 class ShapeAnalysisRequest(BaseModel):
@@ -47,57 +177,359 @@ class ShapeAnalysisRequest(BaseModel):
     traced_image: str    # base64 encoded image
     response_time: float # in seconds
     shape_type: str      # "triangle", "circle", "square", etc.
+    user_id: Optional[str] = None  # records the analysis in the user's history
 
 class ShapeAnalysisResponse(BaseModel):
     analysis_id: str
     emotional_state: Dict[str, float]  # Emotional states with scores
     feedback: str                      # Textual feedback
     recommendation: str                # Personalized recommendation
+    model_version: str                 # Version of the models that produced the analysis
 
 class DoodleAnalysisRequest(BaseModel):
     doodle_image: str  # base64 encoded doodle
+    user_id: Optional[str] = None  # records the analysis in the user's history
+    image_response: str = "inline" # "inline", "reference" or "both"
+    image_accept: Optional[str] = None  # e.g. "image/webp,image/jpeg;q=0.8"
+    image_quality: str = "medium"       # "low", "medium" or "high"
 
 class DoodleAnalysisResponse(BaseModel):
     analysis_id: str
-    generated_image: str              # base64 encoded GauGAN-generated image
+    generated_image: Optional[str] = None     # base64 encoded GauGAN-generated image
+    generated_image_ref: Optional[str] = None # URL of the stored generated image
+    doodle_image_ref: Optional[str] = None    # URL of the stored uploaded doodle
     emotional_state: Dict[str, float] # Emotional states with scores
     feedback: str                     # Textual feedback
     recommendation: str               # Personalized recommendation
+    model_version: str                # Version of the models that produced the analysis
+
+class JobSubmissionResponse(BaseModel):
+    job_id: str
+    status: str                       # "queued"
+    status_url: str                   # poll for the job state
+    events_url: str                   # server-sent events stream
+
+class DoodleJobResponse(BaseModel):
+    job_id: str
+    kind: str                         # "doodle-analysis"
+    status: str                       # "queued", "running", "succeeded" or "failed"
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[DoodleAnalysisResponse] = None  # set once succeeded
+    error: Optional[str] = None                      # set once failed
+
+class UserSessionRequest(BaseModel):
+    user_id: Optional[str] = None
+    session_data: Dict[str, Any]      # e.g. analysis_type, analysis_id, emotional_state
+    timestamp: Optional[float] = None # Unix timestamp of the session
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to AI-PsychDoodle-Analyzer API", 
             "version": "1.0.0",
-            "endpoints": ["/shape-analysis", "/doodle-analysis"]}
+            "endpoints": ["/shape-analysis", "/doodle-analysis", "/jobs/doodle-analysis",
+                          "/users/{user_id}/sessions", "/users/{user_id}/history",
+                          "/health", "/health/live", "/health/ready"]}
 
-@app.post("/shape-analysis", response_model=ShapeAnalysisResponse)
-async def analyze_shape(request: ShapeAnalysisRequest):
+def record_image_context_stats(*contexts: ImageContext):
     """
-    Analyze a traced shape to determine psychological state
+    Count the derived-image cache hits and misses of a request's image contexts
+    (before they are released)
+    """
+    for context in contexts:
+        stats = context.stats()
+        record_cache_access("image_context", True, stats["hits"])
+        record_cache_access("image_context", False, stats["misses"])
+
+def record_session(user_id: str, session_data: Dict[str, Any]):
+    """
+    Add an analysis result to the user's history. A failed write is logged
+    rather than failing the analysis, whose result the client still gets.
     """
     try:
-        # Decode images
-        original_img = decode_base64_image(request.original_image)
-        traced_img = decode_base64_image(request.traced_image)
-        
-        # Analyze the shape tracing
+        history_store.save_session(user_id, session_data)
+    except Exception as e:
+        print(f"Warning: Could not save the session of user {user_id}: {e}")
+
+def run_shape_analysis(request: ShapeAnalysisRequest) -> Dict[str, Any]:
+    """
+    Run the shape analysis pipeline for a request
+    
+    Returns:
+        Response content matching ShapeAnalysisResponse
+    """
+    # The whole request runs on one model version, even if a reload swaps
+    # in a new one meanwhile
+    models = model_manager.current
+    shape_analyzer = models.shape_analyzer
+    analysis_id = str(uuid.uuid4())
+    set_span_attribute("analysis_id", analysis_id)
+    set_span_attribute("model_version", models.version)
+    
+    # Decode images
+    with stage("decode"):
+        original_img = ImageContext(decode_base64_image(request.original_image), buffer_pool)
+        traced_img = ImageContext(decode_base64_image(request.traced_image), buffer_pool)
+    
+    # Analyze the shape tracing
+    record_analysis_path("shape_analyzer", shape_analyzer.model is not None)
+    with original_img, traced_img, stage("analyze"):
         analysis_results = shape_analyzer.analyze(
             original_image=original_img,
             traced_image=traced_img,
             response_time=request.response_time,
             shape_type=request.shape_type
         )
-        
-        # Get recommendations based on analysis
-        feedback = shape_analyzer.generate_feedback(analysis_results)
-        recommendation = shape_analyzer.generate_recommendation(analysis_results)
-        
-        return ShapeAnalysisResponse(
-            analysis_id=str(uuid.uuid4()),
-            emotional_state=analysis_results,
-            feedback=feedback,
-            recommendation=recommendation
-        )
+        record_image_context_stats(original_img, traced_img)
+    emotional_state = {k: float(v) for k, v in analysis_results.items()}
+    
+    # Get recommendations based on analysis
+    with stage("feedback"):
+        feedback = shape_analyzer.generate_feedback(emotional_state)
+        recommendation = shape_analyzer.generate_recommendation(emotional_state)
+    
+    if request.user_id:
+        record_session(request.user_id, {
+            "analysis_type": "shape",
+            "analysis_id": analysis_id,
+            "shape_type": request.shape_type,
+            "response_time": request.response_time,
+            "emotional_state": emotional_state,
+            "model_version": models.version
+        })
+    
+    return {
+        "analysis_id": analysis_id,
+        "emotional_state": emotional_state,
+        "feedback": feedback,
+        "recommendation": recommendation,
+        "model_version": models.version
+    }
+
+def run_doodle_analysis(request: DoodleAnalysisRequest) -> Tuple[Dict[str, Any], Optional[Tuple[bytes, str]]]:
+    """
+    Run the doodle transformation and analysis pipeline for a request
+    
+    Returns:
+        Response content matching DoodleAnalysisResponse without the inline
+        generated_image, and the encoded generated image as (bytes, MIME type)
+        if it should be returned inline (None otherwise)
+    """
+    models = model_manager.current
+    gaugan_adapter = models.gaugan_adapter
+    drawing_analyzer = models.drawing_analyzer
+    analysis_id = str(uuid.uuid4())
+    set_span_attribute("analysis_id", analysis_id)
+    set_span_attribute("model_version", models.version)
+    
+    # Decode doodle image
+    with stage("decode"):
+        doodle_bytes = decode_base64_bytes(request.doodle_image)
+        doodle_img = ImageContext(decode_image_bytes(doodle_bytes), buffer_pool)
+    
+    # Generate image using GauGAN
+    record_analysis_path("gaugan_adapter", gaugan_adapter.model_loaded and gaugan_adapter.model is not None)
+    with doodle_img, stage("gaugan_transform"):
+        generated_img = ImageContext(gaugan_adapter.transform(doodle_img), buffer_pool)
+        record_image_context_stats(doodle_img)
+    
+    # Analyze the generated image
+    record_analysis_path("drawing_analyzer", drawing_analyzer.model is not None)
+    with generated_img, stage("analyze"):
+        analysis_results = drawing_analyzer.analyze_image(generated_img)
+        record_image_context_stats(generated_img)
+    emotional_state = {k: float(v) for k, v in analysis_results.items()}
+    
+    # Generate feedback and recommendations
+    with stage("feedback"):
+        feedback = drawing_analyzer.generate_feedback(emotional_state)
+        recommendation = drawing_analyzer.generate_recommendation(emotional_state)
+    
+    # Encode the generated image, inline and/or as a stored reference
+    generated_image_ref = None
+    doodle_image_ref = None
+    image_format = negotiate_image_format(request.image_accept)
+    with stage("encode"):
+        image_bytes = encode_image(generated_img.image, image_format, request.image_quality)
+        if blob_writer is not None:
+            # Keys are None when too many writes are pending
+            generated_key = blob_writer.submit(image_bytes, image_format)
+            doodle_key = blob_writer.submit(doodle_bytes, extension_for_bytes(doodle_bytes))
+            generated_image_ref = f"/blobs/{generated_key}" if generated_key else None
+            doodle_image_ref = f"/blobs/{doodle_key}" if doodle_key else None
+    
+    inline_image = None
+    if generated_image_ref is None or request.image_response != "reference":
+        inline_image = (image_bytes, f"image/{image_format}")
+    
+    if request.user_id:
+        record_session(request.user_id, {
+            "analysis_type": "doodle",
+            "analysis_id": analysis_id,
+            "generated_image_ref": generated_image_ref,
+            "emotional_state": emotional_state,
+            "model_version": models.version
+        })
+    
+    content = {
+        "analysis_id": analysis_id,
+        "generated_image": None,
+        "generated_image_ref": generated_image_ref,
+        "doodle_image_ref": doodle_image_ref,
+        "emotional_state": emotional_state,
+        "feedback": feedback,
+        "recommendation": recommendation,
+        "model_version": models.version
+    }
+    return content, inline_image
+
+async def run_in_lane(lane: str, fn, *args):
+    """
+    Run a blocking pipeline function in a scheduler lane (inline on the
+    event loop when the scheduler is disabled)
+    """
+    if scheduler is None:
+        return run_profiled(fn, *args)
+    return await scheduler.run(lane, run_queued, time.time_ns(), lane, run_profiled, fn, *args)
+
+def doodle_response(content: Dict[str, Any], inline_image: Optional[Tuple[bytes, str]]) -> Response:
+    """
+    Build the /doodle-analysis response, streaming the inline image as base64
+    """
+    if inline_image is None:
+        return FastJSONResponse(content)
+    image_bytes, mime_type = inline_image
+    return StreamedBase64JSONResponse(content, "generated_image", image_bytes,
+                                      prefix=f"data:{mime_type};base64,")
+
+def run_doodle_job(request: DoodleAnalysisRequest) -> Dict[str, Any]:
+    """
+    Run a queued doodle analysis (on a job worker thread)
+    
+    Returns:
+        Content matching DoodleAnalysisResponse, with an inline generated
+        image as a base64 data URI
+    """
+    with track_request("/jobs/doodle-analysis"):
+        content, inline_image = run_doodle_analysis(request)
+    if inline_image is not None:
+        image_bytes, mime_type = inline_image
+        content["generated_image"] = f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+    return content
+
+# Initialize the asynchronous job queue for long-running analyses
+jobs_config = server_config.get_jobs_config()
+job_manager = None
+if jobs_config.get("enabled", True):
+    job_manager = JobManager(
+        {"doodle-analysis": run_doodle_job},
+        workers=jobs_config["workers"],
+        max_queue=jobs_config["max_queue"],
+        result_ttl=jobs_config["result_ttl"],
+        state_dir=jobs_config.get("state_dir") or None,
+        on_change=record_job_state,
+        runner=(lambda handler, payload: scheduler.run("heavy", handler, payload)) if scheduler else None
+    )
+
+# Scheduler lane serving each analysis endpoint
+ENDPOINT_LANES = {
+    "/shape-analysis": "interactive",
+    "/doodle-analysis": "heavy"
+}
+
+# Endpoints labeled in the rejection metrics; other paths are counted as
+# "other", so arbitrary request paths cannot create new label values
+REJECTION_ENDPOINTS = set(ENDPOINT_LANES) | {"/jobs/doodle-analysis"}
+
+def record_rejection(path: str, status: int):
+    """
+    Count a rejected request under its endpoint or "other"
+    """
+    record_rejected_request(path if path in REJECTION_ENDPOINTS else "other", status)
+
+def overloaded(path: str) -> Optional[float]:
+    """
+    Check whether a request would only be queued behind a full queue
+    
+    Returns:
+        Estimated seconds until the queue has room again, or None if the
+        request can be accepted
+    """
+    lane_name = ENDPOINT_LANES.get(path)
+    if scheduler is not None and lane_name is not None:
+        lane = scheduler.lanes[lane_name]
+        return lane.backlog_seconds() if lane.full else None
+    if path == "/jobs/doodle-analysis" and job_manager is not None and job_manager.full:
+        cost = scheduler.lanes["heavy"].cost if scheduler is not None else 1.0
+        return job_manager.queue_depth() * cost / job_manager.workers
+    return None
+
+# Enforce the configured rate limit across all worker processes, and shed
+# load before reading request bodies that would only wait in full queues
+api_config = server_config.get_api_config()
+rate_limiter = None
+if api_config.get("rate_limit_enabled", False):
+    rate_limiter = SharedTokenBucket(
+        rate=api_config["rate_limit"] / 60.0,
+        burst=api_config.get("rate_limit_burst", api_config["rate_limit"]),
+        path=api_config.get("rate_limit_state_path") or None
+    )
+# Server-Timing headers and opt-in sampled profiles (inside the rate
+# limiter, so rejected requests are not profiled)
+profiling_config = server_config.get_profiling_config()
+app.add_middleware(
+    ProfilingMiddleware,
+    server_timing=profiling_config.get("server_timing", True),
+    admin_keys=api_config.get("admin_api_keys", []) if profiling_config.get("enabled", True) else [],
+    sample_hz=profiling_config.get("sample_hz", 200),
+    max_seconds=profiling_config.get("max_seconds", 60),
+    output_dir=profiling_config.get("output_dir", "data/profiles"),
+    formats=profiling_config.get("formats", ["collapsed", "speedscope"])
+)
+
+# Spans for every request, its queueing and its pipeline stages, continuing
+# the caller's trace (outside the profiler, so its overhead is included)
+tracing_config = server_config.get_tracing_config()
+tracer = create_tracer("psychdoodle-api", tracing_config)
+if tracing_config.get("enabled", True):
+    trace_stages()
+    app.add_middleware(
+        TracingMiddleware,
+        tracer=tracer,
+        exempt_paths=tracing_config.get("exempt_paths", ["/metrics"])
+    )
+
+app.add_middleware(
+    RateLimitMiddleware,
+    limiter=rate_limiter,
+    exempt_paths=["/metrics"],
+    trust_forwarded_for=api_config.get("trust_forwarded_for", False),
+    api_keys=api_config.get("api_keys", []) + api_config.get("admin_api_keys", []),
+    overloaded=overloaded if api_config.get("load_shedding", True) else None,
+    on_reject=record_rejection
+)
+
+# Added last so it is the outermost middleware and rejected requests get
+# CORS headers too
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+@app.post("/shape-analysis", response_model=ShapeAnalysisResponse)
+async def analyze_shape(request: ShapeAnalysisRequest):
+    """
+    Analyze a traced shape to determine psychological state
+    """
+    try:
+        with track_request("/shape-analysis"):
+            return FastJSONResponse(await run_in_lane("interactive", run_shape_analysis, request))
+    except LaneQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
@@ -107,32 +539,56 @@ async def analyze_doodle(request: DoodleAnalysisRequest):
     Transform a doodle using GauGAN and analyze the result
     """
     try:
-        # Decode doodle image
-        doodle_img = decode_base64_image(request.doodle_image)
-        
-        # Generate image using GauGAN
-        generated_img = gaugan_adapter.transform(doodle_img)
-        
-        # Analyze the generated image
-        analysis_results = drawing_analyzer.analyze_image(generated_img)
-        
-        # Generate feedback and recommendations
-        feedback = drawing_analyzer.generate_feedback(analysis_results)
-        recommendation = drawing_analyzer.generate_recommendation(analysis_results)
-        
-        # Encode the generated image to base64
-        encoded_image = encode_base64_image(generated_img)
-        
-        return DoodleAnalysisResponse(
-            analysis_id=str(uuid.uuid4()),
-            generated_image=encoded_image,
-            emotional_state=analysis_results,
-            feedback=feedback,
-            recommendation=recommendation
-        )
+        with track_request("/doodle-analysis"):
+            return doodle_response(*await run_in_lane("heavy", run_doodle_analysis, request))
+    except LaneQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+@app.post("/jobs/doodle-analysis", status_code=202, response_model=JobSubmissionResponse)
+async def submit_doodle_job(request: DoodleAnalysisRequest):
+    """
+    Queue a doodle transformation and analysis, returning a job id immediately
+    """
+    if job_manager is None:
+        raise HTTPException(status_code=404, detail="Asynchronous jobs are disabled")
+    try:
+        job = job_manager.submit("doodle-analysis", request)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    
+    status_url = f"/jobs/{job.job_id}"
+    return FastJSONResponse({
+        "job_id": job.job_id,
+        "status": job.status,
+        "status_url": status_url,
+        "events_url": f"{status_url}/events"
+    }, status_code=202, headers={"Location": status_url})
+
+@app.get("/jobs/{job_id}", response_model=DoodleJobResponse)
+async def get_job(job_id: str):
+    """
+    Returns the state of a job, including its result once it has finished
+    """
+    state = job_manager.get(job_id) if job_manager is not None else None
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return FastJSONResponse(state)
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str):
+    """
+    Streams a job's state changes as server-sent events until it finishes
+    """
+    if job_manager is None or job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return StreamingResponse(
+        job_manager.events(job_id, keepalive=jobs_config.get("sse_keepalive", 15)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/predefined-shapes")
 async def get_predefined_shapes():
     """
@@ -145,6 +601,245 @@ async def get_predefined_shapes():
     }
     return shapes
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics, aggregated across workers in gunicorn multiprocess mode
+    """
+    if not metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=collect_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/blobs/{key}")
+async def get_blob(key: str, x_api_key: Optional[str] = Header(None)):
+    """
+    Returns a stored image by its content-addressed key (requires an API key)
+    """
+    require_api_key(x_api_key)
+    if blob_writer is None:
+        raise HTTPException(status_code=404, detail="Image storage is disabled")
+    
+    data = blob_writer.get(key) if is_valid_key(key) else None
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"Blob {key} not found")
+    
+    return Response(content=data, media_type=content_type_for_key(key),
+                    headers={"Cache-Control": "private, max-age=86400, immutable"})
+
+# Worker readiness: requests are only routed here once warm-up has finished
+worker_state = {
+    "status": "starting",   # "starting", "warming_up", "ready" or "failed"
+    "started_at": time.time(),
+    "warmup_seconds": None,
+    "warmup": {},           # per-step timings of the first and warm runs
+    "error": None
+}
+
+def run_warmup():
+    """
+    Warm up the models (on a background thread, so liveness checks are
+    answered meanwhile)
+    """
+    worker_state["status"] = "warming_up"
+    start = time.perf_counter()
+    try:
+        models = model_manager.current
+        worker_state["warmup"] = warm_up(
+            models.shape_analyzer, models.drawing_analyzer, models.gaugan_adapter,
+            rounds=warmup_config.get("rounds", 2),
+            shape_size=warmup_config.get("shape_size", 256),
+            doodle_size=warmup_config.get("doodle_size", 512)
+        )
+        worker_state["status"] = "ready"
+    except Exception as e:
+        worker_state["error"] = str(e)
+        worker_state["status"] = "failed"
+        print(f"Warning: Warm-up failed: {e}")
+    worker_state["warmup_seconds"] = time.perf_counter() - start
+
+@app.on_event("startup")
+async def start_warmup():
+    """
+    Start warming up the models
+    """
+    if warmup_config.get("enabled", True):
+        asyncio.get_event_loop().run_in_executor(None, run_warmup)
+    else:
+        worker_state["status"] = "ready"
+    if hot_reload_config.get("enabled", True):
+        model_manager.start_watching(hot_reload_config.get("poll_interval", 5))
+
+def health_report() -> Dict[str, Any]:
+    """
+    Readiness of this worker with warm-up timings and model status
+    """
+    models = model_manager.current
+    return {
+        "status": worker_state["status"],
+        "ready": worker_state["status"] == "ready",
+        "pid": os.getpid(),
+        "uptime_seconds": time.time() - worker_state["started_at"],
+        "warmup_seconds": worker_state["warmup_seconds"],
+        "warmup": worker_state["warmup"],
+        "error": worker_state["error"],
+        "model_version": models.version,
+        "models": model_status(models.shape_analyzer, models.drawing_analyzer, models.gaugan_adapter),
+        "last_model_reload": model_manager.last_reload,
+        "resources": effective_resources()
+    }
+
+@app.get("/health/live")
+async def health_live():
+    """
+    Liveness: the worker's event loop is responsive
+    """
+    return {"status": "alive", "pid": os.getpid(),
+            "uptime_seconds": time.time() - worker_state["started_at"]}
+
+@app.get("/health/ready")
+async def health_ready():
+    """
+    Readiness: 200 once warm-up has finished, 503 before (or if it failed)
+    """
+    report = health_report()
+    return FastJSONResponse(report, status_code=200 if report["ready"] else 503)
+
+@app.get("/health")
+async def health():
+    """
+    Health check with warm-up timings and model status (same as /health/ready)
+    """
+    return await health_ready()
+
+def require_admin(api_key: Optional[str]):
+    """
+    Reject requests without an admin API key
+    """
+    if not api_key or api_key not in api_config.get("admin_api_keys", []):
+        raise HTTPException(status_code=403, detail="Admin API key required")
+
+def require_api_key(api_key: Optional[str]):
+    """
+    Reject requests without a client or admin API key
+    """
+    if not api_key or api_key not in api_config.get("api_keys", []) + api_config.get("admin_api_keys", []):
+        raise HTTPException(status_code=403, detail="API key required")
+
+@app.post("/admin/models/reload")
+async def reload_models(force: bool = Query(False), x_api_key: Optional[str] = Header(None)):
+    """
+    Load, validate and swap in the current model weights without downtime
+    
+    Reloads this worker and touches the reload trigger file, so the other
+    workers follow within one poll interval.
+    """
+    require_admin(x_api_key)
+    result = await asyncio.get_event_loop().run_in_executor(None, model_manager.reload, force)
+    if result["error"] is not None:
+        raise HTTPException(status_code=422, detail=f"Model reload rejected: {result['error']}")
+    if result["swapped"]:
+        model_manager.request_reload()
+    return result
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = Query("speedscope"),
+                      x_api_key: Optional[str] = Header(None)):
+    """
+    Returns a stored request profile (speedscope JSON or collapsed stacks)
+    """
+    require_admin(x_api_key)
+    if format not in PROFILE_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown profile format: {format}")
+    path = profile_path(profiling_config.get("output_dir", "data/profiles"), profile_id, format)
+    if not re.fullmatch(r"[0-9a-f]{32}", profile_id) or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    with open(path, "rb") as f:
+        content = f.read()
+    media_type = "application/json" if format == "speedscope" else "text/plain; charset=utf-8"
+    return Response(content=content, media_type=media_type)
+
+@app.on_event("startup")
+async def start_jobs():
+    """
+    Start the job workers on the server's event loop
+    """
+    if job_manager is not None:
+        job_manager.start()
+
+@app.on_event("shutdown")
+async def stop_workers():
+    """
+    Stop the job workers and pipeline threads
+    """
+    if job_manager is not None:
+        await job_manager.stop()
+    if scheduler is not None:
+        scheduler.shutdown()
+    model_manager.stop_watching()
+
+async def prune_storage():
+    """
+    Delete stored images older than the retention period, once an hour
+    """
+    max_age = storage_config["retention_days"] * 86400
+    while True:
+        try:
+            deleted = await asyncio.get_event_loop().run_in_executor(None, blob_writer.prune, max_age)
+            if deleted:
+                print(f"Pruned {deleted} stored images older than {storage_config['retention_days']} days")
+        except Exception as e:
+            print(f"Warning: Could not prune stored images: {e}")
+        await asyncio.sleep(STORAGE_PRUNE_INTERVAL)
+
+@app.on_event("startup")
+async def start_storage_pruning():
+    """
+    Start enforcing the image retention period
+    """
+    if blob_writer is not None and storage_config.get("retention_days"):
+        asyncio.get_event_loop().create_task(prune_storage())
+
+@app.on_event("shutdown")
+async def shutdown_storage():
+    """
+    Flush pending image writes on shutdown
+    """
+    if blob_writer is not None:
+        blob_writer.close(wait=True)
+
+@app.on_event("shutdown")
+async def shutdown_tracing():
+    """
+    Export the remaining spans on shutdown
+    """
+    await asyncio.get_event_loop().run_in_executor(None, tracer.shutdown)
+
+@app.post("/users/{user_id}/sessions")
+async def save_user_session(user_id: str, request: UserSessionRequest):
+    """
+    Save a user session and update the user's trend statistics
+    """
+    # SQLite may wait for the write lock of another worker, so the store is
+    # only used off the event loop
+    try:
+        return await asyncio.get_event_loop().run_in_executor(
+            None, history_store.save_session, user_id, request.session_data, request.timestamp)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Saving session failed: {str(e)}")
+
+@app.get("/users/{user_id}/history")
+async def get_user_history(user_id: str,
+                           limit: int = Query(10, ge=1, le=100),
+                           offset: int = Query(0, ge=0)):
+    """
+    Returns a page of the user's sessions with precomputed trend statistics
+    """
+    try:
+        return await asyncio.get_event_loop().run_in_executor(
+            None, history_store.get_history, user_id, limit, offset)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Loading history failed: {str(e)}")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Request Tracing for AI-PsychDoodle-Analyzer
+Server spans that continue the caller's W3C trace context
+"""
+
+import time
+from typing import Iterable
+
+from utils.tracing import (Tracer, SPAN_KIND_SERVER, TRACEPARENT_HEADER, _current_span,
+                           parse_traceparent, record_span)
+from api.profiling import record_timing
+
+
+def route_name(scope) -> str:
+    """
+    Request path with its path parameters replaced by their names
+    (e.g. "/users/{user_id}/history"), once the router has matched it
+    """
+    path = scope["path"]
+    for name, value in (scope.get("path_params") or {}).items():
+        path = path.replace(f"/{value}", f"/{{{name}}}", 1)
+    return path
+
+
+def run_queued(enqueued_ns: int, lane: str, fn, *args):
+    """
+    Run a pipeline function after recording the time it waited for a
+    pipeline thread as a "queue" span and Server-Timing entry
+
+    Call this on the thread that runs the work, with the time the work was
+    submitted (time.time_ns()).
+    """
+    started_ns = time.time_ns()
+    record_span("queue", enqueued_ns, started_ns, attributes={"lane": lane})
+    record_timing("queue", (started_ns - enqueued_ns) / 1e9)
+    return fn(*args)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that records every request as a server span.
+
+    The span continues the trace of an incoming "traceparent" header (or
+    starts a new one) and is the current span while the request runs, so
+    the queue and pipeline stage spans become its children. The response
+    carries a "traceresponse" header with the trace and span id, so a
+    client can find the server's side of any call.
+    """
+
+    def __init__(self, app, tracer: Tracer, exempt_paths: Iterable[str] = ()):
+        """
+        Initialize the middleware
+
+        Args:
+            app: ASGI application
+            tracer: Tracer creating and exporting the spans
+            exempt_paths: Paths that are not traced (e.g. health checks)
+        """
+        self.app = app
+        self.tracer = tracer
+        self.exempt_paths = set(exempt_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        remote = parse_traceparent(headers.get(TRACEPARENT_HEADER.encode("latin-1"), b"").decode("latin-1"))
+        span = self.tracer.start_span(
+            f"{scope['method']} {scope['path']}", remote, SPAN_KIND_SERVER,
+            attributes={"http.method": scope["method"], "http.target": scope["path"]})
+        token = _current_span.set(span)
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                span.set_attribute("http.status_code", status)
+                if status >= 500:
+                    span.set_error(f"HTTP {status}")
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"traceresponse", span.traceparent().encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except BaseException as e:
+            span.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            # The router has added the path parameters to the scope by now
+            span.name = f"{scope['method']} {route_name(scope)}"
+            span.end()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Model Warm-up for AI-PsychDoodle-Analyzer
+Runs synthetic inputs through the pipeline before a worker reports ready
+"""
+
+import time
+import logging
+from typing import Any, Callable, Dict, List
+
+import cv2
+import numpy as np
+
+from models.shape_analyzer import ShapeAnalyzer
+from models.drawing_analyzer import DrawingAnalyzer, ANALYSIS_SIZE
+from models.gaugan_adapter import GauGANAdapter
+from utils.buffer_pool import get_buffer_pool
+from utils.image_context import ImageContext
+from utils.image_processing import decode_image_bytes, encode_image, supported_image_formats
+from utils.synthetic_drawings import generate_doodle, generate_shape_image, generate_traced_shape
+
+logger = logging.getLogger(__name__)
+
+
+def model_status(shape_analyzer: ShapeAnalyzer, drawing_analyzer: DrawingAnalyzer,
+                 gaugan_adapter: GauGANAdapter) -> Dict[str, Dict[str, Any]]:
+    """
+    Whether each component runs its trained model or the heuristic fallback
+
+    Returns:
+        Mapping of component name to its analysis path and model file
+    """
+    return {
+        "shape_analyzer": {
+            "path": "model" if shape_analyzer.model is not None else "heuristic",
+            "model_path": shape_analyzer.model_path
+        },
+        "drawing_analyzer": {
+            "path": "model" if drawing_analyzer.model is not None else "heuristic",
+            "model_path": drawing_analyzer.model_path
+        },
+        "gaugan_adapter": {
+            "path": "model" if gaugan_adapter.model_loaded and gaugan_adapter.model is not None else "heuristic",
+            "model_path": gaugan_adapter.model_path
+        }
+    }
+
+
+def _check_emotions(component: str, emotional_state: Dict[str, float], categories: List[str]):
+    values = [emotional_state.get(category) for category in categories]
+    if any(value is None for value in values):
+        raise ValueError(f"{component} did not score every emotion category")
+    values = np.asarray(values, dtype=np.float64)
+    if not np.all(np.isfinite(values)) or values.min() < 0.0 or values.max() > 1.0:
+        raise ValueError(f"{component} returned scores outside [0, 1]: {emotional_state}")
+    if abs(values.sum() - 1.0) > 1e-3:
+        raise ValueError(f"{component} returned scores that do not sum to 1: {emotional_state}")
+
+
+def validate_models(shape_analyzer: ShapeAnalyzer, drawing_analyzer: DrawingAnalyzer,
+                    gaugan_adapter: GauGANAdapter, shape_size: int = 256, doodle_size: int = 512):
+    """
+    Canary check of a set of models on synthetic inputs
+
+    Runs one shape tracing and one doodle through the full pipeline and
+    checks that the outputs have the expected form, so broken weights are
+    rejected before they serve requests.
+
+    Args:
+        shape_analyzer: Shape analyzer to check
+        drawing_analyzer: Drawing analyzer to check
+        gaugan_adapter: GauGAN adapter to check
+        shape_size: Canvas size of the synthetic shape tracing
+        doodle_size: Canvas size of the synthetic doodle
+
+    Raises:
+        ValueError: If a component returns malformed output
+    """
+    pool = get_buffer_pool()
+    original = generate_shape_image("circle", shape_size)
+    traced = generate_traced_shape("circle", shape_size, seed=1)
+    doodle = generate_doodle(list(gaugan_adapter.color_map.keys()), doodle_size, seed=1)
+
+    with ImageContext(original, pool) as original_img, ImageContext(traced, pool) as traced_img:
+        shape_state = shape_analyzer.analyze(original_img, traced_img, 2.0, "circle")
+    _check_emotions("shape_analyzer", shape_state, shape_analyzer.emotion_categories)
+
+    with ImageContext(doodle, pool) as doodle_img:
+        generated = gaugan_adapter.transform(doodle_img)
+    if (not isinstance(generated, np.ndarray) or generated.ndim != 3 or generated.shape[2] != 3
+            or generated.dtype != np.uint8):
+        raise ValueError(f"gaugan_adapter returned an invalid image: "
+                         f"{getattr(generated, 'shape', None)} {getattr(generated, 'dtype', None)}")
+
+    with ImageContext(generated, pool) as generated_img:
+        drawing_state = drawing_analyzer.analyze_image(generated_img)
+    _check_emotions("drawing_analyzer", drawing_state, drawing_analyzer.emotion_categories)
+
+
+def warm_up(shape_analyzer: ShapeAnalyzer, drawing_analyzer: DrawingAnalyzer,
+            gaugan_adapter: GauGANAdapter, rounds: int = 2, shape_size: int = 256,
+            doodle_size: int = 512) -> Dict[str, Dict[str, float]]:
+    """
+    Run synthetic inputs through every pipeline step
+
+    The first round pays the one-time costs (TF graph tracing, Torch
+    allocator setup, OpenCV lazy initialization, example image loading,
+    buffer pool allocation); later rounds show the warm latency. Both the
+    model and the heuristic path of each component are exercised, since a
+    worker falls back to the heuristics whenever a model cannot be used.
+
+    Args:
+        shape_analyzer: Shape analyzer to warm up
+        drawing_analyzer: Drawing analyzer to warm up
+        gaugan_adapter: GauGAN adapter to warm up
+        rounds: Number of passes over all steps
+        shape_size: Canvas size of the synthetic shape tracings
+        doodle_size: Canvas size of the synthetic doodles
+
+    Returns:
+        Mapping of step name to {"first": seconds, "warm": seconds} (warm is
+        the fastest later round, or equal to first for a single round)
+    """
+    pool = get_buffer_pool()
+    palette = list(gaugan_adapter.color_map.keys())
+    original = generate_shape_image("circle", shape_size)
+    traced = generate_traced_shape("circle", shape_size, seed=0)
+    _, doodle_png = cv2.imencode(".png", generate_doodle(palette, doodle_size, seed=0))
+    doodle_bytes = doodle_png.tobytes()
+    shape_model = shape_analyzer.model is not None
+    drawing_model = drawing_analyzer.model is not None
+    gaugan_model = gaugan_adapter.model_loaded and gaugan_adapter.model is not None
+
+    timings: Dict[str, List[float]] = {}
+
+    def timed(name: str, fn: Callable[[], Any]) -> Any:
+        start = time.perf_counter()
+        result = fn()
+        timings.setdefault(name, []).append(time.perf_counter() - start)
+        return result
+
+    for _ in range(max(1, rounds)):
+        doodle = timed("decode", lambda: decode_image_bytes(doodle_bytes))
+
+        with ImageContext(original, pool) as original_img, ImageContext(traced, pool) as traced_img:
+            timed("shape_analyzer", lambda: shape_analyzer.analyze(original_img, traced_img, 2.0, "circle"))
+            if shape_model:
+                timed("shape_analyzer.heuristic", lambda: shape_analyzer._heuristic_analysis(
+                    original_img, traced_img, 2.0, "circle"))
+
+        with ImageContext(doodle, pool) as doodle_img:
+            generated = timed("gaugan_adapter", lambda: gaugan_adapter.transform(doodle_img))
+            if gaugan_model:
+                timed("gaugan_adapter.heuristic", lambda: gaugan_adapter._fallback_transform(doodle_img))
+
+        with ImageContext(generated, pool) as generated_img:
+            timed("drawing_analyzer", lambda: drawing_analyzer.analyze_image(generated_img))
+            if drawing_model:
+                timed("drawing_analyzer.heuristic", lambda: drawing_analyzer._heuristic_analysis(
+                    generated_img, ANALYSIS_SIZE))
+
+        for image_format in supported_image_formats():
+            timed(f"encode.{image_format}", lambda: encode_image(generated, image_format))
+
+    return {
+        name: {"first": values[0], "warm": min(values[1:]) if len(values) > 1 else values[0]}
+        for name, values in timings.items()
+    }
@@ -4,6 +4,7 @@ Mobile App Integration for AI-PsychDoodle-Analyzer
 Provides functions for integrating with mobile applications
 """
 import os
+import sys
 import json
 import requests
 import base64
@@ -11,6 +12,9 @@ from typing import Dict, Any, List, Optional, Union
 import time
 import logging
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.tracing import create_tracer, parse_server_timing, SPAN_KIND_CLIENT
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -22,12 +26,15 @@ class PsychDoodleAppIntegration:
     """
     Integrates the AI-PsychDoodle-Analyzer with mobile applications
     """
-    def __init__(self, api_url: str = None, api_key: str = None):
+    def __init__(self, api_url: str = None, api_key: str = None, tracing: Dict[str, Any] = None):
         """
         Initialize the app integration
         Args:
             api_url: URL of the AI-PsychDoodle-Analyzer API
             api_key: API key for authentication (if required)
+            tracing: Tracing settings ("exporter": "file", "otlp" or "none",
+                "file_path", "otlp_endpoint", "sample_ratio"); by default
+                calls only propagate their trace context to the server
         """
         self.api_url = api_url or "http://localhost:8000"
         self.api_key = api_key
@@ -37,6 +44,56 @@ class PsychDoodleAppIntegration:
         self.headers = {"Content-Type": "application/json"}
         if self.api_key:
             self.headers["X-API-Key"] = self.api_key
+        self.tracer = create_tracer("psychdoodle-app", dict({"exporter": "none"}, **(tracing or {})))
+        # Latency breakdown of the most recent call (see _request)
+        self.last_latency: Dict[str, float] = {}
+
+    def _request(self, method: str, path: str, timeout: float = None, name: str = None,
+                 **kwargs) -> requests.Response:
+        """
+        Send an API request in a client span
+        
+        The request carries a traceparent header that continues the current
+        span (e.g. one the app opened around a user action with
+        self.tracer.span()) or starts a new trace, so the server's request,
+        queue and pipeline stage spans join the same trace. The client span
+        records how the call's latency splits into network, server queueing
+        and server compute, from the response's Server-Timing header.
+        Args:
+            method: HTTP method
+            path: API path (e.g. "/health")
+            timeout: Request timeout in seconds (default: self.timeout)
+            name: Span name (default: method and path; use the path template
+                for paths containing identifiers)
+            **kwargs: Further arguments for requests.request (json, params, ...)
+        Returns:
+            The response
+        """
+        url = f"{self.api_url}{path}"
+        with self.tracer.span(name or f"{method} {path}", kind=SPAN_KIND_CLIENT,
+                              attributes={"http.method": method, "http.url": url}) as span:
+            headers = dict(self.headers, traceparent=span.traceparent())
+            response = requests.request(method, url, headers=headers,
+                                        timeout=timeout or self.timeout, **kwargs)
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 400:
+                span.set_error(f"HTTP {response.status_code}")
+            
+            # Until the response headers arrived; body transfer is not included
+            self.last_latency = {"total_ms": response.elapsed.total_seconds() * 1000}
+            server_timing = parse_server_timing(response.headers.get("Server-Timing"))
+            if "total" in server_timing:
+                queue_ms = server_timing.get("queue", 0.0)
+                self.last_latency.update(
+                    network_ms=max(0.0, self.last_latency["total_ms"] - server_timing["total"]),
+                    server_ms=server_timing["total"],
+                    queue_ms=queue_ms,
+                    compute_ms=max(0.0, server_timing["total"] - queue_ms)
+                )
+            self.last_latency = {name: round(value, 3) for name, value in self.last_latency.items()}
+            for name, value in self.last_latency.items():
+                span.set_attribute(f"latency.{name}", value)
+            return response
 
     def get_predefined_shapes(self) -> Dict[str, List[str]]:
         """
@@ -45,11 +102,7 @@ class PsychDoodleAppIntegration:
             Dictionary mapping shape categories to lists of shapes
         """
         try:
-            response = requests.get(
-                f"{self.api_url}/predefined-shapes",
-                headers=self.headers,
-                timeout=self.timeout
-            )
+            response = self._request("GET", "/predefined-shapes")
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -79,11 +132,9 @@ class PsychDoodleAppIntegration:
                 "response_time": response_time,
                 "shape_type": shape_type
             }
-            response = requests.post(
-                f"{self.api_url}/analyze/traced-shape",
-                headers=self.headers,
-                json=payload,
-                timeout=self.timeout
+            response = self._request(
+                "POST", "/analyze/traced-shape",
+                json=payload
             )
             response.raise_for_status()
             return response.json()
@@ -113,11 +164,9 @@ class PsychDoodleAppIntegration:
                 "drawing_time": drawing_time,
                 "metadata": metadata or {}
             }
-            response = requests.post(
-                f"{self.api_url}/analyze/free-drawing",
-                headers=self.headers,
-                json=payload,
-                timeout=self.timeout
+            response = self._request(
+                "POST", "/analyze/free-drawing",
+                json=payload
             )
             response.raise_for_status()
             return response.json()
@@ -140,11 +189,9 @@ class PsychDoodleAppIntegration:
             List of feedback suggestions
         """
         try:
-            response = requests.post(
-                f"{self.api_url}/feedback/suggestions",
-                headers=self.headers,
-                json={"emotional_state": emotional_state},
-                timeout=self.timeout
+            response = self._request(
+                "POST", "/feedback/suggestions",
+                json={"emotional_state": emotional_state}
             )
             response.raise_for_status()
             return response.json()
@@ -177,11 +224,9 @@ class PsychDoodleAppIntegration:
                 "session_data": session_data,
                 "timestamp": time.time()
             }
-            response = requests.post(
-                f"{self.api_url}/users/{user_id}/sessions",
-                headers=self.headers,
-                json=payload,
-                timeout=self.timeout
+            response = self._request(
+                "POST", f"/users/{user_id}/sessions", name="POST /users/{user_id}/sessions",
+                json=payload
             )
             response.raise_for_status()
             return response.json()
@@ -209,11 +254,9 @@ class PsychDoodleAppIntegration:
                 "limit": limit,
                 "offset": offset
             }
-            response = requests.get(
-                f"{self.api_url}/users/{user_id}/history",
-                headers=self.headers,
-                params=params,
-                timeout=self.timeout
+            response = self._request(
+                "GET", f"/users/{user_id}/history", name="GET /users/{user_id}/history",
+                params=params
             )
             response.raise_for_status()
             return response.json()
@@ -233,9 +276,8 @@ class PsychDoodleAppIntegration:
             Dictionary with connection status
         """
         try:
-            response = requests.get(
-                f"{self.api_url}/health",
-                headers=self.headers,
+            response = self._request(
+                "GET", "/health",
                 timeout=5  # Shorter timeout for health check
             )
             response.raise_for_status()
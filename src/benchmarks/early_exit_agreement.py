@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Early-Exit Agreement for AI-PsychDoodle-Analyzer
+Measures how far coarse-to-fine DrawingAnalyzer results drift from the full-resolution analysis
+
+Usage:
+    python src/benchmarks/early_exit_agreement.py --samples 200 --margins 0.005,0.01,0.02,0.05
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from typing import Dict, Any, List
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.drawing_analyzer import DrawingAnalyzer, ANALYSIS_SIZE
+from models.gaugan_adapter import GauGANAdapter
+from utils.image_context import ImageContext
+from utils.synthetic_drawings import generate_doodle
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def _top_emotion(emotions: Dict[str, float]) -> str:
+    return max(emotions.items(), key=lambda x: x[1])[0]
+
+
+def _time_analysis(analyzer: DrawingAnalyzer, image: np.ndarray):
+    context = ImageContext(image)
+    start = time.perf_counter()
+    emotions = analyzer.analyze_image(context)
+    return emotions, time.perf_counter() - start
+
+
+def evaluate(images: List[np.ndarray], levels: List[int], margins: List[float],
+             repeats: int = 3) -> List[Dict[str, Any]]:
+    """
+    Compare early-exit analysis against the full-resolution analysis
+
+    Args:
+        images: Images to analyze (e.g. GauGAN outputs)
+        levels: Coarse pyramid levels, smallest first
+        margins: Confidence margins to evaluate
+        repeats: Timed runs per image (the fastest is used)
+
+    Returns:
+        One entry per margin with the share of analyses finishing at each
+        level, top-emotion agreement, mean and maximum L1 distance of the
+        scores and total time relative to the full analysis
+    """
+    full_analyzer = DrawingAnalyzer()
+    full_results = []
+    full_time = 0.0
+    for image in images:
+        runs = [_time_analysis(full_analyzer, image) for _ in range(repeats)]
+        full_results.append(runs[0][0])
+        full_time += min(t for _, t in runs)
+
+    results = []
+    for margin in margins:
+        used = []
+        analyzer = DrawingAnalyzer(pyramid_levels=levels, confidence_margin=margin,
+                                   on_level_used=used.append)
+        agree, l1, max_l1, elapsed = 0, 0.0, 0.0, 0.0
+        for image, full in zip(images, full_results):
+            runs = [_time_analysis(analyzer, image) for _ in range(repeats)]
+            emotions = runs[0][0]
+            elapsed += min(t for _, t in runs)
+            agree += _top_emotion(emotions) == _top_emotion(full)
+            distance = sum(abs(emotions[k] - full[k]) for k in full)
+            l1 += distance
+            max_l1 = max(max_l1, distance)
+
+        count = len(images)
+        sizes = sorted(levels) + [ANALYSIS_SIZE]
+        results.append({
+            "margin": margin,
+            "exit_rate": {str(size): used.count(size) / len(used) for size in sizes},
+            "top1_agreement": agree / count,
+            "mean_l1": l1 / count,
+            "max_l1": max_l1,
+            "relative_time": elapsed / full_time if full_time > 0 else 1.0
+        })
+    return results
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="DrawingAnalyzer early-exit agreement")
+    parser.add_argument("--samples", type=int, default=100, help="Number of synthetic doodles")
+    parser.add_argument("--resolution", type=int, default=512, help="Doodle resolution")
+    parser.add_argument("--levels", default="56,112", help="Comma-separated pyramid levels")
+    parser.add_argument("--margins", default="0.005,0.01,0.02,0.05,0.1",
+                        help="Comma-separated confidence margins")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for synthetic inputs")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    adapter = GauGANAdapter()
+    palette = list(adapter.color_map.keys())
+    images = [adapter.transform(generate_doodle(palette, args.resolution, seed=args.seed + i))
+              for i in range(args.samples)]
+
+    levels = [int(size) for size in args.levels.split(",")]
+    results = evaluate(images, levels, [float(m) for m in args.margins.split(",")])
+
+    print(f"{'margin':>8} {'agreement':>10} {'mean L1':>9} {'max L1':>8} {'time':>7}  exit rate by level")
+    for r in results:
+        exit_rates = "  ".join(f"{size}:{rate * 100:.0f}%" for size, rate in r["exit_rate"].items())
+        print(f"{r['margin']:>8.3f} {r['top1_agreement'] * 100:>9.1f}% {r['mean_l1']:>9.4f} {r['max_l1']:>8.4f} "
+              f"{r['relative_time'] * 100:>6.0f}%  {exit_rates}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"levels": levels, "samples": args.samples, "results": results}, f, indent=2)
+        logger.info(f"Saved results to {args.output}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
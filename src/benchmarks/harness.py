@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Benchmark Harness for AI-PsychDoodle-Analyzer
+Timing, result summaries and baseline comparison shared by the benchmark suites
+"""
+
+import gc
+import json
+import os
+import platform
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Any, List
+
+import numpy as np
+
+
+def time_callable(fn: Callable[[], Any], repeats: int = 10, warmup: int = 1,
+                  min_time: float = 0.0) -> List[float]:
+    """
+    Time repeated calls of a function
+
+    Args:
+        fn: Function to time (called without arguments)
+        repeats: Minimum number of timed calls
+        warmup: Number of untimed calls made first
+        min_time: Keep timing until at least this many seconds were measured
+
+    Returns:
+        List of call durations in seconds
+    """
+    for _ in range(warmup):
+        fn()
+
+    durations = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while len(durations) < repeats or sum(durations) < min_time:
+            start = time.perf_counter()
+            fn()
+            durations.append(time.perf_counter() - start)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    return durations
+
+
+def summarize(name: str, durations: List[float], resolution: int = None,
+              batch_size: int = 1, **extra) -> Dict[str, Any]:
+    """
+    Summarize the durations of one benchmark case
+
+    Args:
+        name: Benchmark name (e.g. "shape_analyzer.analyze")
+        durations: Durations of each timed batch (seconds)
+        resolution: Input resolution in pixels (optional)
+        batch_size: Number of items processed per timed batch
+        **extra: Additional fields stored with the result
+
+    Returns:
+        Result dictionary
+    """
+    values = np.asarray(durations, dtype=np.float64)
+    per_item = values / batch_size
+    result = {
+        "name": name,
+        "resolution": resolution,
+        "batch_size": batch_size,
+        "repeats": len(durations),
+        "mean_s": float(per_item.mean()),
+        "p50_s": float(np.percentile(per_item, 50)),
+        "p95_s": float(np.percentile(per_item, 95)),
+        "min_s": float(per_item.min()),
+        "std_s": float(per_item.std()),
+        "items_per_s": float(batch_size / np.median(values))
+    }
+    result.update(extra)
+    return result
+
+
+def result_key(result: Dict[str, Any]) -> str:
+    """
+    Key identifying a benchmark case across runs
+    """
+    return f"{result['name']}@{result.get('resolution')}x{result.get('batch_size', 1)}"
+
+
+def environment_metadata() -> Dict[str, Any]:
+    """
+    Describe the machine and library versions a run was made with
+    """
+    metadata = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__
+    }
+    try:
+        import cv2
+        metadata["opencv"] = cv2.__version__
+        metadata["opencv_threads"] = cv2.getNumThreads()
+    except ImportError:
+        pass
+    return metadata
+
+
+def save_results(results: List[Dict[str, Any]], path: str, metadata: Dict[str, Any] = None):
+    """
+    Write benchmark results to a JSON file
+
+    Args:
+        results: Result dictionaries (see summarize)
+        path: Output file path
+        metadata: Run metadata (defaults to environment_metadata())
+    """
+    with open(path, "w") as f:
+        json.dump({"metadata": metadata or environment_metadata(), "results": results}, f, indent=2)
+
+
+def load_results(path: str) -> List[Dict[str, Any]]:
+    """
+    Load benchmark results written by save_results
+    """
+    with open(path, "r") as f:
+        return json.load(f)["results"]
+
+
+def compare_results(current: List[Dict[str, Any]], baseline: List[Dict[str, Any]],
+                    threshold: float = 0.2, metric: str = "p50_s") -> List[Dict[str, Any]]:
+    """
+    Compare a run against a stored baseline
+
+    Args:
+        current: Results of the current run
+        baseline: Results of the baseline run
+        threshold: Allowed relative slowdown before a case counts as a regression
+        metric: Per-item timing metric to compare
+
+    Returns:
+        One comparison entry per case present in both runs, with a
+        "regression" flag set when the slowdown exceeds the threshold
+    """
+    baseline_by_key = {result_key(r): r for r in baseline}
+    comparisons = []
+    for result in current:
+        key = result_key(result)
+        if key not in baseline_by_key:
+            continue
+        before = baseline_by_key[key][metric]
+        after = result[metric]
+        change = (after - before) / before if before > 0 else 0.0
+        comparisons.append({
+            "case": key,
+            "baseline": before,
+            "current": after,
+            "change": change,
+            "regression": change > threshold
+        })
+    return comparisons
+
+
+def format_table(results: List[Dict[str, Any]]) -> str:
+    """
+    Format results as a plain-text table
+    """
+    lines = [f"{'case':<48} {'p50 ms':>10} {'p95 ms':>10} {'items/s':>10}"]
+    for result in results:
+        lines.append(
+            f"{result_key(result):<48} {result['p50_s'] * 1000:>10.3f} "
+            f"{result['p95_s'] * 1000:>10.3f} {result['items_per_s']:>10.1f}"
+        )
+    return "\n".join(lines)
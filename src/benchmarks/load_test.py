@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+HTTP Load Test for AI-PsychDoodle-Analyzer
+Drives a running server with a synthetic or recorded request mix and reports
+latency percentiles, throughput, error rates and per-worker CPU usage
+
+Usage:
+    # Closed loop: 16 concurrent clients for 60 s against a running server
+    python src/benchmarks/load_test.py --url http://localhost:8000 --concurrency 16 --duration 60
+
+    # Open loop: Poisson arrivals at 50 req/s, server started with gunicorn_conf.py
+    python src/benchmarks/load_test.py --start-server --workers 4 --mode open --rate 50
+
+    # Replay a recorded request mix
+    python src/benchmarks/load_test.py --requests recorded.jsonl --concurrency 8
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import subprocess
+from collections import defaultdict
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.synthetic_drawings import generate_shape_request, generate_doodle_request
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# BGR palette of GauGANAdapter.color_map (kept here so the load generator
+# does not need the model dependencies installed)
+DOODLE_PALETTE = [
+    (0, 0, 255), (0, 255, 0), (255, 0, 0), (255, 255, 0), (255, 0, 255),
+    (0, 255, 255), (128, 128, 128), (255, 255, 255), (0, 0, 0)
+]
+
+
+def synthetic_request_mix(mix: Dict[str, float], variants: int = 16,
+                          resolution: int = 256, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Build a pool of synthetic requests
+
+    Args:
+        mix: Relative weight per endpoint kind ("shape", "doodle")
+        variants: Number of distinct payloads per kind
+        resolution: Image resolution of the payloads
+        seed: Random seed
+
+    Returns:
+        List of {"method", "path", "body", "weight"} entries
+    """
+    requests = []
+    for kind, weight in mix.items():
+        if weight <= 0:
+            continue
+        for i in range(variants):
+            if kind == "shape":
+                body = generate_shape_request(resolution, seed=seed + i)
+                path = "/shape-analysis"
+            elif kind == "doodle":
+                body = generate_doodle_request(DOODLE_PALETTE, resolution, seed=seed + i)
+                path = "/doodle-analysis"
+            else:
+                raise ValueError(f"Unknown request kind: {kind}")
+            requests.append({"method": "POST", "path": path, "body": body,
+                             "weight": weight / variants})
+    return requests
+
+
+def load_recorded_requests(path: str) -> List[Dict[str, Any]]:
+    """
+    Load recorded requests from a JSONL file with one
+    {"method", "path", "body"} object per line
+    """
+    requests = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            entry.setdefault("method", "POST")
+            entry.setdefault("weight", 1.0)
+            requests.append(entry)
+    return requests
+
+
+class WorkerCpuMonitor:
+    """
+    Measures CPU time consumed by the worker processes of a gunicorn master
+    (Linux only, reads /proc)
+    """
+
+    def __init__(self, master_pid: int):
+        self.master_pid = master_pid
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self._start = {}
+        self._start_time = None
+
+    def _children(self) -> List[int]:
+        children = []
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "r") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                if int(fields[1]) == self.master_pid:
+                    children.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+        return children
+
+    def _cpu_seconds(self, pid: int) -> Optional[float]:
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+            return (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def start(self):
+        self._start_time = time.monotonic()
+        self._start = {pid: self._cpu_seconds(pid) for pid in [self.master_pid] + self._children()}
+
+    def stop(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self._start_time
+        workers = {}
+        for pid in [self.master_pid] + self._children():
+            end = self._cpu_seconds(pid)
+            begin = self._start.get(pid) or 0.0
+            if end is None:
+                continue
+            cpu = end - begin
+            workers[str(pid)] = {
+                "role": "master" if pid == self.master_pid else "worker",
+                "cpu_seconds": cpu,
+                "cpu_utilization": cpu / elapsed if elapsed > 0 else 0.0
+            }
+        return {"elapsed_s": elapsed, "processes": workers}
+
+
+class LoadTestStats:
+    """
+    Collects per-request outcomes
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.status_codes = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+        self.dropped = 0
+
+    def record(self, path: str, latency: float, status: Optional[int]):
+        self.latencies[path].append(latency)
+        self.status_codes[path][str(status) if status is not None else "exception"] += 1
+        if status is None or status >= 400:
+            self.errors[path] += 1
+
+    def report(self, duration: float) -> Dict[str, Any]:
+        """
+        Summarize the collected outcomes
+
+        Args:
+            duration: Measurement window (seconds)
+        """
+        endpoints = {}
+        all_latencies = []
+        total_errors = 0
+        for path, values in self.latencies.items():
+            all_latencies.extend(values)
+            total_errors += self.errors[path]
+            endpoints[path] = self._summary(values, self.errors[path], duration)
+            endpoints[path]["status_codes"] = dict(self.status_codes[path])
+
+        overall = self._summary(all_latencies, total_errors, duration)
+        overall["dropped"] = self.dropped
+        return {"duration_s": duration, "overall": overall, "endpoints": endpoints}
+
+    @staticmethod
+    def _summary(values: List[float], errors: int, duration: float) -> Dict[str, Any]:
+        if not values:
+            return {"requests": 0, "errors": errors, "error_rate": 0.0, "throughput_rps": 0.0}
+        latencies = np.asarray(values) * 1000.0
+        return {
+            "requests": len(values),
+            "errors": errors,
+            "error_rate": errors / len(values),
+            "throughput_rps": (len(values) - errors) / duration if duration > 0 else 0.0,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()),
+            "mean_ms": float(latencies.mean())
+        }
+
+
+async def _send(client, request: Dict[str, Any], stats: LoadTestStats, record: bool):
+    start = time.perf_counter()
+    status = None
+    try:
+        response = await client.request(request["method"], request["path"], json=request.get("body"))
+        await response.aread()
+        status = response.status_code
+    except Exception as e:
+        logger.debug(f"Request to {request['path']} failed: {e}")
+    if record:
+        stats.record(request["path"], time.perf_counter() - start, status)
+
+
+async def run_closed_loop(client, requests: List[Dict[str, Any]], concurrency: int,
+                          duration: float, warmup: float, think_time: float,
+                          stats: LoadTestStats, seed: int = 0):
+    """
+    Each of `concurrency` clients sends its next request as soon as the
+    previous one completes (plus an optional think time)
+    """
+    weights = [r["weight"] for r in requests]
+    start = time.monotonic()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+
+    async def user(index: int):
+        rng = random.Random(seed + index)
+        while time.monotonic() < stop_at:
+            request = rng.choices(requests, weights)[0]
+            await _send(client, request, stats, record=time.monotonic() >= measure_from)
+            if think_time > 0:
+                await asyncio.sleep(rng.expovariate(1.0 / think_time))
+
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+
+
+async def run_open_loop(client, requests: List[Dict[str, Any]], rate: float,
+                        duration: float, warmup: float, max_outstanding: int,
+                        stats: LoadTestStats, poisson: bool = True, seed: int = 0):
+    """
+    Requests arrive at a fixed average rate independent of response times, so
+    queueing delay inside the server shows up in the measured latencies
+    """
+    rng = random.Random(seed)
+    weights = [r["weight"] for r in requests]
+    start = time.monotonic()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+    outstanding = set()
+    next_arrival = start
+
+    while next_arrival < stop_at:
+        delay = next_arrival - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        record = next_arrival >= measure_from
+        if len(outstanding) >= max_outstanding:
+            if record:
+                stats.dropped += 1
+        else:
+            request = rng.choices(requests, weights)[0]
+            task = asyncio.ensure_future(_send(client, request, stats, record))
+            outstanding.add(task)
+            task.add_done_callback(outstanding.discard)
+
+        next_arrival += rng.expovariate(rate) if poisson else 1.0 / rate
+
+    if outstanding:
+        await asyncio.gather(*outstanding)
+
+
+def start_server(workers: Optional[int], port: int, log_dir: str) -> subprocess.Popen:
+    """
+    Start the API server with the production gunicorn configuration
+    """
+    os.makedirs(os.path.join(REPO_ROOT, "logs"), exist_ok=True)
+    command = [
+        sys.executable, "-m", "gunicorn",
+        "-c", os.path.join(REPO_ROOT, "deployment", "server", "gunicorn_conf.py"),
+        "-b", f"127.0.0.1:{port}",
+        "src.api.server:app"
+    ]
+    if workers:
+        command[5:5] = ["-w", str(workers)]
+    logger.info(f"Starting server: {' '.join(command)}")
+    # All load test clients share one address, so the per-client rate limit
+    # would reject most of the load
+    env = dict(os.environ, API_RATE_LIMIT_ENABLED="false")
+    return subprocess.Popen(command, cwd=REPO_ROOT, env=env,
+                            stdout=open(os.path.join(log_dir, "server_stdout.log"), "w"),
+                            stderr=subprocess.STDOUT)
+
+
+async def wait_until_ready(client, workers: int = 1, timeout: float = 120.0):
+    """
+    Wait until the server's workers have finished warming up
+
+    Polls /health/ready on fresh connections until `workers` different
+    worker processes have reported ready. If only some of them have by the
+    timeout (connections need not reach every worker), the test starts with
+    a warning.
+    """
+    ready_pids = set()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get("/health/ready", headers={"Connection": "close"})
+            if response.status_code == 200:
+                ready_pids.add(response.json().get("pid"))
+                if len(ready_pids) >= workers:
+                    return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    if not ready_pids:
+        raise TimeoutError("Server did not become ready")
+    logger.warning(f"Only {len(ready_pids)} of {workers} workers reported ready")
+
+
+async def run_load_test(args) -> Dict[str, Any]:
+    import httpx
+
+    if args.requests:
+        requests = load_recorded_requests(args.requests)
+    else:
+        mix = {}
+        for part in args.mix.split(","):
+            kind, weight = part.split("=")
+            mix[kind.strip()] = float(weight)
+        requests = synthetic_request_mix(mix, args.variants, args.resolution, args.seed)
+
+    server_process = None
+    master_pid = args.server_pid
+    url = args.url
+    if args.start_server:
+        server_process = start_server(args.workers, args.port, args.log_dir)
+        master_pid = server_process.pid
+        url = f"http://127.0.0.1:{args.port}"
+
+    limits = httpx.Limits(max_connections=max(args.concurrency, args.max_outstanding),
+                          max_keepalive_connections=max(args.concurrency, args.max_outstanding))
+    try:
+        async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+            await wait_until_ready(client, args.workers if args.start_server and args.workers else 1)
+
+            stats = LoadTestStats()
+            monitor = WorkerCpuMonitor(master_pid) if master_pid else None
+            if monitor:
+                monitor.start()
+
+            started = time.monotonic()
+            if args.mode == "closed":
+                await run_closed_loop(client, requests, args.concurrency, args.duration,
+                                      args.warmup, args.think_time, stats, args.seed)
+            else:
+                await run_open_loop(client, requests, args.rate, args.duration, args.warmup,
+                                    args.max_outstanding, stats, not args.constant_rate, args.seed)
+            measured = time.monotonic() - started - args.warmup
+
+            report = stats.report(measured)
+            report["config"] = {
+                "url": url,
+                "mode": args.mode,
+                "concurrency": args.concurrency if args.mode == "closed" else None,
+                "rate": args.rate if args.mode == "open" else None,
+                "workers": args.workers,
+                "request_pool": len(requests)
+            }
+            if monitor:
+                report["cpu"] = monitor.stop()
+            return report
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait(timeout=30)
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [f"{'endpoint':<24} {'reqs':>7} {'err%':>6} {'rps':>8} "
+             f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"]
+    rows = list(report["endpoints"].items()) + [("overall", report["overall"])]
+    for name, s in rows:
+        if not s["requests"]:
+            continue
+        lines.append(f"{name:<24} {s['requests']:>7} {s['error_rate'] * 100:>6.2f} "
+                     f"{s['throughput_rps']:>8.1f} {s['p50_ms']:>9.1f} "
+                     f"{s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f}")
+    if report["overall"].get("dropped"):
+        lines.append(f"dropped arrivals (max outstanding reached): {report['overall']['dropped']}")
+    for pid, p in report.get("cpu", {}).get("processes", {}).items():
+        lines.append(f"{p['role']:<8} pid {pid:<8} cpu {p['cpu_utilization'] * 100:>6.1f}%")
+    return "\n".join(lines)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="AI-PsychDoodle-Analyzer Load Test")
+    parser.add_argument("--url", default="http://localhost:8000", help="Server base URL")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clients in closed-loop mode")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="Mean think time between requests per client (seconds)")
+    parser.add_argument("--rate", type=float, default=10.0, help="Arrival rate in open-loop mode (req/s)")
+    parser.add_argument("--constant-rate", action="store_true",
+                        help="Evenly spaced instead of Poisson arrivals in open-loop mode")
+    parser.add_argument("--max-outstanding", type=int, default=256,
+                        help="Maximum concurrent requests in open-loop mode")
+    parser.add_argument("--duration", type=float, default=30.0, help="Measurement window (seconds)")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Unmeasured warm-up (seconds)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Request timeout (seconds)")
+    parser.add_argument("--mix", default="shape=0.8,doodle=0.2",
+                        help="Synthetic request mix as kind=weight pairs")
+    parser.add_argument("--variants", type=int, default=16, help="Distinct synthetic payloads per kind")
+    parser.add_argument("--resolution", type=int, default=256, help="Synthetic image resolution")
+    parser.add_argument("--requests", help="Replay requests from this JSONL file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server-pid", type=int, help="gunicorn master PID for per-worker CPU")
+    parser.add_argument("--start-server", action="store_true",
+                        help="Start gunicorn with deployment/server/gunicorn_conf.py")
+    parser.add_argument("--workers", type=int, help="Worker count when starting the server")
+    parser.add_argument("--port", type=int, default=8765, help="Port when starting the server")
+    parser.add_argument("--log-dir", default=".", help="Directory for the started server's output")
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_load_test(args))
+    print(format_report(report))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Saved report to {args.output}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite for AI-PsychDoodle-Analyzer
+Times the image utilities, analyzers, GauGAN adapter and API end to end on synthetic inputs
+
+Usage:
+    python src/benchmarks/run_benchmarks.py --output results.json
+    python src/benchmarks/run_benchmarks.py --baseline baseline.json --threshold 0.2
+"""
+
+import os
+import re
+import sys
+import base64
+import argparse
+import logging
+from typing import Callable, Dict, Any, List
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import image_processing
+from utils.buffer_pool import get_buffer_pool
+from utils.synthetic_drawings import (SHAPE_TYPES, generate_shape_image, generate_traced_shape,
+                                      generate_doodle, to_base64_png)
+from benchmarks.harness import (time_callable, summarize, save_results, load_results,
+                                compare_results, format_table, environment_metadata)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class BenchmarkContext:
+    """
+    Lazily created components and synthetic inputs shared by all benchmark cases
+    """
+
+    def __init__(self, seed: int = 0):
+        self.seed = seed
+        self._components = {}
+
+    def component(self, name: str):
+        """
+        Get a shared component instance ("shape_analyzer", "drawing_analyzer",
+        "gaugan_adapter" or "api_client")
+        """
+        if name not in self._components:
+            if name == "shape_analyzer":
+                from models.shape_analyzer import ShapeAnalyzer
+                self._components[name] = ShapeAnalyzer()
+            elif name == "drawing_analyzer":
+                from models.drawing_analyzer import DrawingAnalyzer
+                self._components[name] = DrawingAnalyzer()
+            elif name == "gaugan_adapter":
+                from models.gaugan_adapter import GauGANAdapter
+                self._components[name] = GauGANAdapter()
+            elif name == "api_client":
+                # All benchmark requests come from one client, so the
+                # per-client rate limit would reject most of them
+                os.environ["API_RATE_LIMIT_ENABLED"] = "false"
+                from fastapi.testclient import TestClient
+                from api import server
+                self._components[name] = TestClient(server.app)
+            else:
+                raise KeyError(name)
+        return self._components[name]
+
+    @property
+    def palette(self) -> List:
+        return list(self.component("gaugan_adapter").color_map.keys())
+
+    def tracings(self, resolution: int, count: int) -> List[Dict[str, Any]]:
+        """
+        Generate (original, traced, shape_type) tracing inputs
+        """
+        rng = np.random.RandomState(self.seed)
+        items = []
+        for i in range(count):
+            shape_type = SHAPE_TYPES[i % len(SHAPE_TYPES)]
+            items.append({
+                "original": generate_shape_image(shape_type, resolution),
+                "traced": generate_traced_shape(
+                    shape_type, resolution,
+                    jitter=float(rng.uniform(0.0, 0.03)),
+                    completion=float(rng.uniform(0.6, 1.0)),
+                    seed=self.seed + i
+                ),
+                "shape_type": shape_type,
+                "response_time": float(rng.uniform(0.5, 6.0))
+            })
+        return items
+
+    def doodles(self, resolution: int, count: int) -> List[np.ndarray]:
+        return [generate_doodle(self.palette, resolution, seed=self.seed + i) for i in range(count)]
+
+
+def _batch(fn: Callable[[Any], Any], items: List[Any]) -> Callable[[], None]:
+    def run():
+        for item in items:
+            fn(item)
+    return run
+
+
+def build_cases(ctx: BenchmarkContext, resolution: int, batch_size: int) -> Dict[str, Callable[[], None]]:
+    """
+    Build the benchmark cases for one resolution and batch size
+
+    Returns:
+        Mapping of benchmark name to a callable processing one batch
+    """
+    cases = {}
+
+    # Image utilities
+    def doodles():
+        return ctx.doodles(resolution, batch_size)
+
+    def encoded_doodles():
+        return [to_base64_png(d) for d in doodles()]
+
+    cases["image_processing.decode_base64_image"] = lambda: _batch(
+        image_processing.decode_base64_image, encoded_doodles())
+    cases["image_processing.encode_base64_image"] = lambda: _batch(
+        image_processing.encode_base64_image, doodles())
+    for image_format in image_processing.supported_image_formats():
+        for quality in image_processing.QUALITY_TIERS:
+            cases[f"image_processing.encode_image.{image_format}.{quality}"] = (
+                lambda f=image_format, q=quality: _batch(
+                    lambda img: image_processing.encode_image(img, f, q), doodles()))
+    cases["image_processing.resize_image"] = lambda: _batch(
+        lambda img: image_processing.resize_image(img, (224, 224)), doodles())
+    cases["image_processing.apply_threshold"] = lambda: _batch(
+        image_processing.apply_threshold, doodles())
+    cases["image_processing.calculate_iou"] = lambda: _batch(
+        lambda t: image_processing.calculate_iou(t["original"], t["traced"]),
+        ctx.tracings(resolution, batch_size))
+    cases["image_processing.calculate_color_histogram"] = lambda: _batch(
+        image_processing.calculate_color_histogram, doodles())
+    cases["image_processing.detect_dominant_colors"] = lambda: _batch(
+        image_processing.detect_dominant_colors, doodles())
+    for method in ("histogram", "median_cut", "kmeans"):
+        cases[f"image_processing.detect_dominant_colors.{method}"] = (
+            lambda m=method: _batch(
+                lambda img: image_processing.detect_dominant_colors(img, method=m), doodles()))
+    cases["image_processing.detect_dominant_colors_batch"] = lambda: (
+        lambda images=doodles(): image_processing.detect_dominant_colors_batch(images))
+
+    # Analyzers and adapter
+    def analyze_tracing(t):
+        ctx.component("shape_analyzer").analyze(
+            original_image=t["original"], traced_image=t["traced"],
+            response_time=t["response_time"], shape_type=t["shape_type"]
+        )
+
+    cases["shape_analyzer.analyze"] = lambda: _batch(
+        analyze_tracing, ctx.tracings(resolution, batch_size))
+    def segment_doodle(doodle):
+        segments = ctx.component("gaugan_adapter")._segment_doodle(doodle)
+        get_buffer_pool().release(*segments.values())
+
+    cases["gaugan_adapter.segment_doodle"] = lambda: _batch(segment_doodle, doodles())
+    cases["gaugan_adapter.transform"] = lambda: _batch(
+        ctx.component("gaugan_adapter").transform, doodles())
+    cases["drawing_analyzer.analyze_image"] = lambda: _batch(
+        ctx.component("drawing_analyzer").analyze_image, doodles())
+
+    # API end to end (in-process, including request parsing and serialization)
+    def shape_request(t):
+        return {
+            "original_image": to_base64_png(t["original"]),
+            "traced_image": to_base64_png(t["traced"]),
+            "response_time": t["response_time"],
+            "shape_type": t["shape_type"]
+        }
+
+    def post(path):
+        def send(body):
+            response = ctx.component("api_client").post(path, json=body)
+            response.raise_for_status()
+        return send
+
+    cases["api./shape-analysis"] = lambda: _batch(
+        post("/shape-analysis"), [shape_request(t) for t in ctx.tracings(resolution, batch_size)])
+    cases["api./doodle-analysis"] = lambda: _batch(
+        post("/doodle-analysis"), [{"doodle_image": d} for d in encoded_doodles()])
+
+    # Response serialization: pydantic + stdlib json (previous path) versus
+    # orjson and the streamed base64 response, for a generated-image payload
+    def serialization_payload():
+        noise = np.random.RandomState(ctx.seed).randint(0, 256, (resolution, resolution, 3), np.uint8)
+        image_bytes = image_processing.encode_image(noise)
+        emotions = ["calm", "anxious", "energetic", "melancholic",
+                    "creative", "logical", "joyful", "contemplative"]
+        content = {
+            "analysis_id": "550e8400-e29b-41d4-a716-446655440001",
+            "generated_image_ref": None,
+            "doodle_image_ref": None,
+            "emotional_state": {e: 1.0 / len(emotions) for e in emotions},
+            "feedback": "Your drawing shows remarkable imagination and creativity.",
+            "recommendation": "Your imaginative state is perfect for artistic expression.",
+            "model_version": "3f9a1c0b72de"
+        }
+        return content, image_bytes
+
+    def pydantic_stdlib(payload):
+        from fastapi.encoders import jsonable_encoder
+        from fastapi.responses import JSONResponse
+        from api.server import DoodleAnalysisResponse
+        content, image_bytes = payload
+        data_uri = "data:image/jpeg;base64," + base64.b64encode(image_bytes).decode("utf-8")
+        model = DoodleAnalysisResponse(generated_image=data_uri, **content)
+        return JSONResponse(jsonable_encoder(model)).body
+
+    def fast_json(payload):
+        from api.responses import FastJSONResponse
+        content, image_bytes = payload
+        data_uri = "data:image/jpeg;base64," + base64.b64encode(image_bytes).decode("utf-8")
+        return FastJSONResponse(dict(content, generated_image=data_uri)).body
+
+    def streamed_base64(payload):
+        from api.responses import StreamedBase64JSONResponse
+        content, image_bytes = payload
+        response = StreamedBase64JSONResponse(content, "generated_image", image_bytes,
+                                              prefix="data:image/jpeg;base64,")
+        return b"".join(response.iter_body())
+
+    cases["serialization.pydantic_stdlib"] = lambda: _batch(
+        pydantic_stdlib, [serialization_payload()] * batch_size)
+    cases["serialization.orjson"] = lambda: _batch(
+        fast_json, [serialization_payload()] * batch_size)
+    cases["serialization.streamed_base64"] = lambda: _batch(
+        streamed_base64, [serialization_payload()] * batch_size)
+
+    return cases
+
+
+def run_suite(resolutions: List[int], batch_sizes: List[int], repeats: int = 5,
+              warmup: int = 1, pattern: str = None, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Run all benchmark cases matching a pattern
+
+    Args:
+        resolutions: Input resolutions (square images, pixels)
+        batch_sizes: Numbers of items processed per timed batch
+        repeats: Timed batches per case
+        warmup: Untimed batches per case
+        pattern: Regular expression selecting benchmark names (optional)
+        seed: Seed for the synthetic inputs
+
+    Returns:
+        List of result dictionaries
+    """
+    ctx = BenchmarkContext(seed)
+    selector = re.compile(pattern) if pattern else None
+    results = []
+
+    for resolution in resolutions:
+        for batch_size in batch_sizes:
+            for name, factory in build_cases(ctx, resolution, batch_size).items():
+                if selector and not selector.search(name):
+                    continue
+                try:
+                    fn = factory()
+                except ImportError as e:
+                    logger.warning(f"Skipping {name}: {e}")
+                    continue
+
+                # Count buffer pool allocations made by the timed (post-warm-up)
+                # batches: zero means the case reached steady state
+                pool = get_buffer_pool()
+                for _ in range(warmup):
+                    fn()
+                allocations = pool.stats()["allocations"]
+                durations = time_callable(fn, repeats=repeats, warmup=0)
+                result = summarize(name, durations, resolution=resolution, batch_size=batch_size,
+                                   pool_allocations=pool.stats()["allocations"] - allocations)
+                logger.info(f"{name} @{resolution}px x{batch_size}: "
+                            f"{result['p50_s'] * 1000:.3f} ms/item")
+                results.append(result)
+
+    return results
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="AI-PsychDoodle-Analyzer Benchmarks")
+    parser.add_argument("--resolutions", default="128,256,512,1024",
+                        help="Comma-separated square input resolutions")
+    parser.add_argument("--batch-sizes", default="1,8", help="Comma-separated batch sizes")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed batches per case")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed batches per case")
+    parser.add_argument("--filter", help="Regular expression selecting benchmark names")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for synthetic inputs")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this JSON results file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed relative slowdown against the baseline")
+    args = parser.parse_args(argv)
+
+    results = run_suite(
+        resolutions=[int(r) for r in args.resolutions.split(",")],
+        batch_sizes=[int(b) for b in args.batch_sizes.split(",")],
+        repeats=args.repeats,
+        warmup=args.warmup,
+        pattern=args.filter,
+        seed=args.seed
+    )
+
+    print(format_table(results))
+
+    if args.output:
+        save_results(results, args.output, environment_metadata())
+        logger.info(f"Saved results to {args.output}")
+
+    if args.baseline:
+        comparisons = compare_results(results, load_results(args.baseline), args.threshold)
+        regressions = [c for c in comparisons if c["regression"]]
+        for c in comparisons:
+            marker = "REGRESSION" if c["regression"] else "ok"
+            print(f"{c['case']:<48} {c['change'] * 100:>+8.1f}%  {marker}")
+        if regressions:
+            logger.error(f"{len(regressions)} case(s) slower than baseline by more than "
+                         f"{args.threshold * 100:.0f}%")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
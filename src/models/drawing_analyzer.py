@@ -7,24 +7,64 @@ Analyzes free-form drawings and GauGAN-generated images
 import os
 import numpy as np
 import cv2
-from typing import Dict, Any, Tuple, List
+from typing import Callable, Dict, Any, Tuple, List, Optional, Union
 from PIL import Image
 import tensorflow as tf
+
+from models.weight_store import is_weight_file, load_keras_model
+from models.heuristic_engine import HeuristicEngine, default_spec_path
+from utils.stage_timing import stage
+from utils.image_context import ImageContext
+from utils.buffer_pool import get_buffer_pool
+from utils.composition import RegionStatistics
 import random
 
+# Resolution (pixels, square) features are computed at for the full analysis
+ANALYSIS_SIZE = 224
+
+# Default lead of the top emotion needed to stop at a coarse pyramid level.
+# Coarse results change the scores, not only the top emotion: tune it against
+# the score drift reported by benchmarks/early_exit_agreement.py
+DEFAULT_CONFIDENCE_MARGIN = 0.01
+
 class DrawingAnalyzer:
     """
     Analyzes free-form drawings and GauGAN-generated images to determine
     psychological state based on color usage, composition, and visual elements.
+    
+    With pyramid levels configured, analysis runs coarse to fine: features are
+    first computed on small copies of the image (e.g. 56 and 112 pixels), and
+    the result is returned as soon as the top emotion leads the runner-up by
+    at least the confidence margin. Only close calls are refined at full
+    resolution. Early results are approximations of the full analysis, so
+    early exit is off unless pyramid levels are given.
     """
     
-    def __init__(self, model_path: str = None):
+    # Version of the features returned by _extract_features; increase it
+    # whenever they change, so stored features are not reused
+    FEATURE_VERSION = 1
+    
+    def __init__(self, model_path: str = None, pyramid_levels: List[int] = None,
+                 confidence_margin: float = DEFAULT_CONFIDENCE_MARGIN,
+                 on_level_used: Optional[Callable[[int], None]] = None,
+                 heuristics_path: str = None):
         """
         Initialize the drawing analyzer model
         
         Args:
             model_path: Path to the pre-trained model (optional)
+            pyramid_levels: Coarse resolutions to try before the full analysis,
+                smallest first (optional; empty disables early exit)
+            confidence_margin: Minimum lead of the top emotion over the
+                runner-up for a coarse result to be returned
+            on_level_used: Called with the resolution each analysis finished at
+            heuristics_path: Spec file of the heuristics used without a model
+                (optional; see models/heuristic_engine.py)
         """
+        self.pyramid_levels = sorted(size for size in (pyramid_levels or []) if size < ANALYSIS_SIZE)
+        self.confidence_margin = confidence_margin
+        self.on_level_used = on_level_used
+
         self.model_path = model_path or os.path.join(
             os.path.dirname(os.path.abspath(__file__)),
             "weights/drawing_analyzer_model.h5"
@@ -34,7 +74,10 @@ class DrawingAnalyzer:
         self.model = None
         if os.path.exists(self.model_path):
             try:
-                self.model = tf.keras.models.load_model(self.model_path)
+                if is_weight_file(self.model_path):
+                    self.model = load_keras_model(self.model_path)
+                else:
+                    self.model = tf.keras.models.load_model(self.model_path)
             except Exception as e:
                 print(f"Warning: Could not load model from {self.model_path}: {e}")
                 print("Using heuristic-based analysis instead.")
@@ -45,20 +88,11 @@ class DrawingAnalyzer:
             "creative", "logical", "joyful", "contemplative"
         ]
         
-        # Color-emotion associations (based on color psychology research)
-        self.color_emotions = {
-            "red": {"energetic": 0.8, "anxious": 0.6, "joyful": 0.4, "melancholic": 0.1},
-            "blue": {"calm": 0.8, "contemplative": 0.7, "melancholic": 0.4, "anxious": 0.2},
-            "green": {"calm": 0.7, "creative": 0.5, "logical": 0.4, "joyful": 0.4},
-            "yellow": {"joyful": 0.8, "energetic": 0.7, "creative": 0.6, "anxious": 0.3},
-            "purple": {"creative": 0.7, "contemplative": 0.6, "melancholic": 0.4, "calm": 0.3},
-            "orange": {"energetic": 0.7, "joyful": 0.6, "creative": 0.5, "anxious": 0.3},
-            "pink": {"joyful": 0.7, "creative": 0.5, "energetic": 0.4, "calm": 0.3},
-            "brown": {"logical": 0.7, "contemplative": 0.6, "melancholic": 0.5, "calm": 0.4},
-            "black": {"melancholic": 0.7, "contemplative": 0.6, "logical": 0.5, "anxious": 0.4},
-            "white": {"logical": 0.6, "calm": 0.5, "contemplative": 0.4, "melancholic": 0.3},
-            "gray": {"logical": 0.6, "contemplative": 0.5, "melancholic": 0.4, "calm": 0.3}
-        }
+        # Heuristic scoring (used when no model is loaded), including the
+        # color-emotion associations
+        self.heuristics = HeuristicEngine.load(heuristics_path or default_spec_path("drawing"))
+        if sorted(self.heuristics.emotions) != sorted(self.emotion_categories):
+            raise ValueError(f"Heuristics {heuristics_path} do not score the drawing emotion categories")
         
         # Feedback templates
         self.feedback_templates = {
@@ -132,129 +166,196 @@ class DrawingAnalyzer:
             ]
         }
     
-    def analyze_image(self, image: np.ndarray) -> Dict[str, float]:
+    def analyze_image(self, image: Union[np.ndarray, ImageContext]) -> Dict[str, float]:
         """
         Analyze the image to determine psychological state
         
         Args:
-            image: The image to analyze
+            image: The image to analyze or its ImageContext
+            
+        Returns:
+            Dictionary mapping emotional states to scores (0.0-1.0)
+        """
+        image = ImageContext.of(image)
+        
+        # Try the coarse levels first and stop at the first confident result
+        for size in self.pyramid_levels:
+            emotions = self.analyze_at(image, size)
+            if self.confidence(emotions) >= self.confidence_margin:
+                if self.on_level_used:
+                    self.on_level_used(size)
+                return emotions
+        
+        emotions = self.analyze_at(image, ANALYSIS_SIZE)
+        if self.on_level_used:
+            self.on_level_used(ANALYSIS_SIZE)
+        return emotions
+    
+    def analyze_at(self, image: Union[np.ndarray, ImageContext], size: int = ANALYSIS_SIZE) -> Dict[str, float]:
+        """
+        Analyze the image with features computed at one resolution
+        
+        Args:
+            image: The image to analyze or its ImageContext
+            size: Analysis resolution in pixels (square)
             
         Returns:
             Dictionary mapping emotional states to scores (0.0-1.0)
         """
+        image = ImageContext.of(image)
+        
         # If the model is loaded, use it for prediction
         if self.model:
-            return self._model_based_analysis(image)
+            return self._model_based_analysis(image, size)
         
         # Otherwise use heuristic analysis
-        return self._heuristic_analysis(image)
+        return self._heuristic_analysis(image, size)
+    
+    def extract_features(self, image: Union[np.ndarray, ImageContext], size: int = ANALYSIS_SIZE) -> Dict[str, Any]:
+        """
+        Extract the features the analysis is based on
+        
+        Args:
+            image: The image to analyze or its ImageContext
+            size: Analysis resolution in pixels (square)
+            
+        Returns:
+            Dictionary of feature values, with the color distribution and
+            the regional composition as nested dictionaries (see FEATURE_VERSION)
+        """
+        with stage("feature_extraction"):
+            return self._extract_features(ImageContext.of(image), size)
+    
+    def score_features(self, features: Dict[str, Any]) -> Dict[str, float]:
+        """
+        Score extracted features (e.g. stored ones) with the model, or the
+        heuristics if no model is loaded
+        
+        Args:
+            features: Features returned by extract_features
+            
+        Returns:
+            Dictionary mapping emotional states to scores (0.0-1.0)
+        """
+        if self.model:
+            return self._model_scores(features)
+        return self._heuristic_scores(features)
     
-    def _model_based_analysis(self, image: np.ndarray) -> Dict[str, float]:
+    @staticmethod
+    def confidence(emotions: Dict[str, float]) -> float:
+        """
+        Lead of the top emotion over the runner-up
+        
+        Args:
+            emotions: Dictionary mapping emotional states to scores
+            
+        Returns:
+            Difference between the two highest scores
+        """
+        top = sorted(emotions.values(), reverse=True)
+        return top[0] - top[1] if len(top) > 1 else 1.0
+    
+    def _model_based_analysis(self, image: ImageContext, size: int = ANALYSIS_SIZE) -> Dict[str, float]:
         """
         Use the trained model to analyze the image
         """
         # Extract features
-        features = self._extract_features(image)
-        
+        with stage("feature_extraction"):
+            features = self._extract_features(image, size)
+        return self._model_scores(features)
+    
+    def _model_scores(self, features: Dict[str, Any]) -> Dict[str, float]:
+        """
+        Emotion scores of the trained model for extracted features
+        """
         # Prepare model input (normalize and reshape)
-        model_input = np.expand_dims(np.array(list(features.values())), axis=0)
+        # (the regional composition features are not part of the model's input)
+        model_input = np.expand_dims(np.array([v for k, v in features.items() if k != "composition"]), axis=0)
         
         # Get model predictions
-        predictions = self.model.predict(model_input)[0]
+        with stage("model_inference"):
+            predictions = self.model.predict(model_input)[0]
         
         # Map predictions to emotion categories
         emotions = {category: float(score) for category, score in zip(self.emotion_categories, predictions)}
         
         return emotions
     
-    def _heuristic_analysis(self, image: np.ndarray) -> Dict[str, float]:
+    def _heuristic_analysis(self, image: ImageContext, size: int = ANALYSIS_SIZE) -> Dict[str, float]:
         """
         Use heuristics to analyze the image when the model is not available
         """
         # Extract features
-        features = self._extract_features(image)
-        
-        # Initialize emotion scores
-        emotions = {emotion: 0.0 for emotion in self.emotion_categories}
-        
-        # Calculate color-based emotions
-        for color, percentage in features["color_distribution"].items():
-            if color in self.color_emotions:
-                for emotion, weight in self.color_emotions[color].items():
-                    emotions[emotion] += percentage * weight
-        
-        # Adjust based on composition features
-        # - High complexity can indicate creativity or anxiety
-        complexity = features["complexity"]
-        emotions["creative"] += complexity * 0.5
-        emotions["anxious"] += complexity * 0.3
-        
-        # - Balance can indicate calmness or logical thinking
-        balance = features["balance"]
-        emotions["calm"] += balance * 0.5
-        emotions["logical"] += balance * 0.4
-        
-        # - Contrast can indicate energy or melancholy
-        contrast = features["contrast"]
-        emotions["energetic"] += contrast * 0.4
-        emotions["melancholic"] += (1 - contrast) * 0.3
-        
-        # - Brightness can indicate joy or contemplation
-        brightness = features["brightness"]
-        emotions["joyful"] += brightness * 0.6
-        emotions["contemplative"] += (1 - brightness) * 0.5
-        
-        # Normalize scores to sum to 1.0
-        total = sum(emotions.values())
-        if total > 0:
-            emotions = {k: v/total for k, v in emotions.items()}
-        else:
-            # Default to equal distribution if all scores are 0
-            emotions = {k: 1.0/len(emotions) for k in emotions}
-        
-        return emotions
+        with stage("feature_extraction"):
+            features = self._extract_features(image, size)
+        return self._heuristic_scores(features)
     
-    def _extract_features(self, image: np.ndarray) -> Dict[str, Any]:
+    def _heuristic_scores(self, features: Dict[str, Any]) -> Dict[str, float]:
         """
-        Extract visual features from the image
+        Heuristic emotion scores for extracted features
+        """
+        return self.heuristics.score(features)
+    
+    def _extract_features(self, image: ImageContext, size: int = ANALYSIS_SIZE) -> Dict[str, Any]:
         """
-        # Convert image to RGB if it's BGR
-        if len(image.shape) == 3 and image.shape[2] == 3:
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        else:
-            rgb_image = image
+        Extract visual features from the image
         
-        # Resize for consistent analysis
-        resized = cv2.resize(rgb_image, (224, 224))
+        Args:
+            image: The image to analyze
+            size: Analysis resolution in pixels (square)
+        """
+        # Resize for consistent analysis. Coarse levels are area-averaged from
+        # the full-resolution copy (a pyramid), which is then already cached
+        # if the analysis has to be refined
+        resized = image.resized((ANALYSIS_SIZE, ANALYSIS_SIZE))
+        if size != ANALYSIS_SIZE:
+            resized = resized.resized((size, size), cv2.INTER_AREA)
+        half = size // 2
         
         # Extract color distribution
         color_distribution = self._analyze_colors(resized)
         
         # Calculate image complexity (edge density)
-        gray = cv2.cvtColor(resized, cv2.COLOR_RGB2GRAY)
-        edges = cv2.Canny(gray, 100, 200)
-        complexity = np.count_nonzero(edges) / (224 * 224)
-        
-        # Calculate balance (symmetry)
-        left_half = gray[:, :112]
-        right_half = cv2.flip(gray[:, 112:], 1)
-        balance = 1.0 - (np.sum(np.abs(left_half - right_half)) / (112 * 224 * 255))
-        
-        # Calculate contrast
-        contrast = np.std(gray) / 128.0  # Normalize by half of max intensity
-        
-        # Calculate brightness
-        brightness = np.mean(gray) / 255.0
+        # Edges are curves, so their pixel count grows linearly with the
+        # resolution while the area grows quadratically: scale the density to
+        # its full-resolution equivalent
+        gray = resized.gray()
+        edges = resized.edges(100, 200)
+        edge_scale = size / ANALYSIS_SIZE
+        complexity = cv2.countNonZero(edges) / (size * size) * edge_scale
+        
+        # Calculate balance (symmetry); absdiff avoids uint8 wraparound
+        left_half = gray[:, :half]
+        right_half = cv2.flip(gray[:, size - half:], 1)
+        balance = 1.0 - (float(cv2.absdiff(left_half, right_half).sum()) / (half * size * 255))
+        
+        # Regional composition: brightness, contrast, edge density and color
+        # mass (saturation) of halves, quadrants, thirds, center and periphery
+        layers = {
+            "edge_density": edges,
+            "color_mass": cv2.extractChannel(resized.hsv(), 1)
+        }
+        with RegionStatistics(gray, layers, pool=get_buffer_pool()) as regions:
+            composition = regions.layout()
+            
+            # Calculate contrast and brightness from the whole-image sums
+            # (contrast is normalized by half of max intensity)
+            overall = regions.region((0, 0, size, size))
+        for stats in composition.values():
+            stats["edge_density"] *= edge_scale
+        contrast = overall["contrast"]
+        brightness = overall["brightness"]
         
         return {
             "color_distribution": color_distribution,
             "complexity": complexity,
             "balance": balance,
             "contrast": contrast,
-            "brightness": brightness
+            "brightness": brightness,
+            "composition": composition
         }
     
-    def _analyze_colors(self, image: np.ndarray) -> Dict[str, float]:
+    def _analyze_colors(self, image: ImageContext) -> Dict[str, float]:
         """
         Analyze the color distribution in the image
         """
@@ -275,7 +376,7 @@ class DrawingAnalyzer:
         }
         
         # Convert to HSV
-        hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+        hsv = image.hsv()
         
         # Get total pixel count
         total_pixels = image.shape[0] * image.shape[1]
@@ -283,21 +384,23 @@ class DrawingAnalyzer:
         # Calculate color distribution
         color_distribution = {}
         
-        # Process red as a special case (it wraps around in HSV)
-        red1_mask = cv2.inRange(hsv, np.array(color_ranges["red1"][0]), np.array(color_ranges["red1"][1]))
-        red2_mask = cv2.inRange(hsv, np.array(color_ranges["red2"][0]), np.array(color_ranges["red2"][1]))
-        red_mask = cv2.bitwise_or(red1_mask, red2_mask)
-        red_pixels = np.count_nonzero(red_mask)
-        color_distribution["red"] = red_pixels / total_pixels
-        
-        # Process other colors
-        for color, (lower, upper) in color_ranges.items():
-            if color in ["red1", "red2"]:  # Skip red as it's handled separately
-                continue
-                
-            mask = cv2.inRange(hsv, np.array(lower), np.array(upper))
-            color_pixels = np.count_nonzero(mask)
-            color_distribution[color] = color_pixels / total_pixels
+        pool = get_buffer_pool()
+        with pool.borrow(hsv.shape[:2]) as mask, pool.borrow(hsv.shape[:2]) as red_mask:
+            # Process red as a special case (it wraps around in HSV)
+            cv2.inRange(hsv, np.array(color_ranges["red1"][0]), np.array(color_ranges["red1"][1]), dst=red_mask)
+            cv2.inRange(hsv, np.array(color_ranges["red2"][0]), np.array(color_ranges["red2"][1]), dst=mask)
+            cv2.bitwise_or(red_mask, mask, dst=red_mask)
+            red_pixels = cv2.countNonZero(red_mask)
+            color_distribution["red"] = red_pixels / total_pixels
+            
+            # Process other colors
+            for color, (lower, upper) in color_ranges.items():
+                if color in ["red1", "red2"]:  # Skip red as it's handled separately
+                    continue
+                    
+                cv2.inRange(hsv, np.array(lower), np.array(upper), dst=mask)
+                color_pixels = cv2.countNonZero(mask)
+                color_distribution[color] = color_pixels / total_pixels
         
         return color_distribution
     
@@ -10,12 +10,17 @@ import cv2
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from typing import Dict, Any, Union
+from typing import Dict, Any, Optional, Tuple, Union
 from PIL import Image
 import requests
 import io
 import warnings
 
+from models.weight_store import is_weight_file, load_torch_module
+from utils.stage_timing import stage
+from utils.image_context import ImageContext
+from utils.buffer_pool import BufferPool, get_buffer_pool
+
 class GauGANAdapter:
     """
     Adapter for NVIDIA's GauGAN technology to transform doodles into realistic images.
@@ -65,6 +70,9 @@ class GauGANAdapter:
         
         # Load example images for fallback method
         self.example_images = self._load_example_images()
+        
+        # Decoded example images, resized to the composite size
+        self._example_cache = {}
     
     def _load_model(self):
         """
@@ -103,6 +111,11 @@ class GauGANAdapter:
             else:
                 device = torch.device("cpu")
                 
+            if is_weight_file(self.model_path):
+                # Parameters stay backed by the memory-mapped file
+                self.model = load_torch_module(SimpleSPADE, self.model_path, device)
+                return
+            
             self.model = SimpleSPADE().to(device)
             
             # Load weights if available
@@ -183,16 +196,18 @@ class GauGANAdapter:
         
         return examples
     
-    def transform(self, doodle_image: np.ndarray) -> np.ndarray:
+    def transform(self, doodle_image: Union[np.ndarray, ImageContext]) -> np.ndarray:
         """
         Transform a doodle into a realistic image using GauGAN
         
         Args:
-            doodle_image: The doodle image (numpy array)
+            doodle_image: The doodle image (numpy array) or its ImageContext
             
         Returns:
             A realistic image based on the doodle
         """
+        doodle_image = ImageContext.of(doodle_image)
+        
         # If the model is loaded, use it
         if self.model_loaded and self.model is not None:
             return self._model_transform(doodle_image)
@@ -200,15 +215,15 @@ class GauGANAdapter:
         # Otherwise use the fallback method
         return self._fallback_transform(doodle_image)
     
-    def _model_transform(self, doodle_image: np.ndarray) -> np.ndarray:
+    def _model_transform(self, doodle_image: ImageContext) -> np.ndarray:
         """
         Transform a doodle using the loaded GauGAN model
         """
         # Resize input to model's expected size
-        resized_doodle = cv2.resize(doodle_image, (256, 256))
+        resized_doodle = doodle_image.resized((256, 256)).bgr()
         
-        # Convert to tensor and normalize
-        input_tensor = torch.from_numpy(resized_doodle.transpose(2, 0, 1)).float() / 127.5 - 1.0
+        # Convert to tensor and normalize (astype copies the shared read-only array)
+        input_tensor = torch.from_numpy(resized_doodle.transpose(2, 0, 1).astype(np.float32)) / 127.5 - 1.0
         input_tensor = input_tensor.unsqueeze(0)  # Add batch dimension
         
         # Move to device
@@ -216,7 +231,7 @@ class GauGANAdapter:
             input_tensor = input_tensor.cuda()
         
         # Generate image
-        with torch.no_grad():
+        with stage("model_inference"), torch.no_grad():
             output = self.model(input_tensor)
         
         # Convert back to numpy array
@@ -226,58 +241,81 @@ class GauGANAdapter:
         
         return output
     
-    def _fallback_transform(self, doodle_image: np.ndarray) -> np.ndarray:
+    def _fallback_transform(self, doodle_image: ImageContext) -> np.ndarray:
         """
         Fallback method when the model is not available
         This creates a composite based on example images
         """
         # Resize doodle to match example images
-        resized_doodle = cv2.resize(doodle_image, (256, 256))
+        resized_doodle = doodle_image.resized((256, 256)).bgr()
         
         # Segment the doodle based on colors
-        segments = self._segment_doodle(resized_doodle)
+        pool = get_buffer_pool()
+        with stage("segmentation"):
+            segments = self._segment_doodle(resized_doodle, pool)
         
         # Create a composite based on segments
         composite = np.zeros((256, 256, 3), dtype=np.uint8)
         
-        # Add each segment with appropriate blending
+        # Add each segment: the masks are strictly 0/255, so blending reduces
+        # to copying the example image where the mask is set
         for class_name, mask in segments.items():
-            if class_name in self.example_images:
-                # Load example image
-                example_path = self.example_images[class_name]
-                example = cv2.imread(example_path)
-                
-                if example is not None:
-                    # Resize example to match the doodle size
-                    example = cv2.resize(example, (256, 256))
-                    
-                    # Blend the example image where the mask is active
-                    mask_3ch = np.stack([mask] * 3, axis=2) / 255.0
-                    composite = composite * (1 - mask_3ch) + example * mask_3ch
+            example = self._example_image(class_name, (256, 256))
+            if example is not None:
+                cv2.copyTo(example, mask, composite)
         
-        # Ensure output is in correct format
-        composite = np.clip(composite, 0, 255).astype(np.uint8)
+        pool.release(*segments.values())
         
         return composite
     
-    def _segment_doodle(self, doodle: np.ndarray) -> Dict[str, np.ndarray]:
+    def _example_image(self, class_name: str, size: Tuple[int, int]) -> Optional[np.ndarray]:
+        """
+        Get the example image for a class resized to a size (loaded once)
+        
+        Args:
+            class_name: Segment class name
+            size: Size as (width, height)
+            
+        Returns:
+            BGR image, or None if there is no readable example for the class
+        """
+        key = (class_name, size)
+        if key not in self._example_cache:
+            example = None
+            if class_name in self.example_images:
+                example = cv2.imread(self.example_images[class_name])
+                if example is not None:
+                    example = cv2.resize(example, size)
+                    example.flags.writeable = False
+            self._example_cache[key] = example
+        return self._example_cache[key]
+    
+    def _segment_doodle(self, doodle: np.ndarray, pool: BufferPool = None) -> Dict[str, np.ndarray]:
         """
         Segment the doodle based on colors
         
         Args:
             doodle: The doodle image
+            pool: Buffer pool the masks are borrowed from (defaults to the
+                process-wide pool); callers may release them when done
             
         Returns:
             Dictionary mapping class names to binary masks
         """
+        pool = pool or get_buffer_pool()
+        shape = (doodle.shape[0], doodle.shape[1])
         segments = {}
         
-        # Initialize all segments to zero
+        # Initialize all segments to zero (the background mask is built separately)
         for class_name in self.example_images.keys():
-            segments[class_name] = np.zeros((doodle.shape[0], doodle.shape[1]), dtype=np.uint8)
+            segments[class_name] = None if class_name == "background" else pool.acquire_zeros(shape)
         
         # Default background mask (will be updated)
-        background_mask = np.ones((doodle.shape[0], doodle.shape[1]), dtype=np.uint8) * 255
+        background_mask = pool.acquire(shape)
+        background_mask.fill(255)
+        
+        mask = pool.acquire(shape)
+        inverted = pool.acquire(shape)
         
         # Process each color in the color map
         for color, class_name in self.color_map.items():
@@ -287,15 +325,18 @@ class GauGANAdapter:
             upper_bound = np.array([min(255, c + tolerance) for c in color])
             
             # Create mask for this color
-            mask = cv2.inRange(doodle, lower_bound, upper_bound)
+            cv2.inRange(doodle, lower_bound, upper_bound, dst=mask)
             
             # Update the segment for this class
-            if class_name in segments:
-                segments[class_name] = cv2.bitwise_or(segments[class_name], mask)
+            if segments.get(class_name) is not None:
+                cv2.bitwise_or(segments[class_name], mask, dst=segments[class_name])
             
             # Update background mask (everything not matched yet)
             if class_name != "background":
-                background_mask = cv2.bitwise_and(background_mask, cv2.bitwise_not(mask))
+                cv2.bitwise_not(mask, dst=inverted)
+                cv2.bitwise_and(background_mask, inverted, dst=background_mask)
+        
+        pool.release(mask, inverted)
         
         # Add remaining area to background
         segments["background"] = background_mask
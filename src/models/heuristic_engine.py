@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Heuristic Scoring Engine for AI-PsychDoodle-Analyzer
+Vectorized heuristic emotion scores from extracted features
+
+The heuristics of an analyzer are described by a spec file (YAML or JSON,
+see models/heuristics/) instead of code:
+
+    emotions: [calm, anxious, ...]
+    normalize: sum
+    terms:
+      - name: time                       # min(1, response_time / 2)
+        inputs: [response_time]
+        scale: 0.5
+        max: 1.0
+      - name: late                       # max(0, time - 0.7)
+        inputs: [time]
+        offset: -0.7
+        min: 0.0
+        weights: {anxious: 0.5}
+
+Each term is computed from features (nested names joined with ".", as in
+the feature store) or earlier terms:
+
+    value = inputs[0] * inputs[1] * ...   (op "product", the default)
+            inputs[0] + inputs[1] + ...   (op "sum")
+            inputs[0] - inputs[1]         (op "difference")
+    value = value * scale + offset, then abs (if set), then clipped to [min, max]
+
+An emotion's score is the weighted sum of the terms; with normalize "sum"
+the scores of a row are divided by their total (equal scores if the total
+is 0). Terms are accumulated one at a time in spec order, the same order
+the original hand-written formulas added them in, so the default specs
+reproduce those scores exactly (a matrix product would reorder the sums
+and change the last bits).
+
+Usage:
+    python heuristic_engine.py rescore data/features drawing v1-224px --output scores.jsonl
+"""
+
+import os
+import sys
+import json
+import argparse
+from typing import Any, Dict, List
+
+import numpy as np
+import yaml
+
+# Spec files of the analyzers' default heuristics
+HEURISTICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "heuristics")
+
+OPS = ("product", "sum", "difference")
+
+
+def default_spec_path(analyzer: str) -> str:
+    """
+    Default spec file of an analyzer ("shape" or "drawing")
+    """
+    return os.path.join(HEURISTICS_DIR, f"{analyzer}.yml")
+
+
+def load_spec(path: str) -> Dict[str, Any]:
+    """
+    Read a spec file (.json, otherwise YAML)
+    """
+    with open(path) as f:
+        if path.lower().endswith(".json"):
+            return json.load(f)
+        return yaml.safe_load(f)
+
+
+class HeuristicEngine:
+    """
+    Scores feature matrices of shape (N, features) to emotion matrices of
+    shape (N, emotions) with a feature transform and a weight matrix.
+    """
+
+    def __init__(self, spec: Dict[str, Any]):
+        """
+        Build the engine from a spec (see the module description)
+
+        Raises:
+            ValueError: For an invalid spec
+        """
+        self.emotions: List[str] = list(spec["emotions"])
+        self.normalize = spec.get("normalize", "sum")
+        if self.normalize not in ("sum", "none"):
+            raise ValueError(f"Unknown normalization {self.normalize}")
+
+        self.terms: List[Dict[str, Any]] = []
+        self.features: List[str] = []
+        names = set()
+        emotion_index = {emotion: index for index, emotion in enumerate(self.emotions)}
+        weights = []
+        for term in spec["terms"]:
+            name = term["name"]
+            if name in names:
+                raise ValueError(f"Duplicate term {name}")
+            op = term.get("op", "product")
+            inputs = list(term["inputs"])
+            if op not in OPS or (op == "difference" and len(inputs) != 2) or not inputs:
+                raise ValueError(f"Term {name}: invalid op {op} for {len(inputs)} inputs")
+            # Inputs are earlier terms, otherwise features:
+            # ("term", index) or ("feature", index)
+            sources = []
+            for source in inputs:
+                if source in names:
+                    sources.append(("term", [t["name"] for t in self.terms].index(source)))
+                else:
+                    if source not in self.features:
+                        self.features.append(source)
+                    sources.append(("feature", self.features.index(source)))
+            row = np.zeros(len(self.emotions))
+            for emotion, weight in (term.get("weights") or {}).items():
+                if emotion not in emotion_index:
+                    raise ValueError(f"Term {name}: unknown emotion {emotion}")
+                row[emotion_index[emotion]] = weight
+            names.add(name)
+            weights.append(row)
+            self.terms.append({
+                "name": name, "op": op, "inputs": inputs, "sources": sources,
+                "scale": term.get("scale"), "offset": term.get("offset"), "abs": bool(term.get("abs")),
+                "min": term.get("min"), "max": term.get("max")
+            })
+        # (terms, emotions)
+        self.weights = np.array(weights).reshape(len(self.terms), len(self.emotions))
+        self._weighted = [index for index in range(len(self.terms)) if self.weights[index].any()]
+        # (emotion index, weight) pairs of the weighted terms, for score()
+        self._sparse_weights = [(index, [(emotion, float(weight)) for emotion, weight in enumerate(self.weights[index])
+                                         if weight != 0.0])
+                                for index in self._weighted]
+        self._feature_paths = [feature.split(".") for feature in self.features]
+        # Terms as tuples for score(), with the sources as indices into the
+        # list of feature values followed by term values
+        self._plan = [(
+            [column if kind == "feature" else len(self.features) + column for kind, column in term["sources"]],
+            term["op"], term["scale"], term["offset"], term["abs"], term["min"], term["max"]
+        ) for term in self.terms]
+
+    @classmethod
+    def load(cls, path: str) -> "HeuristicEngine":
+        """
+        Build the engine from a spec file
+        """
+        return cls(load_spec(path))
+
+    def transform(self, features: np.ndarray) -> np.ndarray:
+        """
+        Term values of a feature matrix
+
+        Args:
+            features: Matrix of shape (N, len(self.features))
+
+        Returns:
+            Matrix of shape (N, len(self.terms))
+        """
+        features = np.asarray(features, dtype=np.float64)
+        values = np.empty((features.shape[0], len(self.terms)))
+        for index, term in enumerate(self.terms):
+            inputs = [(values if kind == "term" else features)[:, column] for kind, column in term["sources"]]
+            value = inputs[0]
+            if term["op"] == "difference":
+                value = value - inputs[1]
+            else:
+                for other in inputs[1:]:
+                    value = value * other if term["op"] == "product" else value + other
+            if term["scale"] is not None:
+                value = value * term["scale"]
+            if term["offset"] is not None:
+                value = value + term["offset"]
+            if term["abs"]:
+                value = np.abs(value)
+            if term["min"] is not None:
+                value = np.maximum(value, term["min"])
+            if term["max"] is not None:
+                value = np.minimum(value, term["max"])
+            values[:, index] = value
+        return values
+
+    def score_matrix(self, features: np.ndarray) -> np.ndarray:
+        """
+        Emotion scores of a feature matrix
+
+        Args:
+            features: Matrix of shape (N, len(self.features))
+
+        Returns:
+            Matrix of shape (N, len(self.emotions))
+        """
+        terms = self.transform(features)
+        scores = np.zeros((terms.shape[0], len(self.emotions)))
+        for index in self._weighted:
+            scores += terms[:, index:index + 1] * self.weights[index]
+        if self.normalize == "sum":
+            # Summed emotion by emotion, like sum() over a dict of scores
+            total = np.zeros(terms.shape[0])
+            for index in range(len(self.emotions)):
+                total += scores[:, index]
+            positive = total > 0
+            scores[positive] /= total[positive, None]
+            scores[~positive] = 1.0 / len(self.emotions)
+        return scores
+
+    def feature_row(self, features: Dict[str, Any]) -> List[float]:
+        """
+        The engine's features from a (nested) feature dictionary
+        """
+        row = []
+        for path in self._feature_paths:
+            value = features
+            for key in path:
+                value = value[key]
+            row.append(value)
+        return row
+
+    def score_batch(self, features: List[Dict[str, Any]]) -> List[Dict[str, float]]:
+        """
+        Emotion scores of a batch of feature dictionaries (as returned by
+        the analyzers' extract_features)
+        """
+        if not features:
+            return []
+        scores = self.score_matrix(np.array([self.feature_row(row) for row in features], dtype=np.float64))
+        return [dict(zip(self.emotions, row.tolist())) for row in scores]
+
+    def score(self, features: Dict[str, Any]) -> Dict[str, float]:
+        """
+        Emotion scores of one feature dictionary
+
+        Computed with Python floats: for a single row, the per-call overhead
+        of NumPy would dominate. The operations and their order are those of
+        score_matrix, so the results are the same.
+        """
+        values = [float(value) for value in self.feature_row(features)]
+        for sources, op, scale, offset, absolute, minimum, maximum in self._plan:
+            value = values[sources[0]]
+            if len(sources) > 1:
+                if op == "difference":
+                    value = value - values[sources[1]]
+                else:
+                    for source in sources[1:]:
+                        value = value * values[source] if op == "product" else value + values[source]
+            if scale is not None:
+                value = value * scale
+            if offset is not None:
+                value = value + offset
+            if absolute:
+                value = abs(value)
+            if minimum is not None and value < minimum:
+                value = minimum
+            if maximum is not None and value > maximum:
+                value = maximum
+            values.append(value)
+
+        first_term = len(self.features)
+        scores = [0.0] * len(self.emotions)
+        for index, weights in self._sparse_weights:
+            value = values[first_term + index]
+            for emotion, weight in weights:
+                scores[emotion] += value * weight
+        if self.normalize == "sum":
+            total = sum(scores)
+            if total > 0:
+                scores = [score / total for score in scores]
+            else:
+                scores = [1.0 / len(scores)] * len(scores)
+        return dict(zip(self.emotions, scores))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score stored features with a heuristic spec")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rescore_parser = subparsers.add_parser("rescore", help="Score every row of a feature store table")
+    rescore_parser.add_argument("root", help="Feature store directory")
+    rescore_parser.add_argument("extractor", choices=("shape", "drawing"))
+    rescore_parser.add_argument("version", help="Table version (e.g. v1-224px)")
+    rescore_parser.add_argument("--spec", help="Spec file (default: the analyzer's default heuristics)")
+    rescore_parser.add_argument("--output", required=True, help="JSON lines file with one row per key")
+    args = parser.parse_args()
+
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils.feature_store import FeatureStore
+
+    engine = HeuristicEngine.load(args.spec or default_spec_path(args.extractor))
+    table = FeatureStore(args.root).table(args.extractor, args.version)
+    if not len(table):
+        print(f"No features in {table.path}")
+        return 1
+    scores = engine.score_matrix(table.matrix(engine.features))
+    with open(args.output, "w") as f:
+        for key, row in zip(table.keys(), scores.tolist()):
+            emotional_state = dict(zip(engine.emotions, row))
+            f.write(json.dumps({"key": key.decode("ascii"), "emotional_state": emotional_state,
+                                "top_emotion": max(emotional_state.items(), key=lambda x: x[1])[0]}) + "\n")
+    print(f"Scored {len(scores)} rows of {table.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
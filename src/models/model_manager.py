@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Model Manager for AI-PsychDoodle-Analyzer
+Versioned model bundles with background reloading, canary validation and atomic swaps
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from models.shape_analyzer import ShapeAnalyzer
+from models.drawing_analyzer import DrawingAnalyzer
+from models.gaugan_adapter import GauGANAdapter
+from models.weight_store import is_weight_file, read_header
+
+logger = logging.getLogger(__name__)
+
+# Components of a bundle, by the key of their weight file path
+COMPONENTS = ("shape_analyzer", "drawing_analyzer", "gaugan_adapter")
+
+# Version of a bundle without any weight files (all heuristic)
+HEURISTIC_VERSION = "heuristic"
+
+# Bytes hashed per read when fingerprinting weight files
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def weights_version(paths: Dict[str, str]) -> str:
+    """
+    Content-derived version of a set of weight files
+
+    Args:
+        paths: Weight file path by component name
+
+    Returns:
+        12 hex digits of a hash over the components' file contents, or
+        "heuristic" if none of the files exists
+    """
+    digest = hashlib.blake2b(digest_size=6)
+    found = False
+    for name in COMPONENTS:
+        path = paths.get(name)
+        digest.update(name.encode("utf-8"))
+        if path and os.path.exists(path):
+            found = True
+            if is_weight_file(path):
+                # Digest of the data recorded at export, so the file is not read
+                digest.update(read_header(path)["digest"].encode("ascii"))
+                continue
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+                    digest.update(chunk)
+    return digest.hexdigest() if found else HEURISTIC_VERSION
+
+
+def file_signature(paths: Dict[str, str]) -> Tuple:
+    """
+    Cheap change signature (size and modification time) of weight files
+    """
+    signature = []
+    for name in COMPONENTS:
+        try:
+            stat = os.stat(paths[name])
+            signature.append((name, stat.st_size, stat.st_mtime_ns))
+        except (KeyError, OSError):
+            signature.append((name, None, None))
+    return tuple(signature)
+
+
+class ModelBundle:
+    """
+    One consistent set of loaded models.
+
+    Bundles are never modified after they have been published, so a request
+    that takes the current bundle at its start finishes on that version even
+    if a new bundle is swapped in meanwhile.
+    """
+
+    def __init__(self, version: str, shape_analyzer: ShapeAnalyzer,
+                 drawing_analyzer: DrawingAnalyzer, gaugan_adapter: GauGANAdapter,
+                 paths: Dict[str, str]):
+        """
+        Initialize the bundle
+
+        Args:
+            version: Bundle version (see weights_version)
+            shape_analyzer: Loaded shape analyzer
+            drawing_analyzer: Loaded drawing analyzer
+            gaugan_adapter: Loaded GauGAN adapter
+            paths: Weight file path by component name
+        """
+        self.version = version
+        self.shape_analyzer = shape_analyzer
+        self.drawing_analyzer = drawing_analyzer
+        self.gaugan_adapter = gaugan_adapter
+        self.paths = dict(paths)
+        self.loaded_at = time.time()
+
+    def model_loaded(self, name: str) -> bool:
+        """
+        Whether a component runs its trained model (rather than the heuristics)
+        """
+        if name == "gaugan_adapter":
+            return self.gaugan_adapter.model_loaded and self.gaugan_adapter.model is not None
+        return getattr(self, name).model is not None
+
+
+def default_factory(paths: Dict[str, str]) -> Tuple[ShapeAnalyzer, DrawingAnalyzer, GauGANAdapter]:
+    """
+    Construct the components from their weight files
+    """
+    return (ShapeAnalyzer(paths.get("shape_analyzer")),
+            DrawingAnalyzer(paths.get("drawing_analyzer")),
+            GauGANAdapter(paths.get("gaugan_adapter")))
+
+
+class ModelManager:
+    """
+    Holds the current model bundle and replaces it without downtime.
+
+    A reload builds a complete new bundle in the background, checks that
+    every component with a weight file actually loaded its model, runs the
+    canary check (e.g. synthetic inputs with output validation and warm-up)
+    and only then publishes the bundle with a single reference assignment.
+    Requests keep using the bundle they started with.
+
+    Reloads are triggered by reload() (e.g. from an admin endpoint) or by the
+    watcher thread when the weight files change. The watcher also follows an
+    optional trigger file, so touching it makes every process that shares
+    it reload (e.g. all gunicorn workers).
+    """
+
+    def __init__(self, paths: Dict[str, str],
+                 factory: Callable[[Dict[str, str]], Tuple[ShapeAnalyzer, DrawingAnalyzer, GauGANAdapter]] = None,
+                 canary: Optional[Callable[[ModelBundle], None]] = None,
+                 trigger_path: Optional[str] = None,
+                 on_swap: Optional[Callable[[ModelBundle, Optional[ModelBundle]], None]] = None):
+        """
+        Initialize the manager and load the initial bundle
+
+        Args:
+            paths: Weight file path by component name ("shape_analyzer",
+                "drawing_analyzer", "gaugan_adapter")
+            factory: Builds the components from the paths (default:
+                default_factory)
+            canary: Validates a new bundle before it is published, raising
+                an exception to reject it; not applied to the initial bundle
+            trigger_path: File whose modification requests a reload
+            on_swap: Called with (new bundle, previous bundle) after a swap
+        """
+        self.paths = dict(paths)
+        self.factory = factory or default_factory
+        self.canary = canary
+        self.trigger_path = trigger_path
+        self.on_swap = on_swap
+
+        self._reload_lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.last_reload: Optional[Dict[str, Any]] = None
+
+        self._bundle = self._build()
+        self._signature = file_signature(self.paths)
+        self._trigger_mtime = self._trigger_signature()
+
+    @property
+    def current(self) -> ModelBundle:
+        """
+        The bundle new requests should use (take it once per request)
+        """
+        return self._bundle
+
+    def _build(self) -> ModelBundle:
+        version = weights_version(self.paths)
+        shape_analyzer, drawing_analyzer, gaugan_adapter = self.factory(self.paths)
+        return ModelBundle(version, shape_analyzer, drawing_analyzer, gaugan_adapter, self.paths)
+
+    def reload(self, force: bool = False) -> Dict[str, Any]:
+        """
+        Load, validate and publish a new bundle (blocking)
+
+        Args:
+            force: Reload even if the weight files are unchanged
+
+        Returns:
+            Result with "swapped", "version", "previous_version", "seconds"
+            and "error" (the reason a new bundle was rejected, if any)
+        """
+        with self._reload_lock:
+            start = time.perf_counter()
+            previous = self._bundle
+            signature = file_signature(self.paths)
+            result = {"swapped": False, "version": previous.version,
+                      "previous_version": previous.version, "seconds": 0.0, "error": None}
+
+            try:
+                if not force and signature == self._signature:
+                    return result
+                bundle = self._build()
+                if not force and bundle.version == previous.version:
+                    # Touched but identical weights
+                    self._signature = signature
+                    return result
+
+                # A component whose weight file exists but did not load would
+                # silently fall back to its heuristics
+                failed = [name for name in COMPONENTS
+                          if os.path.exists(self.paths.get(name) or "") and not bundle.model_loaded(name)]
+                if failed:
+                    raise RuntimeError(f"Could not load model weights for {', '.join(failed)}")
+                if self.canary is not None:
+                    self.canary(bundle)
+
+                self._bundle = bundle
+                self._signature = signature
+                result.update(swapped=True, version=bundle.version)
+                logger.info(f"Swapped models {previous.version} -> {bundle.version}")
+                if self.on_swap is not None:
+                    self.on_swap(bundle, previous)
+            except Exception as e:
+                # Keep serving the current bundle; the same files are not retried
+                self._signature = signature
+                result["error"] = str(e)
+                logger.error(f"Model reload rejected, keeping {previous.version}: {e}")
+            finally:
+                result["seconds"] = time.perf_counter() - start
+                self.last_reload = dict(result, finished_at=time.time())
+            return result
+
+    def request_reload(self):
+        """
+        Ask every process watching the trigger file to reload
+        """
+        if not self.trigger_path:
+            return
+        directory = os.path.dirname(self.trigger_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.trigger_path, "a"):
+            pass
+        os.utime(self.trigger_path, None)
+        # This process has already reloaded
+        self._trigger_mtime = self._trigger_signature()
+
+    def _trigger_signature(self) -> Optional[int]:
+        if not self.trigger_path:
+            return None
+        try:
+            return os.stat(self.trigger_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def start_watching(self, poll_interval: float = 5.0):
+        """
+        Poll the weight files and the trigger file on a daemon thread
+
+        A changed weight file is only loaded once its size and modification
+        time have been stable for one poll interval, so files that are still
+        being copied are not picked up.
+
+        Args:
+            poll_interval: Seconds between checks
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._stop.clear()
+
+        def watch():
+            pending = None
+            while not self._stop.wait(poll_interval):
+                try:
+                    trigger = self._trigger_signature()
+                    if trigger != self._trigger_mtime:
+                        self._trigger_mtime = trigger
+                        self.reload(force=True)
+                        pending = None
+                        continue
+                    signature = file_signature(self.paths)
+                    if signature == self._signature:
+                        pending = None
+                    elif signature == pending:
+                        self.reload()
+                        pending = None
+                    else:
+                        pending = signature
+                except Exception as e:
+                    logger.error(f"Model watcher error: {e}")
+
+        self._watcher = threading.Thread(target=watch, name="model-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        """
+        Stop the watcher thread
+        """
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=5)
+            self._watcher = None
@@ -7,22 +7,34 @@ Analyzes traced shapes to determine psychological state
 import os
 import numpy as np
 import cv2
-from typing import Dict, Any, Tuple, List
+from typing import Dict, Any, Tuple, List, Union
 from PIL import Image
 import tensorflow as tf
 
+from models.weight_store import is_weight_file, load_keras_model
+from models.heuristic_engine import HeuristicEngine, default_spec_path
+from utils.stage_timing import stage
+from utils.image_context import ImageContext
+from utils.buffer_pool import get_buffer_pool
+
 class ShapeAnalyzer:
     """
     Analyzes traced shapes to determine psychological state based on 
     response time, shape accuracy, and drawing characteristics.
     """
     
-    def __init__(self, model_path: str = None):
+    # Version of the features returned by _extract_features; increase it
+    # whenever they change, so stored features are not reused
+    FEATURE_VERSION = 1
+    
+    def __init__(self, model_path: str = None, heuristics_path: str = None):
         """
         Initialize the shape analyzer model
         
         Args:
             model_path: Path to the pre-trained model (optional)
+            heuristics_path: Spec file of the heuristics used without a model
+                (optional; see models/heuristic_engine.py)
         """
         self.model_path = model_path or os.path.join(
             os.path.dirname(os.path.abspath(__file__)),
@@ -33,7 +45,10 @@ class ShapeAnalyzer:
         self.model = None
         if os.path.exists(self.model_path):
             try:
-                self.model = tf.keras.models.load_model(self.model_path)
+                if is_weight_file(self.model_path):
+                    self.model = load_keras_model(self.model_path)
+                else:
+                    self.model = tf.keras.models.load_model(self.model_path)
             except Exception as e:
                 print(f"Warning: Could not load model from {self.model_path}: {e}")
                 print("Using heuristic-based analysis instead.")
@@ -44,6 +59,11 @@ class ShapeAnalyzer:
             "focused", "distracted", "confident", "hesitant"
         ]
         
+        # Heuristic scoring (used when no model is loaded)
+        self.heuristics = HeuristicEngine.load(heuristics_path or default_spec_path("shape"))
+        if sorted(self.heuristics.emotions) != sorted(self.emotion_categories):
+            raise ValueError(f"Heuristics {heuristics_path} do not score the shape emotion categories")
+        
         # Feedback templates
         self.feedback_templates = {
             "calm": [
@@ -116,20 +136,24 @@ class ShapeAnalyzer:
             ]
         }
     
-    def analyze(self, original_image: np.ndarray, traced_image: np.ndarray, 
+    def analyze(self, original_image: Union[np.ndarray, ImageContext],
+                traced_image: Union[np.ndarray, ImageContext],
                 response_time: float, shape_type: str) -> Dict[str, float]:
         """
         Analyze the traced shape to determine psychological state
         
         Args:
-            original_image: The original shape image
-            traced_image: The user's traced shape image
+            original_image: The original shape image or its ImageContext
+            traced_image: The user's traced shape image or its ImageContext
             response_time: Time taken to trace the shape (seconds)
             shape_type: Type of shape (e.g., "triangle", "circle", "square")
             
         Returns:
             Dictionary mapping emotional states to scores (0.0-1.0)
         """
+        original_image = ImageContext.of(original_image)
+        traced_image = ImageContext.of(traced_image)
+        
         # If the model is loaded, use it for prediction
         if self.model:
             return self._model_based_analysis(original_image, traced_image, response_time, shape_type)
@@ -137,14 +161,54 @@ class ShapeAnalyzer:
         # Otherwise use heuristic analysis
         return self._heuristic_analysis(original_image, traced_image, response_time, shape_type)
     
-    def _model_based_analysis(self, original_image: np.ndarray, traced_image: np.ndarray, 
+    def extract_features(self, original_image: Union[np.ndarray, ImageContext],
+                         traced_image: Union[np.ndarray, ImageContext],
+                         response_time: float, shape_type: str) -> Dict[str, float]:
+        """
+        Extract the features the analysis is based on
+        
+        Args:
+            original_image: The original shape image or its ImageContext
+            traced_image: The user's traced shape image or its ImageContext
+            response_time: Time taken to trace the shape (seconds)
+            shape_type: Type of shape (e.g., "triangle", "circle", "square")
+            
+        Returns:
+            Dictionary of feature values (see FEATURE_VERSION)
+        """
+        with stage("feature_extraction"):
+            return self._extract_features(ImageContext.of(original_image), ImageContext.of(traced_image),
+                                          response_time, shape_type)
+    
+    def score_features(self, features: Dict[str, float]) -> Dict[str, float]:
+        """
+        Score extracted features (e.g. stored ones) with the model, or the
+        heuristics if no model is loaded
+        
+        Args:
+            features: Features returned by extract_features
+            
+        Returns:
+            Dictionary mapping emotional states to scores (0.0-1.0)
+        """
+        if self.model:
+            return self._model_scores(features)
+        return self._heuristic_scores(features)
+    
+    def _model_based_analysis(self, original_image: ImageContext, traced_image: ImageContext,
                              response_time: float, shape_type: str) -> Dict[str, float]:
         """
         Use the trained model to analyze the traced shape
         """
         # Extract features
-        features = self._extract_features(original_image, traced_image, response_time, shape_type)
-        
+        with stage("feature_extraction"):
+            features = self._extract_features(original_image, traced_image, response_time, shape_type)
+        return self._model_scores(features)
+    
+    def _model_scores(self, features: Dict[str, float]) -> Dict[str, float]:
+        """
+        Emotion scores of the trained model for extracted features
+        """
         # Normalize features
         normalized_features = self._normalize_features(features)
         
@@ -152,79 +216,47 @@ class ShapeAnalyzer:
         model_input = np.array([list(normalized_features.values())])
         
         # Get model predictions
-        predictions = self.model.predict(model_input)[0]
+        with stage("model_inference"):
+            predictions = self.model.predict(model_input)[0]
         
         # Map predictions to emotion categories
         emotions = {category: float(score) for category, score in zip(self.emotion_categories, predictions)}
         
         return emotions
     
-    def _heuristic_analysis(self, original_image: np.ndarray, traced_image: np.ndarray, 
+    def _heuristic_analysis(self, original_image: ImageContext, traced_image: ImageContext,
                            response_time: float, shape_type: str) -> Dict[str, float]:
         """
         Use heuristics to analyze the traced shape when the model is not available
         """
         # Extract features
-        features = self._extract_features(original_image, traced_image, response_time, shape_type)
-        
-        # Analyze overlap accuracy
-        overlap_accuracy = features['overlap_percentage']
-        
-        # Analyze response time
-        # Assume average tracing time is 2 seconds for baseline
-        normalized_time = min(1.0, response_time / 2.0)
-        
-        # Analyze line steadiness
-        line_steadiness = features['line_steadiness']
-        
-        # Analyze shape completion
-        completion = features['completion_percentage']
-        
-        # Calculate emotional scores based on heuristics
-        emotions = {
-            "calm": 0.5 * (line_steadiness + min(1.0, 2.0 * (1.0 - abs(normalized_time - 0.5)))),
-            "anxious": 0.5 * ((1.0 - line_steadiness) + max(0, normalized_time - 0.7)),
-            "excited": 0.5 * ((1.0 - line_steadiness) + min(normalized_time, 0.7)),
-            "depressed": 0.5 * ((1.0 - completion) + max(0, 1.5 * (normalized_time - 0.6))),
-            "focused": 0.5 * (overlap_accuracy + line_steadiness),
-            "distracted": 0.5 * ((1.0 - overlap_accuracy) + (1.0 - completion)),
-            "confident": 0.5 * (min(normalized_time, 0.6) + completion * line_steadiness),
-            "hesitant": 0.5 * (max(0, normalized_time - 0.6) + (1.0 - overlap_accuracy * completion))
-        }
-        
-        # Normalize scores to sum to 1.0
-        total = sum(emotions.values())
-        emotions = {k: v/total for k, v in emotions.items()}
-        
-        return emotions
+        with stage("feature_extraction"):
+            features = self._extract_features(original_image, traced_image, response_time, shape_type)
+        return self._heuristic_scores(features)
     
-    def _extract_features(self, original_image: np.ndarray, traced_image: np.ndarray, 
+    def _heuristic_scores(self, features: Dict[str, float]) -> Dict[str, float]:
+        """
+        Heuristic emotion scores for extracted features
+        """
+        return self.heuristics.score(features)
+    
+    def _extract_features(self, original_image: ImageContext, traced_image: ImageContext,
                          response_time: float, shape_type: str) -> Dict[str, float]:
         """
         Extract features from the traced shape
         """
-        # Convert images to grayscale if they're not already
-        if len(original_image.shape) > 2 and original_image.shape[2] > 1:
-            original_gray = cv2.cvtColor(original_image, cv2.COLOR_BGR2GRAY)
-        else:
-            original_gray = original_image
-            
-        if len(traced_image.shape) > 2 and traced_image.shape[2] > 1:
-            traced_gray = cv2.cvtColor(traced_image, cv2.COLOR_BGR2GRAY)
-        else:
-            traced_gray = traced_image
-        
-        # Threshold images to binary
-        _, original_binary = cv2.threshold(original_gray, 127, 255, cv2.THRESH_BINARY)
-        _, traced_binary = cv2.threshold(traced_gray, 127, 255, cv2.THRESH_BINARY)
+        # Threshold images to binary (grayscale conversion is shared through the contexts)
+        original_binary = original_image.binary(127)
+        traced_binary = traced_image.binary(127)
         
         # Calculate overlap between original and traced shapes
-        intersection = cv2.bitwise_and(original_binary, traced_binary)
-        union = cv2.bitwise_or(original_binary, traced_binary)
+        with get_buffer_pool().borrow(traced_binary.shape) as scratch:
+            intersection_area = cv2.countNonZero(
+                cv2.bitwise_and(original_binary, traced_binary, dst=scratch))
+            union_area = cv2.countNonZero(
+                cv2.bitwise_or(original_binary, traced_binary, dst=scratch))
         
         # Calculate overlap percentage (IoU - Intersection over Union)
-        intersection_area = np.count_nonzero(intersection)
-        union_area = np.count_nonzero(union)
         overlap_percentage = intersection_area / max(1, union_area)  # Avoid division by zero
         
         # Calculate completion percentage (how much of original shape is covered)
@@ -232,7 +264,7 @@ class ShapeAnalyzer:
         completion_percentage = intersection_area / max(1, original_area)  # Avoid division by zero
         
         # Calculate line steadiness (using contour analysis)
-        contours, _ = cv2.findContours(traced_binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours = traced_image.contours(127)
         
         line_steadiness = 0.5  # Default medium steadiness
         if contours:
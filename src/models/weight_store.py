@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Weight Store for AI-PsychDoodle-Analyzer
+Flat, aligned, memory-mapped model weight files that load in O(header) time
+
+File layout:
+    8 bytes   magic b"PDWEIGHT"
+    8 bytes   header length (little-endian uint64)
+    header    UTF-8 JSON, padded with spaces so the data starts 64-byte aligned
+    data      raw little-endian tensors, each starting 64-byte aligned
+
+The header lists every tensor's name, dtype, shape and offset, plus the
+framework, the model architecture (Keras JSON) and a digest of the data.
+Opening a file maps it and parses the header; tensor data is only paged in
+when it is used, straight from the OS page cache, so all worker processes
+share one copy of the weights.
+
+Usage:
+    python weight_store.py export weights/gaugan_model.pth weights/gaugan_model.pdw
+    python weight_store.py inspect weights/gaugan_model.pdw
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import tempfile
+import argparse
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+try:
+    import tensorflow as tf
+except ImportError:
+    tf = None
+
+MAGIC = b"PDWEIGHT"
+FORMAT_VERSION = 1
+PREAMBLE = struct.Struct("<8sQ")   # magic, header length
+ALIGNMENT = 64
+
+# Conventional extension of weight store files
+WEIGHTS_EXTENSION = ".pdw"
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _raw_bytes(array: np.ndarray) -> np.ndarray:
+    # Byte view of a contiguous array (also for 0-d and empty arrays)
+    return array.reshape(-1).view(np.uint8)
+
+
+def is_weight_file(path: str) -> bool:
+    """
+    Check whether a file is in the weight store format (by its magic bytes)
+    """
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def read_header(path: str) -> Dict[str, Any]:
+    """
+    Read the JSON header of a weight store file without mapping its data
+
+    Raises:
+        ValueError: If the file is not a weight store file
+    """
+    with open(path, "rb") as f:
+        preamble = f.read(PREAMBLE.size)
+        if len(preamble) < PREAMBLE.size:
+            raise ValueError(f"{path} is not a weight store file")
+        magic, header_length = PREAMBLE.unpack(preamble)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a weight store file")
+        header = json.loads(f.read(header_length).decode("utf-8"))
+    if header.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported weight store version {header.get('version')} in {path}")
+    return header
+
+
+def save_weights(path: str, tensors: "OrderedDict[str, np.ndarray]", framework: str,
+                 architecture: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None):
+    """
+    Write tensors to a weight store file (atomically replacing it)
+
+    Args:
+        path: Output file
+        tensors: Arrays by name, in the order the loader should return them
+        framework: Framework the weights belong to ("keras" or "torch")
+        architecture: Serialized model architecture (e.g. Keras model JSON)
+        metadata: Additional JSON-serializable information (e.g. the source file)
+    """
+    arrays = OrderedDict((name, np.asarray(array, dtype=np.asarray(array).dtype.newbyteorder("<"), order="C"))
+                         for name, array in tensors.items())
+    entries = []
+    offset = 0
+    digest = hashlib.blake2b(digest_size=16)
+    for name, array in arrays.items():
+        if array.dtype.hasobject:
+            raise ValueError(f"Tensor {name} has unsupported dtype {array.dtype}")
+        offset = _align(offset)
+        entries.append({"name": name, "dtype": array.dtype.str, "shape": list(array.shape),
+                        "offset": offset, "nbytes": array.nbytes})
+        digest.update(name.encode("utf-8"))
+        digest.update(array.dtype.str.encode("ascii"))
+        digest.update(str(array.shape).encode("ascii"))
+        digest.update(_raw_bytes(array))
+        offset += array.nbytes
+
+    header = {
+        "version": FORMAT_VERSION,
+        "framework": framework,
+        "architecture": architecture,
+        "metadata": metadata or {},
+        "digest": digest.hexdigest(),
+        "data_bytes": offset,
+        "tensors": entries
+    }
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    data_start = _align(PREAMBLE.size + len(header_bytes))
+    header_bytes += b" " * (data_start - PREAMBLE.size - len(header_bytes))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=WEIGHTS_EXTENSION)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(PREAMBLE.pack(MAGIC, len(header_bytes)))
+            f.write(header_bytes)
+            for entry, array in zip(entries, arrays.values()):
+                f.seek(data_start + entry["offset"])
+                f.write(_raw_bytes(array))
+            f.truncate(data_start + offset)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class WeightFile:
+    """
+    A memory-mapped weight store file.
+
+    Tensors are NumPy views into the mapping. The mapping is private
+    (copy-on-write): pages come from the shared page cache and are only
+    copied for a process that writes to them, which inference never does.
+    """
+
+    def __init__(self, path: str):
+        """
+        Map a weight store file and parse its header
+
+        Args:
+            path: Weight store file
+
+        Raises:
+            ValueError: If the file is not a valid weight store file
+        """
+        self.path = path
+        self.header = read_header(path)
+        with open(path, "rb") as f:
+            header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))[1]
+            self._data_start = PREAMBLE.size + header_length
+            size = os.fstat(f.fileno()).st_size
+            if size < self._data_start + self.header["data_bytes"]:
+                raise ValueError(f"{path} is truncated")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    @property
+    def framework(self) -> str:
+        return self.header["framework"]
+
+    @property
+    def architecture(self) -> Optional[str]:
+        return self.header.get("architecture")
+
+    @property
+    def digest(self) -> str:
+        return self.header["digest"]
+
+    def tensor(self, entry: Dict[str, Any]) -> np.ndarray:
+        """
+        View of one tensor (no data is read until it is accessed)
+        """
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        array = np.frombuffer(self._map, dtype=np.dtype(entry["dtype"]), count=count,
+                              offset=self._data_start + entry["offset"])
+        return array.reshape(tuple(entry["shape"]))
+
+    def tensors(self) -> "OrderedDict[str, np.ndarray]":
+        """
+        Views of all tensors by name, in file order
+        """
+        return OrderedDict((entry["name"], self.tensor(entry)) for entry in self.header["tensors"])
+
+    def close(self):
+        """
+        Unmap the file (deferred to garbage collection while views exist)
+        """
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass
+            self._map = None
+
+    def __enter__(self) -> "WeightFile":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+
+def load_keras_model(path: str):
+    """
+    Build a Keras model from a weight store file
+
+    Keras copies the weights into its own variables, so unlike Torch the
+    tensors are not shared with the page cache; loading still skips HDF5
+    parsing and per-layer deserialization.
+
+    Args:
+        path: Weight store file exported from a Keras model
+
+    Returns:
+        The Keras model
+    """
+    if tf is None:
+        raise ImportError("TensorFlow is required to load Keras weights")
+    with WeightFile(path) as weights:
+        if weights.framework != "keras" or not weights.architecture:
+            raise ValueError(f"{path} does not contain a Keras model")
+        model = tf.keras.models.model_from_json(weights.architecture)
+        model.set_weights(list(weights.tensors().values()))
+    return model
+
+
+def load_torch_state_dict(path: str) -> "OrderedDict[str, Any]":
+    """
+    Torch state dict whose tensors share memory with the mapped file
+
+    Args:
+        path: Weight store file exported from a Torch state dict
+
+    Returns:
+        Tensors by parameter name
+    """
+    if torch is None:
+        raise ImportError("PyTorch is required to load Torch weights")
+    weights = WeightFile(path)
+    if weights.framework != "torch":
+        raise ValueError(f"{path} does not contain Torch weights")
+    # The views keep the mapping alive for as long as the tensors exist
+    return OrderedDict((name, torch.from_numpy(array)) for name, array in weights.tensors().items())
+
+
+def load_torch_module(factory: Callable[[], Any], path: str, device=None):
+    """
+    Construct a Torch module with its parameters backed by a weight store file
+
+    The module is created on the meta device (no parameter memory) and the
+    mapped tensors are assigned as its parameters, so on the CPU no weights
+    are copied. Torch versions without meta-device construction or
+    assign-loading fall back to copying the weights into a normal module.
+
+    Args:
+        factory: Creates the (uninitialized) module
+        path: Weight store file exported from the module's state dict
+        device: Target device (moving to an accelerator copies the weights)
+
+    Returns:
+        The module in evaluation mode
+    """
+    state = load_torch_state_dict(path)
+    try:
+        with torch.device("meta"):
+            module = factory()
+        module.load_state_dict(state, assign=True)
+    except (AttributeError, TypeError, RuntimeError) as e:
+        # load_state_dict(assign=True) needs torch 2.1
+        print(f"Warning: Could not assign the mapped weights of {path} (torch {torch.__version__}): {e}")
+        print("Copying the weights instead; each worker keeps its own copy.")
+        module = factory()
+        module.load_state_dict(state)
+    if device is not None:
+        module = module.to(device)
+    module.eval()
+    return module
+
+
+def export_keras(source: str, destination: str):
+    """
+    Export a Keras model (.h5/.keras) to a weight store file
+    """
+    if tf is None:
+        raise ImportError("TensorFlow is required to export Keras models")
+    model = tf.keras.models.load_model(source)
+    tensors = OrderedDict()
+    for index, (variable, array) in enumerate(zip(model.weights, model.get_weights())):
+        # Variable names need not be unique, so prefix them with their position
+        tensors[f"{index:04d}/{getattr(variable, 'path', variable.name)}"] = array
+    save_weights(destination, tensors, "keras", architecture=model.to_json(),
+                 metadata={"source": os.path.basename(source)})
+
+
+def export_torch(source: str, destination: str):
+    """
+    Export a Torch state dict (or pickled module) to a weight store file
+    """
+    if torch is None:
+        raise ImportError("PyTorch is required to export Torch weights")
+    state = torch.load(source, map_location="cpu")
+    if hasattr(state, "state_dict"):
+        state = state.state_dict()
+    tensors = OrderedDict((name, tensor.detach().cpu().numpy()) for name, tensor in state.items())
+    save_weights(destination, tensors, "torch", metadata={"source": os.path.basename(source)})
+
+
+def export(source: str, destination: str):
+    """
+    Export model weights to a weight store file, choosing the framework by
+    the source file's extension (.h5/.keras for Keras, .pth/.pt for Torch)
+    """
+    extension = os.path.splitext(source)[1].lower()
+    if extension in (".h5", ".keras"):
+        export_keras(source, destination)
+    elif extension in (".pth", ".pt"):
+        export_torch(source, destination)
+    else:
+        raise ValueError(f"Unknown model format: {source}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and inspect memory-mapped model weight files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Convert .h5/.keras/.pth/.pt weights")
+    export_parser.add_argument("source", help="Keras model or Torch state dict")
+    export_parser.add_argument("destination", nargs="?",
+                               help=f"Output file (default: source with {WEIGHTS_EXTENSION} extension)")
+
+    inspect_parser = subparsers.add_parser("inspect", help="Print a weight file's header")
+    inspect_parser.add_argument("path")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        destination = args.destination or os.path.splitext(args.source)[0] + WEIGHTS_EXTENSION
+        export(args.source, destination)
+        header = read_header(destination)
+        print(f"Wrote {destination}: {len(header['tensors'])} tensors, "
+              f"{header['data_bytes'] / 1e6:.1f} MB, digest {header['digest']}")
+    else:
+        header = read_header(args.path)
+        print(f"{args.path}: {header['framework']} weights, {len(header['tensors'])} tensors, "
+              f"{header['data_bytes'] / 1e6:.1f} MB, digest {header['digest']}")
+        for entry in header["tensors"]:
+            print(f"  {entry['name']:<48} {entry['dtype']:<6} {tuple(entry['shape'])}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
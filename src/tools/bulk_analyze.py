@@ -0,0 +1,624 @@
+#!/usr/bin/env python3
+"""
+Bulk Analysis for AI-PsychDoodle-Analyzer
+Re-scores archives of tracings and doodles on all cores, resumable after interruption
+
+Inputs are either a directory of doodle images or a manifest (JSON lines or
+CSV) listing tracings and doodles:
+
+    {"id": "p17-circle", "original": "shapes/circle.png", "traced": "p17/circle.png",
+     "response_time": 2.4, "shape_type": "circle"}
+    {"id": "p17-doodle", "doodle": "p17/doodle.png"}
+
+Relative paths are resolved against the manifest's directory. Records are
+distributed in chunks to a pool of worker processes, each with its own
+models and its share of the CPU threads. Results are streamed to a JSON
+lines file or to a directory of Parquet files as they arrive; already
+written records are skipped when the same command is run again. Doodles
+are always analyzed at full resolution (the server's drawing_early_exit
+setting is ignored), so an archive scores the same with or without a
+feature store.
+
+With --feature-store, the extracted features are kept in a feature store
+(see utils/feature_store.py) keyed by the content of the inputs, so later
+runs, e.g. with new analyzer weights, only score the stored features and
+skip decoding, the GauGAN transformation and feature extraction.
+
+Usage:
+    python src/tools/bulk_analyze.py archive/doodles --output doodles.jsonl
+    python src/tools/bulk_analyze.py manifest.jsonl --output results/ --format parquet --workers 16
+    python src/tools/bulk_analyze.py manifest.jsonl --output rescored.jsonl --feature-store data/features
+"""
+
+import os
+import csv
+import sys
+import json
+import glob
+import time
+import signal
+import argparse
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SRC_DIR)
+sys.path.append(os.path.join(os.path.dirname(SRC_DIR), "deployment", "server"))
+
+from server_config import (ServerConfig, load_environment_variables, detect_cpu_topology,
+                           plan_resources, apply_resource_plan)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+
+OUTPUT_FORMATS = ("jsonl", "parquet")
+
+# Seconds between checkpoints (output synced to disk, progress logged)
+CHECKPOINT_INTERVAL = 30.0
+
+
+def iter_directory(root: str) -> Iterator[Dict[str, Any]]:
+    """
+    Doodle records for every image below a directory, in sorted order
+
+    Record ids are the paths relative to the directory.
+    """
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(directory, name)
+                yield {"id": os.path.relpath(path, root), "type": "doodle", "doodle": path}
+
+
+def _manifest_record(row: Dict[str, Any], base: str, line: int) -> Dict[str, Any]:
+    def resolve(path):
+        return path if os.path.isabs(path) else os.path.join(base, path)
+
+    record_type = row.get("type") or ("shape" if row.get("traced") else "doodle")
+    if record_type == "shape":
+        missing = [key for key in ("original", "traced", "response_time", "shape_type") if row.get(key) in (None, "")]
+        if missing:
+            raise ValueError(f"Manifest line {line}: shape record without {', '.join(missing)}")
+        return {"id": str(row.get("id") or row["traced"]), "type": "shape",
+                "original": resolve(row["original"]), "traced": resolve(row["traced"]),
+                "response_time": float(row["response_time"]), "shape_type": row["shape_type"]}
+    if record_type == "doodle":
+        if not row.get("doodle"):
+            raise ValueError(f"Manifest line {line}: doodle record without an image")
+        return {"id": str(row.get("id") or row["doodle"]), "type": "doodle", "doodle": resolve(row["doodle"])}
+    raise ValueError(f"Manifest line {line}: unknown record type {record_type}")
+
+
+def iter_manifest(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Records of a manifest file (.csv, otherwise JSON lines)
+
+    Raises:
+        ValueError: For a malformed record
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        if path.lower().endswith(".csv"):
+            for line, row in enumerate(csv.DictReader(f), start=2):
+                yield _manifest_record(row, base, line)
+        else:
+            for line, text in enumerate(f, start=1):
+                if text.strip():
+                    yield _manifest_record(json.loads(text), base, line)
+
+
+def iter_records(source: str) -> Iterator[Dict[str, Any]]:
+    """
+    Records of a directory or manifest file
+    """
+    return iter_directory(source) if os.path.isdir(source) else iter_manifest(source)
+
+
+def chunked(records: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    iterator = iter(records)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def feature_tables(root: str) -> Dict[str, Any]:
+    """
+    Feature store tables of the current feature extractors, by record type
+    """
+    from utils.feature_store import FeatureStore
+    from models.shape_analyzer import ShapeAnalyzer
+    from models.drawing_analyzer import DrawingAnalyzer, ANALYSIS_SIZE
+
+    store = FeatureStore(root)
+    return {
+        "shape": store.table("shape", f"v{ShapeAnalyzer.FEATURE_VERSION}"),
+        "doodle": store.table("drawing", f"v{DrawingAnalyzer.FEATURE_VERSION}-{ANALYSIS_SIZE}px")
+    }
+
+
+# Models of a worker process (see _init_worker)
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(paths: Dict[str, str],
+                 slots: Optional[List[Dict[str, Any]]], counter, feature_store: Optional[str] = None):
+    """
+    Load the models in a worker process after applying its CPU slot
+    """
+    # Interrupts are handled by the parent, which stops handing out work
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    if slots:
+        try:
+            apply_resource_plan(slots[index % len(slots)])
+        except Exception as e:
+            logger.warning(f"Could not apply resource plan in worker {os.getpid()}: {e}")
+
+    # Imported after the thread settings are applied, since some libraries
+    # only read them once
+    from models.shape_analyzer import ShapeAnalyzer
+    from models.drawing_analyzer import DrawingAnalyzer
+    from models.gaugan_adapter import GauGANAdapter
+    from models.model_manager import weights_version
+
+    _worker.update(
+        shape_analyzer=ShapeAnalyzer(paths["shape_analyzer"], heuristics_path=paths.get("shape_heuristics")),
+        # Without pyramid levels: coarse early exits approximate the scores
+        drawing_analyzer=DrawingAnalyzer(paths["drawing_analyzer"], heuristics_path=paths.get("drawing_heuristics")),
+        gaugan_adapter=GauGANAdapter(paths["gaugan_adapter"]),
+        version=weights_version(paths),
+        # Doodle features depend on the GauGAN weights, not on the analyzers'
+        gaugan_version=weights_version({"gaugan_adapter": paths["gaugan_adapter"]}),
+        feature_tables=feature_tables(feature_store) if feature_store else None
+    )
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _decode(data: bytes, path: str):
+    from utils.image_processing import decode_image_bytes
+    image = decode_image_bytes(data)
+    if image is None:
+        raise ValueError(f"Could not decode {path}")
+    return image
+
+
+def _read_image(path: str):
+    return _decode(_read_bytes(path), path)
+
+
+def _record_features(record: Dict[str, Any], pool, new_features: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Features of a record from the feature store, extracted (and added to
+    new_features by key) if they are not stored yet
+    """
+    from utils.image_context import ImageContext
+    from utils.feature_store import content_key
+
+    table = _worker["feature_tables"][record["type"]]
+    if record["type"] == "shape":
+        original, traced = _read_bytes(record["original"]), _read_bytes(record["traced"])
+        key = content_key(original, traced, record["shape_type"], record["response_time"])
+        features = table.get(key) or new_features.get(key)
+        if features is None:
+            with ImageContext(_decode(original, record["original"]), pool) as original_img, \
+                    ImageContext(_decode(traced, record["traced"]), pool) as traced_img:
+                features = _worker["shape_analyzer"].extract_features(
+                    original_img, traced_img, record["response_time"], record["shape_type"])
+            new_features[key] = features
+    else:
+        doodle = _read_bytes(record["doodle"])
+        key = content_key(doodle, _worker["gaugan_version"])
+        features = table.get(key) or new_features.get(key)
+        if features is None:
+            with ImageContext(_decode(doodle, record["doodle"]), pool) as doodle_img:
+                generated = _worker["gaugan_adapter"].transform(doodle_img)
+            with ImageContext(generated, pool) as generated_img:
+                features = _worker["drawing_analyzer"].extract_features(generated_img)
+            new_features[key] = features
+    return features
+
+
+def analyze_record(record: Dict[str, Any],
+                   new_features: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Analyze one record in a worker process
+
+    Args:
+        record: Record to analyze
+        new_features: Newly extracted features by record type and key,
+            collected for the feature store (if the worker has one)
+
+    Returns:
+        Result with the record's id, type and inputs, "status" ("ok" or
+        "error"), "error", "emotional_state", "top_emotion",
+        "model_version" and "seconds"
+    """
+    from utils.image_context import ImageContext
+    from utils.buffer_pool import get_buffer_pool
+
+    result = {"id": record["id"], "type": record["type"], "status": "ok", "error": None,
+              "model_version": _worker["version"], "shape_type": record.get("shape_type"),
+              "response_time": record.get("response_time"), "emotional_state": None,
+              "top_emotion": None}
+    start = time.perf_counter()
+    try:
+        pool = get_buffer_pool()
+        if _worker["feature_tables"] is not None:
+            if new_features is None:
+                new_features = {}
+            features = _record_features(record, pool, new_features.setdefault(record["type"], {}))
+            analyzer = _worker["shape_analyzer" if record["type"] == "shape" else "drawing_analyzer"]
+            emotions = analyzer.score_features(features)
+        elif record["type"] == "shape":
+            original, traced = _read_image(record["original"]), _read_image(record["traced"])
+            with ImageContext(original, pool) as original_img, ImageContext(traced, pool) as traced_img:
+                emotions = _worker["shape_analyzer"].analyze(
+                    original_img, traced_img, record["response_time"], record["shape_type"])
+        else:
+            with ImageContext(_read_image(record["doodle"]), pool) as doodle_img:
+                generated = _worker["gaugan_adapter"].transform(doodle_img)
+            with ImageContext(generated, pool) as generated_img:
+                emotions = _worker["drawing_analyzer"].analyze_image(generated_img)
+        emotional_state = {emotion: float(score) for emotion, score in emotions.items()}
+        result["emotional_state"] = emotional_state
+        result["top_emotion"] = max(emotional_state.items(), key=lambda x: x[1])[0]
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def analyze_chunk(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    new_features = {}
+    results = [analyze_record(record, new_features) for record in records]
+    # One feature store segment per chunk and record type
+    for record_type, features in new_features.items():
+        if features:
+            try:
+                _worker["feature_tables"][record_type].put(list(features.keys()), list(features.values()))
+            except Exception as e:
+                logger.warning(f"Could not store {len(features)} {record_type} features: {e}")
+    return results
+
+
+class JSONLResultWriter:
+    """
+    Appends results to a JSON lines file (one result per line)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def completed(self, retry_errors: bool = False) -> Set[str]:
+        """
+        Ids of the records already in the file
+
+        A line cut short by an interruption is removed first.
+
+        Args:
+            retry_errors: Leave out records that failed (they are analyzed
+                again and appended; readers should keep the last line per id)
+        """
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        valid_bytes = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                valid_bytes += len(line)
+                result = json.loads(line)
+                if result["status"] == "ok" or not retry_errors:
+                    done.add(result["id"])
+                else:
+                    done.discard(result["id"])
+        if valid_bytes < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_bytes)
+        return done
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def write(self, results: List[Dict[str, Any]]):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a")
+        self._file.write("".join(json.dumps(result) + "\n" for result in results))
+        self._file.flush()
+
+    def sync(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self.sync()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetResultWriter:
+    """
+    Writes results to a directory of Parquet files with rows_per_file rows
+    each (the last one possibly fewer).
+
+    Results are buffered until a file is full, so an interruption loses at
+    most one file's worth of results, which are analyzed again on resume.
+    """
+
+    def __init__(self, directory: str, rows_per_file: int = 10000):
+        if pa is None:
+            raise ImportError("pyarrow is required for Parquet output")
+        self.directory = directory
+        self.rows_per_file = rows_per_file
+        self._rows: List[Dict[str, Any]] = []
+        self._next_part = 0
+        self.schema = pa.schema([
+            ("id", pa.string()),
+            ("type", pa.string()),
+            ("status", pa.string()),
+            ("error", pa.string()),
+            ("model_version", pa.string()),
+            ("shape_type", pa.string()),
+            ("response_time", pa.float64()),
+            ("emotional_state", pa.map_(pa.string(), pa.float64())),
+            ("top_emotion", pa.string()),
+            ("seconds", pa.float64())
+        ])
+
+    def _parts(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "part-*.parquet")))
+
+    def completed(self, retry_errors: bool = False) -> Set[str]:
+        """
+        Ids of the records in the existing files (see JSONLResultWriter.completed)
+        """
+        done = set()
+        parts = self._parts()
+        for part in parts:
+            table = pq.read_table(part, columns=["id", "status"])
+            for record_id, status in zip(table.column("id").to_pylist(), table.column("status").to_pylist()):
+                if status == "ok" or not retry_errors:
+                    done.add(record_id)
+                else:
+                    done.discard(record_id)
+        if parts:
+            self._next_part = int(os.path.basename(parts[-1])[5:-8]) + 1
+        return done
+
+    def clear(self):
+        for part in self._parts():
+            os.remove(part)
+        self._next_part = 0
+
+    def write(self, results: List[Dict[str, Any]]):
+        self._rows.extend(results)
+        while len(self._rows) >= self.rows_per_file:
+            self._write_part(self._rows[:self.rows_per_file])
+            self._rows = self._rows[self.rows_per_file:]
+
+    def _write_part(self, rows: List[Dict[str, Any]]):
+        os.makedirs(self.directory, exist_ok=True)
+        rows = [dict(row, emotional_state=list(row["emotional_state"].items())
+                     if row["emotional_state"] is not None else None) for row in rows]
+        table = pa.Table.from_pylist(rows, schema=self.schema)
+        path = os.path.join(self.directory, f"part-{self._next_part:05d}.parquet")
+        temp_path = path + ".tmp"
+        pq.write_table(table, temp_path)
+        os.replace(temp_path, path)
+        self._next_part += 1
+
+    def sync(self):
+        # Only complete files are written (see the class description)
+        pass
+
+    def close(self):
+        if self._rows:
+            self._write_part(self._rows)
+            self._rows = []
+
+
+def checkpoint_path(output: str) -> str:
+    return output.rstrip("/\\") + ".checkpoint.json"
+
+
+def save_checkpoint(path: str, state: Dict[str, Any]):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(dict(state, updated_at=time.time()), f, indent=2)
+    os.replace(temp_path, path)
+
+
+def run(source: str, output: str, output_format: str = "jsonl", workers: int = None,
+        chunk_size: int = 16, config: ServerConfig = None, retry_errors: bool = False,
+        overwrite: bool = False, limit: int = None, rows_per_file: int = 10000,
+        feature_store: str = None) -> Dict[str, Any]:
+    """
+    Analyze all records of a directory or manifest that are not yet in the output
+
+    Args:
+        source: Directory of doodle images or manifest file
+        output: JSON lines file, or directory for Parquet files
+        output_format: "jsonl" or "parquet"
+        workers: Worker processes (default: the effective CPUs)
+        chunk_size: Records handed to a worker at a time
+        config: Server configuration with the model paths and resource
+            settings (default: deployment/server/config.yml)
+        retry_errors: Analyze records that failed in an earlier run again
+        overwrite: Discard existing results instead of resuming
+        limit: Analyze at most this many records
+        rows_per_file: Rows per Parquet file
+        feature_store: Feature store directory to reuse and add extracted
+            features (default: features are not stored)
+
+    Returns:
+        Progress state (also stored in the checkpoint file next to the output)
+    """
+    config = config or ServerConfig()
+    workers = workers or detect_cpu_topology()["effective_cpus"]
+    if output_format == "parquet":
+        writer = ParquetResultWriter(output, rows_per_file)
+    else:
+        writer = JSONLResultWriter(output)
+
+    state_path = checkpoint_path(output)
+    if overwrite:
+        writer.clear()
+        if os.path.exists(state_path):
+            os.remove(state_path)
+    done = writer.completed(retry_errors)
+    state = {"source": os.path.abspath(source), "output": os.path.abspath(output), "format": output_format,
+             "records_done": len(done), "errors": 0, "model_versions": [], "finished": False}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            previous = json.load(f)
+        if previous.get("source") != state["source"]:
+            logger.warning(f"Resuming output written from {previous.get('source')} with {state['source']}")
+        state["errors"] = previous.get("errors", 0) if not retry_errors else 0
+        state["model_versions"] = previous.get("model_versions", [])
+    if done:
+        logger.info(f"Resuming: {len(done)} records already in {output}")
+
+    records = (record for record in iter_records(source) if record["id"] not in done)
+    if limit is not None:
+        records = islice(records, limit)
+    chunks = chunked(records, chunk_size)
+
+    models_config = config.get_models_config()
+    paths = {
+        "shape_analyzer": os.path.join(SRC_DIR, models_config["shape_analyzer_path"]),
+        "drawing_analyzer": os.path.join(SRC_DIR, models_config["drawing_analyzer_path"]),
+        "gaugan_adapter": os.path.join(SRC_DIR, models_config["gaugan_model_path"])
+    }
+    for analyzer in ("shape", "drawing"):
+        if models_config.get(f"{analyzer}_heuristics_path"):
+            paths[f"{analyzer}_heuristics"] = os.path.join(SRC_DIR, models_config[f"{analyzer}_heuristics_path"])
+    # One model inference at a time per process, so each gets its whole CPU share
+    slots = None
+    if config.get_resources_config().get("enabled", True):
+        slots = plan_resources(config, workers, model_concurrency=1)["slots"]
+
+    # Fresh interpreters: the parent's imports and threads are not inherited
+    context = multiprocessing.get_context("spawn")
+    counter = context.Value("i", 0)
+    start = last_checkpoint = time.perf_counter()
+    processed = 0
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                   initargs=(paths, slots, counter, feature_store))
+    logger.info(f"Analyzing {source} with {workers} worker processes")
+    try:
+        pending = set()
+        exhausted = False
+        while True:
+            # A bounded number of chunks in flight keeps memory constant
+            while not exhausted and len(pending) < 2 * workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    pending.add(executor.submit(analyze_chunk, chunk))
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                results = future.result()
+                writer.write(results)
+                processed += len(results)
+                state["records_done"] += len(results)
+                for result in results:
+                    if result["status"] != "ok":
+                        state["errors"] += 1
+                    if result["model_version"] not in state["model_versions"]:
+                        state["model_versions"].append(result["model_version"])
+
+            now = time.perf_counter()
+            if now - last_checkpoint >= CHECKPOINT_INTERVAL:
+                last_checkpoint = now
+                writer.sync()
+                save_checkpoint(state_path, state)
+                logger.info(f"{state['records_done']} records done ({state['errors']} errors), "
+                            f"{processed / (now - start):.1f} records/s")
+        state["finished"] = True
+    except KeyboardInterrupt:
+        logger.warning("Interrupted; run the same command again to resume")
+        executor.shutdown(wait=False, cancel_futures=True)
+    finally:
+        executor.shutdown(wait=True)
+        writer.close()
+        elapsed = time.perf_counter() - start
+        state["seconds"] = elapsed
+        save_checkpoint(state_path, state)
+    if feature_store and state["finished"]:
+        # Merge the segments written per chunk
+        for record_type, table in feature_tables(feature_store).items():
+            if table.segments():
+                logger.info(f"Feature store {table.path}: {table.compact()} rows")
+    if len(state["model_versions"]) > 1:
+        logger.warning(f"Output mixes model versions {state['model_versions']}")
+    logger.info(f"Analyzed {processed} records in {elapsed:.1f} s "
+                f"({processed / elapsed if elapsed > 0 else 0.0:.1f} records/s), "
+                f"{state['records_done']} in {output}")
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze archives of tracings and doodles in parallel")
+    parser.add_argument("source", help="Directory of doodle images, or manifest (.jsonl or .csv)")
+    parser.add_argument("--output", required=True, help="JSON lines file, or directory for Parquet files")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="jsonl", help="Output format")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes (default: all effective CPUs)")
+    parser.add_argument("--chunk-size", type=int, default=16, help="Records per work item")
+    parser.add_argument("--rows-per-file", type=int, default=10000, help="Rows per Parquet file")
+    parser.add_argument("--limit", type=int, default=None, help="Analyze at most this many records")
+    parser.add_argument("--retry-errors", action="store_true", help="Analyze previously failed records again")
+    parser.add_argument("--overwrite", action="store_true", help="Discard existing results instead of resuming")
+    parser.add_argument("--feature-store", help="Directory of stored features to reuse and extend")
+    parser.add_argument("--config", help="Server configuration file with the model paths")
+    args = parser.parse_args()
+
+    config = ServerConfig(args.config)
+    load_environment_variables(config)
+    state = run(args.source, args.output, args.format, args.workers, args.chunk_size, config,
+                retry_errors=args.retry_errors, overwrite=args.overwrite, limit=args.limit,
+                rows_per_file=args.rows_per_file, feature_store=args.feature_store)
+    return 0 if state["finished"] else 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
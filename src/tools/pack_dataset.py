@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Dataset Packing for AI-PsychDoodle-Analyzer
+Packs labeled tracings or doodles into a sharded training dataset
+
+The input is a manifest (JSON lines or CSV) of labeled records, as for
+bulk_analyze.py plus the labels, either as emotion scores or as a single
+emotion:
+
+    {"id": "p17-circle", "original": "shapes/circle.png", "traced": "p17/circle.png",
+     "response_time": 2.4, "shape_type": "circle", "labels": {"calm": 0.7, "focused": 0.3}}
+    {"id": "p17-doodle", "doodle": "p17/doodle.png", "label": "joyful"}
+
+In CSV manifests, labels are a "label" column or one column per emotion.
+Relative paths are resolved against the manifest's directory. The dataset
+is written in the format of utils/dataset.py.
+
+Usage:
+    python src/tools/pack_dataset.py manifest.jsonl --type shape --output datasets/shapes
+    python src/tools/pack_dataset.py manifest.csv --type doodle --output datasets/doodles --image-size 256
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+import cv2
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SRC_DIR)
+
+from utils.dataset import RECORD_IMAGES, ShardWriter
+from utils.image_processing import decode_image_bytes, encode_image, resize_image
+from models.heuristic_engine import default_spec_path, load_spec
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Heuristics spec with the emotion categories of each record type
+ANALYZERS = {"shape": "shape", "doodle": "drawing"}
+
+
+def default_emotions(record_type: str) -> List[str]:
+    """
+    Emotion categories of the analyzer trained on a record type
+    """
+    return load_spec(default_spec_path(ANALYZERS[record_type]))["emotions"]
+
+
+def _labels(row: Dict[str, Any], emotions: List[str], line: int) -> Dict[str, float]:
+    if isinstance(row.get("labels"), dict):
+        return {emotion: float(score) for emotion, score in row["labels"].items()}
+    if row.get("label"):
+        return {row["label"]: 1.0}
+    scores = {emotion: float(row[emotion]) for emotion in emotions if row.get(emotion) not in (None, "")}
+    if not scores:
+        raise ValueError(f"Manifest line {line}: record without labels")
+    return scores
+
+
+def iter_labeled_records(path: str, record_type: str, emotions: List[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Labeled records of one type from a manifest (.csv, otherwise JSON lines);
+    records of other types are skipped
+
+    Raises:
+        ValueError: For a malformed record
+    """
+    base = os.path.dirname(os.path.abspath(path))
+
+    def record(row: Dict[str, Any], line: int) -> Optional[Dict[str, Any]]:
+        row_type = row.get("type") or ("shape" if row.get("traced") else "doodle")
+        if row_type != record_type:
+            return None
+        fields = {}
+        if record_type == "shape":
+            missing = [key for key in ("response_time", "shape_type") if row.get(key) in (None, "")]
+            if missing:
+                raise ValueError(f"Manifest line {line}: shape record without {', '.join(missing)}")
+            fields = {"response_time": float(row["response_time"]), "shape_type": row["shape_type"]}
+        images = {}
+        for name in RECORD_IMAGES[record_type]:
+            if not row.get(name):
+                raise ValueError(f"Manifest line {line}: {record_type} record without {name}")
+            images[name] = row[name] if os.path.isabs(row[name]) else os.path.join(base, row[name])
+        return {"id": str(row.get("id") or images[RECORD_IMAGES[record_type][-1]]), "images": images,
+                "labels": _labels(row, emotions, line), "fields": fields}
+
+    with open(path, newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = enumerate(csv.DictReader(f), start=2)
+        else:
+            rows = ((line, json.loads(text)) for line, text in enumerate(f, start=1) if text.strip())
+        for line, row in rows:
+            result = record(row, line)
+            if result is not None:
+                yield result
+
+
+def load_images(record: Dict[str, Any], image_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Read the image files of a record (letterboxed to image_size and
+    re-encoded as PNG if given, otherwise as they are)
+    """
+    images = {}
+    for name, path in record["images"].items():
+        with open(path, "rb") as f:
+            data = f.read()
+        if image_size is not None:
+            image = decode_image_bytes(data)
+            if image is None:
+                raise ValueError(f"Could not decode {path}")
+            if image.ndim == 2 or image.shape[2] != 3:
+                image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR if image.ndim == 2 else cv2.COLOR_RGBA2BGR)
+            data = encode_image(resize_image(image, (image_size, image_size)), format="png")
+        images[name] = data
+    return dict(record, images=images)
+
+
+def pack(manifest: str, output: str, record_type: str, emotions: List[str] = None,
+         shard_megabytes: int = 256, image_size: Optional[int] = None, workers: int = 8,
+         skip_errors: bool = False) -> Dict[str, Any]:
+    """
+    Pack the records of one type from a manifest into a dataset
+
+    Args:
+        manifest: Manifest file
+        output: Dataset directory
+        record_type: "shape" or "doodle"
+        emotions: Label order (default: the analyzer's emotion categories)
+        shard_megabytes: Shard size
+        image_size: Letterbox images to this square size (default: keep
+            the original files)
+        workers: Threads reading (and resizing) images
+        skip_errors: Skip records whose images cannot be read instead of
+            failing
+
+    Returns:
+        Dataset index
+    """
+    emotions = emotions or default_emotions(record_type)
+    start = time.perf_counter()
+    skipped = 0
+    records = iter_labeled_records(manifest, record_type, emotions)
+    with ThreadPoolExecutor(workers) as pool, \
+            ShardWriter(output, record_type, emotions, shard_megabytes * 1024 * 1024) as writer:
+        # Reads run ahead in the pool, in bounded windows to keep memory flat
+        while True:
+            window = [record for _, record in zip(range(workers * 16), records)]
+            if not window:
+                break
+            futures = [pool.submit(load_images, record, image_size) for record in window]
+            for record, future in zip(window, futures):
+                try:
+                    loaded = future.result()
+                except (OSError, ValueError) as e:
+                    if not skip_errors:
+                        raise
+                    logger.warning(f"Skipping {record['id']}: {e}")
+                    skipped += 1
+                    continue
+                writer.write(loaded["id"], loaded["images"], loaded["labels"], **loaded["fields"])
+        index = writer.close()
+    elapsed = time.perf_counter() - start
+    logger.info(f"Packed {index['records']} {record_type} records into {len(index['shards'])} shards "
+                f"in {elapsed:.1f} s ({skipped} skipped)")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack labeled tracings or doodles into a sharded dataset")
+    parser.add_argument("manifest", help="Manifest of labeled records (.jsonl or .csv)")
+    parser.add_argument("--type", required=True, choices=sorted(RECORD_IMAGES), help="Record type to pack")
+    parser.add_argument("--output", required=True, help="Dataset directory")
+    parser.add_argument("--shard-size", type=int, default=256, help="Shard size in MB")
+    parser.add_argument("--image-size", type=int, default=None,
+                        help="Letterbox images to this size and store them as PNG (default: keep the files)")
+    parser.add_argument("--workers", type=int, default=8, help="Image reading threads")
+    parser.add_argument("--skip-errors", action="store_true", help="Skip records with unreadable images")
+    args = parser.parse_args()
+
+    pack(args.manifest, args.output, args.type, shard_megabytes=args.shard_size,
+         image_size=args.image_size, workers=args.workers, skip_errors=args.skip_errors)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
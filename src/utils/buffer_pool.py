@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Buffer Pool for AI-PsychDoodle-Analyzer
+Reuses the full-size NumPy arrays that pipeline stages need as temporaries
+"""
+
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+BufferKey = Tuple[Tuple[int, ...], str]
+
+
+class BufferPool:
+    """
+    Thread-safe arena of preallocated arrays keyed by shape and dtype.
+
+    Stages acquire a buffer, use it as the dst/out argument of OpenCV and
+    NumPy calls, and release it when done. Once every buffer shape a pipeline
+    needs has been allocated, processing the same kind of request again
+    allocates nothing, which the allocation counters make visible.
+
+    Acquired buffers are uninitialized. Releasing a buffer that is still
+    referenced elsewhere is a bug: the next acquirer will overwrite it.
+    """
+
+    def __init__(self, max_buffers_per_key: int = 16, max_bytes: int = 256 * 1024 * 1024,
+                 on_acquire: Optional[Callable[[bool], None]] = None):
+        """
+        Initialize the pool
+
+        Args:
+            max_buffers_per_key: Maximum idle buffers kept per shape and dtype
+            max_bytes: Maximum total size of idle buffers
+            on_acquire: Called with True when a pooled buffer is reused and
+                False when a new one is allocated (e.g. to export hit rates)
+        """
+        self.max_buffers_per_key = max_buffers_per_key
+        self.max_bytes = max_bytes
+        self.on_acquire = on_acquire
+
+        self._lock = threading.Lock()
+        self._free: Dict[BufferKey, List[np.ndarray]] = defaultdict(list)
+        self._pooled_bytes = 0
+        self._outstanding = 0
+
+        self.allocations = 0
+        self.allocated_bytes = 0
+        self.reuses = 0
+        self.releases = 0
+        self.discards = 0
+
+    @staticmethod
+    def _key(shape: Tuple[int, ...], dtype) -> BufferKey:
+        return tuple(int(n) for n in shape), np.dtype(dtype).str
+
+    def acquire(self, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """
+        Borrow an uninitialized buffer
+
+        Args:
+            shape: Array shape
+            dtype: Array dtype
+
+        Returns:
+            C-contiguous array to be passed back to release()
+        """
+        key = self._key(shape, dtype)
+        with self._lock:
+            free = self._free.get(key)
+            buffer = free.pop() if free else None
+            reused = buffer is not None
+            if reused:
+                self._pooled_bytes -= buffer.nbytes
+                self.reuses += 1
+            self._outstanding += 1
+
+        if not reused:
+            buffer = np.empty(key[0], dtype=key[1])
+            with self._lock:
+                self.allocations += 1
+                self.allocated_bytes += buffer.nbytes
+
+        if self.on_acquire is not None:
+            self.on_acquire(reused)
+        return buffer
+
+    def acquire_zeros(self, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """
+        Borrow a zero-filled buffer
+        """
+        buffer = self.acquire(shape, dtype)
+        buffer.fill(0)
+        return buffer
+
+    def release(self, *buffers: np.ndarray):
+        """
+        Return buffers to the pool
+
+        Buffers are dropped instead of pooled when their shape's free list or
+        the pool's byte budget is full. Views and non-contiguous arrays are
+        ignored.
+        """
+        with self._lock:
+            for buffer in buffers:
+                if buffer is None:
+                    continue
+                self._outstanding -= 1
+                self.releases += 1
+                if buffer.base is not None or not buffer.flags.c_contiguous:
+                    self.discards += 1
+                    continue
+                key = self._key(buffer.shape, buffer.dtype)
+                free = self._free[key]
+                if (len(free) >= self.max_buffers_per_key
+                        or self._pooled_bytes + buffer.nbytes > self.max_bytes):
+                    self.discards += 1
+                    continue
+                buffer.flags.writeable = True
+                free.append(buffer)
+                self._pooled_bytes += buffer.nbytes
+
+    @contextmanager
+    def borrow(self, shape: Tuple[int, ...], dtype=np.uint8, zero: bool = False) -> Iterator[np.ndarray]:
+        """
+        Borrow a buffer for the duration of a with block
+
+        Args:
+            shape: Array shape
+            dtype: Array dtype
+            zero: Whether to zero-fill the buffer
+        """
+        buffer = self.acquire_zeros(shape, dtype) if zero else self.acquire(shape, dtype)
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+    def clear(self):
+        """
+        Drop all idle buffers
+        """
+        with self._lock:
+            self._free.clear()
+            self._pooled_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Allocation counters
+
+        Returns:
+            Dictionary with allocations, allocated_bytes, reuses, releases,
+            discards, outstanding (borrowed and not yet released), pooled
+            (idle buffers) and pooled_bytes
+        """
+        with self._lock:
+            return {
+                "allocations": self.allocations,
+                "allocated_bytes": self.allocated_bytes,
+                "reuses": self.reuses,
+                "releases": self.releases,
+                "discards": self.discards,
+                "outstanding": self._outstanding,
+                "pooled": sum(len(free) for free in self._free.values()),
+                "pooled_bytes": self._pooled_bytes
+            }
+
+
+# Process-wide pool used by the pipeline (replaced by the server at startup)
+_default_pool = BufferPool()
+
+
+def get_buffer_pool() -> BufferPool:
+    """
+    Get the process-wide buffer pool
+    """
+    return _default_pool
+
+
+def set_buffer_pool(pool: BufferPool):
+    """
+    Replace the process-wide buffer pool
+    """
+    global _default_pool
+    _default_pool = pool
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Composition Features for AI-PsychDoodle-Analyzer
+Region statistics (brightness, contrast, edge density, color mass) from integral images
+"""
+
+import numpy as np
+import cv2
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from utils.buffer_pool import BufferPool
+
+Region = Tuple[int, int, int, int]  # (x0, y0, x1, y1), exclusive end
+
+
+def grid_regions(width: int, height: int, rows: int, cols: int, prefix: str) -> Dict[str, Region]:
+    """
+    Split an image into a grid of regions
+
+    Args:
+        width: Image width
+        height: Image height
+        rows: Number of rows
+        cols: Number of columns
+        prefix: Region name prefix (names are "<prefix>_<row>_<col>")
+
+    Returns:
+        Mapping of region name to (x0, y0, x1, y1)
+    """
+    xs = np.linspace(0, width, cols + 1).round().astype(int)
+    ys = np.linspace(0, height, rows + 1).round().astype(int)
+    return {
+        f"{prefix}_{r}_{c}": (int(xs[c]), int(ys[r]), int(xs[c + 1]), int(ys[r + 1]))
+        for r in range(rows) for c in range(cols)
+    }
+
+
+def composition_regions(width: int, height: int) -> Dict[str, Region]:
+    """
+    Standard composition layout: halves, quadrants, rule-of-thirds cells and
+    the central region (the periphery is derived from it, see RegionStatistics)
+
+    Args:
+        width: Image width
+        height: Image height
+
+    Returns:
+        Mapping of region name to (x0, y0, x1, y1)
+    """
+    return dict(_composition_regions(width, height))
+
+
+@lru_cache(maxsize=32)
+def _composition_regions(width: int, height: int) -> Tuple[Tuple[str, Region], ...]:
+    half_w, half_h = width // 2, height // 2
+    regions = {
+        "top": (0, 0, width, half_h),
+        "bottom": (0, height - half_h, width, height),
+        "left": (0, 0, half_w, height),
+        "right": (width - half_w, 0, width, height),
+        # Central box spanning the middle half of each axis (a quarter of the area)
+        "center": (width // 4, height // 4, width - width // 4, height - height // 4)
+    }
+    regions.update(grid_regions(width, height, 2, 2, "quadrant"))
+    regions.update(grid_regions(width, height, 3, 3, "third"))
+    return tuple(regions.items())
+
+
+@lru_cache(maxsize=32)
+def _layout_boxes(width: int, height: int) -> Tuple[Tuple[str, ...], np.ndarray]:
+    """
+    Region names and a (n, 4) box array for composition_regions plus the
+    periphery, encoded as the whole image followed by the center
+    """
+    regions = _composition_regions(width, height)
+    center = dict(regions)["center"]
+    names = tuple(name for name, _ in regions)
+    boxes = np.array([box for _, box in regions] + [(0, 0, width, height), center], dtype=np.intp)
+    boxes.flags.writeable = False
+    return names, boxes
+
+
+class RegionStatistics:
+    """
+    Constant-time statistics for any rectangular region of an image.
+
+    One integral image of the grayscale values and one of their squares give
+    the mean (brightness) and standard deviation (contrast) of any rectangle
+    from four lookups each; extra layers (e.g. an edge map or the saturation
+    channel) are stacked as channels of the same integral image, so a whole
+    layout of regions is evaluated with a handful of vectorized lookups.
+
+    With a BufferPool the integral images are written into pooled buffers
+    that release() (or leaving a with block) returns.
+    """
+
+    def __init__(self, gray: np.ndarray, layers: Dict[str, np.ndarray] = None,
+                 pool: Optional[BufferPool] = None):
+        """
+        Build the integral images
+
+        Args:
+            gray: Grayscale image (uint8)
+            layers: Additional single-channel uint8 layers by name, e.g.
+                {"edge_density": edges, "color_mass": saturation}; region
+                values are their means scaled to 0.0-1.0
+            pool: Buffer pool for the integral images (optional)
+        """
+        self.height, self.width = gray.shape[:2]
+        self.layer_names = list((layers or {}).keys())
+        self.pool = pool
+        self._buffers: List[np.ndarray] = []
+        
+        # Integer sums are exact and much faster than float64 ones as long as
+        # they cannot overflow
+        exact = self.height * self.width * 255 < 2 ** 31
+        depth, dtype = (cv2.CV_32S, np.int32) if exact else (cv2.CV_64F, np.float64)
+        integral_shape = (self.height + 1, self.width + 1)
+        gray_sum, self._sqsum = cv2.integral2(
+            gray, sum=self._buffer(integral_shape, dtype),
+            sqsum=self._buffer(integral_shape, np.float64),
+            sdepth=depth, sqdepth=cv2.CV_64F)
+        self._integrals = [gray_sum[:, :, None]]
+        if self.layer_names:
+            channels = len(self.layer_names)
+            layer_stack = [layers[name] for name in self.layer_names]
+            if channels > 1:
+                stacked = cv2.merge(layer_stack, dst=self._buffer((self.height, self.width, channels), np.uint8))
+            else:
+                stacked = layer_stack[0]
+            layer_sum = cv2.integral(stacked, sum=self._buffer(integral_shape + (channels,) if channels > 1
+                                                               else integral_shape, dtype), sdepth=depth)
+            self._integrals.append(layer_sum.reshape(integral_shape + (channels,)))
+
+    def __enter__(self) -> "RegionStatistics":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def _buffer(self, shape: Tuple[int, ...], dtype) -> Optional[np.ndarray]:
+        """
+        Pooled output buffer (None without a pool)
+        """
+        if self.pool is None:
+            return None
+        buffer = self.pool.acquire(shape, dtype)
+        self._buffers.append(buffer)
+        return buffer
+
+    def release(self):
+        """
+        Return pooled buffers to the pool; the statistics must not be used afterwards
+        """
+        if self.pool is not None and self._buffers:
+            self.pool.release(*self._buffers)
+        self._buffers = []
+
+    def _sums(self, boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Areas, per-channel sums and grayscale square sums of regions
+
+        Args:
+            boxes: Integer array of shape (n, 4) with (x0, y0, x1, y1) rows
+        """
+        x0, y0, x1, y1 = boxes.T
+        areas = np.maximum(0, x1 - x0) * np.maximum(0, y1 - y0)
+        sums = np.hstack([
+            integral[y1, x1].astype(np.float64) - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+            for integral in self._integrals
+        ])
+        squares = self._sqsum[y1, x1] - self._sqsum[y0, x1] - self._sqsum[y1, x0] + self._sqsum[y0, x0]
+        return areas, sums, squares
+
+    def _statistics(self, areas: np.ndarray, sums: np.ndarray,
+                    squares: np.ndarray) -> List[Dict[str, float]]:
+        safe_areas = np.maximum(areas, 1).astype(np.float64)
+        means = sums / safe_areas[:, None]
+        variances = np.maximum(0.0, squares / safe_areas - means[:, 0] ** 2)
+        values = np.empty((len(areas), 2 + len(self.layer_names)))
+        values[:, 0] = means[:, 0] / 255.0
+        values[:, 1] = np.sqrt(variances) / 128.0  # Normalized like DrawingAnalyzer's global contrast
+        values[:, 2:] = means[:, 1:] / 255.0
+        values[areas <= 0] = 0.0
+        keys = ["brightness", "contrast"] + self.layer_names
+        return [dict(zip(keys, row)) for row in values.tolist()]
+
+    def regions(self, regions: Dict[str, Region]) -> Dict[str, Dict[str, float]]:
+        """
+        Statistics of a set of regions
+
+        Args:
+            regions: Mapping of region name to (x0, y0, x1, y1) with exclusive end coordinates
+
+        Returns:
+            Mapping of region name to a dictionary with brightness and
+            contrast plus one entry per layer
+        """
+        names = list(regions.keys())
+        boxes = np.array([regions[name] for name in names], dtype=np.intp).reshape(-1, 4)
+        return dict(zip(names, self._statistics(*self._sums(boxes))))
+
+    def region(self, region: Region) -> Dict[str, float]:
+        """
+        Statistics of one region
+
+        Args:
+            region: (x0, y0, x1, y1) with exclusive end coordinates
+        """
+        return self.regions({"region": region})["region"]
+
+    def complement(self, region: Region) -> Dict[str, float]:
+        """
+        Statistics of everything outside a region (e.g. the periphery around
+        the center), from the whole-image sums minus the region's
+        """
+        boxes = np.array([(0, 0, self.width, self.height), region], dtype=np.intp)
+        areas, sums, squares = self._sums(boxes)
+        return self._statistics(areas[:1] - areas[1:], sums[:1] - sums[1:], squares[:1] - squares[1:])[0]
+
+    def layout(self, regions: Dict[str, Region] = None) -> Dict[str, Dict[str, float]]:
+        """
+        Statistics of a composition layout
+
+        Args:
+            regions: Mapping of region name to (x0, y0, x1, y1) (defaults to
+                composition_regions; a "periphery" entry is added whenever a
+                "center" region is present)
+
+        Returns:
+            Mapping of region name to its statistics
+        """
+        if regions is not None:
+            stats = self.regions(regions)
+            if "center" in regions:
+                stats["periphery"] = self.complement(regions["center"])
+            return stats
+        
+        # Default layout: all boxes (plus whole image and center for the
+        # periphery) in a single vectorized lookup
+        names, boxes = _layout_boxes(self.width, self.height)
+        areas, sums, squares = self._sums(boxes)
+        areas = np.append(areas[:-2], areas[-2] - areas[-1])
+        sums = np.vstack([sums[:-2], sums[-2] - sums[-1]])
+        squares = np.append(squares[:-2], squares[-2] - squares[-1])
+        return dict(zip(names + ("periphery",), self._statistics(areas, sums, squares)))
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+Training Datasets for AI-PsychDoodle-Analyzer
+Sharded, indexed record files and a streaming loader
+
+A dataset holds the records of one type ("shape": original and traced
+image, response time, shape type; "doodle": the doodle image), each with
+its emotion labels. Records are appended to shard files of a bounded size,
+with the encoded images stored as they are, so packing does not re-encode
+and the loader decodes in parallel:
+
+    <dataset>/index.json        type, emotions, record and shard counts
+    <dataset>/shard-00000.rec   records: 4-byte header length, JSON header,
+                                image bytes
+    <dataset>/shard-00000.idx   .npy array of (offset, length, crc32) per record
+
+Reading a dataset opens one file per shard instead of several files per
+sample: the loader streams shards sequentially through a shuffle buffer,
+decodes and resizes images on a thread pool (utils.image_processing) and
+prepares batches in the background, while the index gives random access
+to any record.
+
+Usage:
+    python src/tools/pack_dataset.py manifest.jsonl --type shape --output datasets/shapes
+"""
+
+import os
+import json
+import mmap
+import zlib
+import queue
+import random
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import cv2
+
+from utils.image_processing import decode_image_bytes, resize_image
+
+FORMAT_VERSION = 1
+
+# Image fields of the records of each type
+RECORD_IMAGES = {
+    "shape": ("original", "traced"),
+    "doodle": ("doodle",)
+}
+
+# Length prefix of a record's JSON header
+HEADER_LENGTH = struct.Struct("<I")
+
+
+def _shard_name(index: int) -> str:
+    return f"shard-{index:05d}"
+
+
+class ShardWriter:
+    """
+    Writes records to the shards of a new dataset.
+
+    Shards are written under temporary names and renamed when complete,
+    and index.json is written last by close(), so readers only see
+    complete files.
+    """
+
+    def __init__(self, path: str, record_type: str, emotions: List[str],
+                 shard_bytes: int = 256 * 1024 * 1024):
+        """
+        Start a dataset
+
+        Args:
+            path: Dataset directory (created; existing shards are replaced)
+            record_type: "shape" or "doodle"
+            emotions: Label order of the dataset
+            shard_bytes: Size after which a new shard is started
+        """
+        if record_type not in RECORD_IMAGES:
+            raise ValueError(f"Unknown record type {record_type}")
+        self.path = path
+        self.record_type = record_type
+        self.emotions = list(emotions)
+        self.shard_bytes = shard_bytes
+        self.shards: List[Dict[str, Any]] = []
+        self._file = None
+        self._index: List[tuple] = []
+        self._offset = 0
+        self._closed: Optional[Dict[str, Any]] = None
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, record_id: str, images: Dict[str, bytes], labels: Dict[str, float],
+              **fields: Any):
+        """
+        Append a record
+
+        Args:
+            record_id: Unique id of the record
+            images: Encoded image (PNG, JPEG, ...) by field, see RECORD_IMAGES
+            labels: Emotion scores (emotions not given are 0)
+            fields: Other values (e.g. response_time, shape_type)
+
+        Raises:
+            ValueError: For missing images or unknown emotions
+        """
+        missing = [name for name in RECORD_IMAGES[self.record_type] if not images.get(name)]
+        if missing:
+            raise ValueError(f"Record {record_id}: missing images {', '.join(missing)}")
+        unknown = set(labels) - set(self.emotions)
+        if unknown:
+            raise ValueError(f"Record {record_id}: unknown emotions {', '.join(sorted(unknown))}")
+
+        names = RECORD_IMAGES[self.record_type]
+        header = json.dumps({
+            "id": record_id,
+            "labels": {emotion: float(score) for emotion, score in labels.items()},
+            "fields": fields,
+            "images": [[name, len(images[name])] for name in names]
+        }).encode("utf-8")
+        parts = [HEADER_LENGTH.pack(len(header)), header] + [images[name] for name in names]
+        length = sum(len(part) for part in parts)
+
+        if self._file is None or self._offset + length > self.shard_bytes and self._index:
+            self._finish_shard()
+            self._file = open(os.path.join(self.path, _shard_name(len(self.shards)) + ".rec.tmp"), "wb")
+        crc = 0
+        for part in parts:
+            self._file.write(part)
+            crc = zlib.crc32(part, crc)
+        self._index.append((self._offset, length, crc))
+        self._offset += length
+
+    def _finish_shard(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        name = _shard_name(len(self.shards))
+        base = os.path.join(self.path, name)
+        with open(base + ".idx.tmp", "wb") as f:
+            np.save(f, np.array(self._index, dtype=np.uint64).reshape(-1, 3))
+        os.replace(base + ".idx.tmp", base + ".idx")
+        os.replace(base + ".rec.tmp", base + ".rec")
+        self.shards.append({"name": name, "records": len(self._index), "bytes": self._offset})
+        self._index = []
+        self._offset = 0
+
+    def close(self) -> Dict[str, Any]:
+        """
+        Finish the last shard and write the index
+
+        Returns:
+            Dataset index (the content of index.json)
+        """
+        if self._closed is not None:
+            return self._closed
+        self._finish_shard()
+        # Shards of an earlier, larger dataset in the same directory
+        index = len(self.shards)
+        while os.path.exists(os.path.join(self.path, _shard_name(index) + ".rec")):
+            for extension in (".rec", ".idx"):
+                os.remove(os.path.join(self.path, _shard_name(index) + extension))
+            index += 1
+        content = {
+            "format": FORMAT_VERSION,
+            "type": self.record_type,
+            "emotions": self.emotions,
+            "images": list(RECORD_IMAGES[self.record_type]),
+            "records": sum(shard["records"] for shard in self.shards),
+            "shards": self.shards
+        }
+        temp_path = os.path.join(self.path, "index.json.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(content, f, indent=2)
+        os.replace(temp_path, os.path.join(self.path, "index.json"))
+        self._closed = content
+        return content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        elif self._file is not None:
+            self._file.close()
+            os.remove(self._file.name)
+            self._file = None
+
+
+class ShardedDataset:
+    """
+    Random and sequential access to the records of a packed dataset.
+
+    Shards are memory-mapped, so records are read without a file open and
+    the dataset can be shared by threads.
+    """
+
+    def __init__(self, path: str, verify: bool = False):
+        """
+        Open a dataset
+
+        Args:
+            path: Dataset directory
+            verify: Check the CRC of every record read
+        """
+        self.path = path
+        self.verify = verify
+        with open(os.path.join(path, "index.json")) as f:
+            self.info = json.load(f)
+        if self.info.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported dataset format {self.info.get('format')} in {path}")
+        self.record_type: str = self.info["type"]
+        self.emotions: List[str] = self.info["emotions"]
+        self.image_fields: List[str] = self.info["images"]
+        self.shards = [np.load(os.path.join(path, shard["name"] + ".idx")) for shard in self.info["shards"]]
+        # Index of the first record of each shard
+        self._starts = np.cumsum([0] + [len(index) for index in self.shards])
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return int(self._starts[-1])
+
+    def _map(self, shard: int) -> mmap.mmap:
+        if shard not in self._maps:
+            with self._lock:
+                if shard not in self._maps:
+                    with open(os.path.join(self.path, self.info["shards"][shard]["name"] + ".rec"), "rb") as f:
+                        self._maps[shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[shard]
+
+    def locate(self, index: int) -> tuple:
+        """
+        (shard, record within the shard) of a record index
+        """
+        if not 0 <= index < len(self):
+            raise IndexError(f"Record {index} out of range")
+        shard = int(np.searchsorted(self._starts, index, side="right")) - 1
+        return shard, index - int(self._starts[shard])
+
+    def read(self, shard: int, position: int) -> Dict[str, Any]:
+        """
+        Undecoded record: "id", "labels", "fields" and the encoded "images" by field
+
+        Raises:
+            ValueError: If verification is enabled and the record is corrupt
+        """
+        offset, length, crc = (int(value) for value in self.shards[shard][position])
+        data = self._map(shard)[offset:offset + length]
+        if self.verify and zlib.crc32(data) != crc:
+            raise ValueError(f"Corrupt record {position} in {self.info['shards'][shard]['name']}")
+        header_length, = HEADER_LENGTH.unpack_from(data)
+        end = HEADER_LENGTH.size + header_length
+        record = json.loads(data[HEADER_LENGTH.size:end])
+        images = {}
+        for name, size in record["images"]:
+            images[name] = data[end:end + size]
+            end += size
+        record["images"] = images
+        return record
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        return self.read(*self.locate(index))
+
+    def iter_shard(self, shard: int) -> Iterator[Dict[str, Any]]:
+        """
+        Undecoded records of a shard, in file order
+        """
+        for position in range(len(self.shards[shard])):
+            yield self.read(shard, position)
+
+    def close(self):
+        with self._lock:
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps = {}
+
+
+def decode_record(record: Dict[str, Any], emotions: List[str],
+                  image_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Decode an undecoded record into a training sample
+
+    Args:
+        record: Record as returned by ShardedDataset.read
+        emotions: Label order
+        image_size: Letterbox images to this square size (see
+            image_processing.resize_image), or keep their size if None
+
+    Returns:
+        Sample with "id", the images (BGR, uint8) by field, "labels"
+        (float32 vector) and the record's other fields
+    """
+    sample = dict(record["fields"], id=record["id"])
+    for name, data in record["images"].items():
+        image = decode_image_bytes(bytes(data))
+        if image is None:
+            raise ValueError(f"Could not decode {name} of record {record['id']}")
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        elif image.shape[2] == 4:
+            image = cv2.cvtColor(image, cv2.COLOR_RGBA2BGR)
+        if image_size is not None:
+            image = resize_image(image, (image_size, image_size))
+        sample[name] = image
+    sample["labels"] = np.array([record["labels"].get(emotion, 0.0) for emotion in emotions], dtype=np.float32)
+    return sample
+
+
+def collate(samples: List[Dict[str, Any]], image_fields: List[str]) -> Dict[str, Any]:
+    """
+    Combine samples into a batch: images into (batch, height, width, 3)
+    arrays (lists if their sizes differ), labels into (batch, emotions),
+    numeric fields into arrays and other fields into lists
+    """
+    batch = {}
+    for name in samples[0]:
+        values = [sample[name] for sample in samples]
+        if name in image_fields:
+            shapes = {value.shape for value in values}
+            batch[name] = np.stack(values) if len(shapes) == 1 else values
+        elif name == "labels":
+            batch[name] = np.stack(values)
+        elif all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+            batch[name] = np.array(values, dtype=np.float32)
+        else:
+            batch[name] = values
+    return batch
+
+
+class DataLoader:
+    """
+    Streams batches of decoded samples from a dataset.
+
+    Each epoch reads the shards in a (seeded) random order, one after the
+    other, and draws samples from a shuffle buffer, so reads stay sequential
+    while the order is mixed across shards. Images are decoded on a thread
+    pool (OpenCV and PIL release the GIL while decoding) and batches are
+    assembled by a background thread up to `prefetch` batches ahead.
+    """
+
+    def __init__(self, dataset: ShardedDataset, batch_size: int = 32, shuffle: bool = True,
+                 shuffle_buffer: int = 2048, image_size: Optional[int] = 224, workers: int = 4,
+                 prefetch: int = 4, drop_last: bool = False, seed: int = 0,
+                 rank: int = 0, world_size: int = 1):
+        """
+        Initialize the loader
+
+        Args:
+            dataset: Dataset to read
+            batch_size: Samples per batch
+            shuffle: Shuffle shards and samples (otherwise dataset order)
+            shuffle_buffer: Samples held for shuffling (larger mixes better
+                and uses more memory, as undecoded records)
+            image_size: Square size images are letterboxed to (None keeps
+                their sizes; batches then hold lists of images)
+            workers: Decoding threads
+            prefetch: Batches prepared ahead of the training loop
+            drop_last: Skip the last, incomplete batch
+            seed: Shuffle seed (combined with the epoch number)
+            rank: Index of this process in distributed training
+            world_size: Number of processes in distributed training (each
+                reads every world_size-th shard)
+        """
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shuffle_buffer = max(1, shuffle_buffer)
+        self.image_size = image_size
+        self.workers = max(1, workers)
+        self.prefetch = max(1, prefetch)
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.shards = list(range(rank, len(dataset.shards), world_size))
+
+    def __len__(self) -> int:
+        records = sum(len(self.dataset.shards[shard]) for shard in self.shards)
+        if self.drop_last:
+            return records // self.batch_size
+        return (records + self.batch_size - 1) // self.batch_size
+
+    def set_epoch(self, epoch: int):
+        """
+        Set the epoch the next iteration shuffles for (it is otherwise
+        increased after every complete iteration)
+        """
+        self.epoch = epoch
+
+    def _records(self, rng: random.Random) -> Iterator[Dict[str, Any]]:
+        shards = list(self.shards)
+        if self.shuffle:
+            rng.shuffle(shards)
+        records = (record for shard in shards for record in self.dataset.iter_shard(shard))
+        if not self.shuffle:
+            yield from records
+            return
+        buffer = []
+        for record in records:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(record)
+                continue
+            index = rng.randrange(len(buffer))
+            yield buffer[index]
+            buffer[index] = record
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _produce(self, batches: queue.Queue, stop: threading.Event, rng: random.Random):
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        emotions, fields = self.dataset.emotions, self.dataset.image_fields
+        try:
+            with ThreadPoolExecutor(self.workers, thread_name_prefix="dataset-decode") as pool:
+                pending = deque()
+                samples = []
+                records = self._records(rng)
+                exhausted = False
+                while not stop.is_set():
+                    # Keep a batch worth of records in decoding ahead of the batch being filled
+                    while not exhausted and len(pending) < self.batch_size + self.workers:
+                        record = next(records, None)
+                        if record is None:
+                            exhausted = True
+                        else:
+                            pending.append(pool.submit(decode_record, record, emotions, self.image_size))
+                    if not pending:
+                        break
+                    samples.append(pending.popleft().result())
+                    if len(samples) == self.batch_size:
+                        if not put(collate(samples, fields)):
+                            return
+                        samples = []
+                if samples and not self.drop_last and not stop.is_set():
+                    put(collate(samples, fields))
+                for future in pending:
+                    future.cancel()
+        except BaseException as e:
+            put(e)
+            return
+        put(None)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        rng = random.Random(self.seed * 1000003 + self.epoch)
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(batches, stop, rng),
+                                    name="dataset-loader", daemon=True)
+        producer.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield batch
+            self.epoch += 1
+        finally:
+            stop.set()
+            producer.join()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Longitudinal Emotion Trend Aggregation for AI-PsychDoodle-Analyzer
+Maintains per-user statistics incrementally so history queries never rescan sessions
+"""
+
+import os
+import json
+import math
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+
+class RunningStatistics:
+    """
+    Running mean and variance of a single value (Welford's algorithm)
+    """
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def update(self, value: float):
+        """
+        Add a new observation
+
+        Args:
+            value: The observed value
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self) -> float:
+        """
+        Sample variance of the observations seen so far
+        """
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, float]) -> "RunningStatistics":
+        return cls(data.get("count", 0), data.get("mean", 0.0), data.get("m2", 0.0))
+
+
+class EmotionTrendAggregator:
+    """
+    Incrementally maintained emotion statistics for one user and analysis type.
+
+    Every update is O(number of emotion categories); the state is bounded by
+    the number of categories and the number of retained daily rollups, so
+    reading the statistics never depends on how many sessions were saved.
+    """
+
+    def __init__(self, categories: List[str], ewma_alpha: float = 0.3,
+                 max_daily_rollups: int = 30):
+        """
+        Initialize the aggregator
+
+        Args:
+            categories: Emotion categories tracked by this aggregator
+            ewma_alpha: Smoothing factor of the exponentially weighted moving average
+            max_daily_rollups: Number of most recent days kept in the daily rollups
+        """
+        self.categories = list(categories)
+        self.ewma_alpha = ewma_alpha
+        self.max_daily_rollups = max_daily_rollups
+
+        self.count = 0
+        self.first_seen = None
+        self.last_seen = None
+        self.running = {category: RunningStatistics() for category in self.categories}
+        self.ewma = {}
+        # date (YYYY-MM-DD) -> {"count": n, "sums": {category: total}}
+        self.daily = {}
+
+    def update(self, emotional_state: Dict[str, float], timestamp: float = None):
+        """
+        Fold one analysis result into the aggregates
+
+        Args:
+            emotional_state: Dictionary mapping emotional states to scores (0.0-1.0)
+            timestamp: Unix timestamp of the analysis (defaults to now)
+        """
+        timestamp = timestamp if timestamp is not None else time.time()
+        # The moving average follows the sessions in time order: a session
+        # older than the latest one (e.g. back-filled) does not move it
+        in_order = self.last_seen is None or timestamp >= self.last_seen
+
+        self.count += 1
+        self.first_seen = timestamp if self.first_seen is None else min(self.first_seen, timestamp)
+        self.last_seen = timestamp if self.last_seen is None else max(self.last_seen, timestamp)
+
+        day = datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%d")
+        rollup = self.daily.setdefault(day, {"count": 0, "sums": {}})
+        rollup["count"] += 1
+
+        for category in self.categories:
+            if category not in emotional_state:
+                continue
+            score = float(emotional_state[category])
+
+            self.running[category].update(score)
+
+            previous = self.ewma.get(category)
+            if previous is None:
+                self.ewma[category] = score
+            elif in_order:
+                self.ewma[category] = self.ewma_alpha * score + (1 - self.ewma_alpha) * previous
+
+            rollup["sums"][category] = rollup["sums"].get(category, 0.0) + score
+
+        # Drop the oldest days once the rollup window is exceeded
+        if len(self.daily) > self.max_daily_rollups:
+            for stale_day in sorted(self.daily)[:len(self.daily) - self.max_daily_rollups]:
+                del self.daily[stale_day]
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Get the statistics in the form returned by the history endpoint
+
+        Returns:
+            Dictionary with per-emotion statistics, dominant emotion and daily rollups
+        """
+        emotions = {}
+        for category in self.categories:
+            stats = self.running[category]
+            if stats.count == 0:
+                continue
+            emotions[category] = {
+                "mean": stats.mean,
+                "variance": stats.variance,
+                "std": math.sqrt(stats.variance),
+                "ewma": self.ewma.get(category, stats.mean)
+            }
+
+        dominant_emotion = None
+        if self.ewma:
+            dominant_emotion = max(self.ewma.items(), key=lambda x: x[1])[0]
+
+        daily = []
+        for day in sorted(self.daily):
+            rollup = self.daily[day]
+            daily.append({
+                "date": day,
+                "count": rollup["count"],
+                "mean": {k: v / rollup["count"] for k, v in rollup["sums"].items()}
+            })
+
+        return {
+            "count": self.count,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "dominant_emotion": dominant_emotion,
+            "emotions": emotions,
+            "daily": daily
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "categories": self.categories,
+            "ewma_alpha": self.ewma_alpha,
+            "max_daily_rollups": self.max_daily_rollups,
+            "count": self.count,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "running": {k: v.to_dict() for k, v in self.running.items()},
+            "ewma": self.ewma,
+            "daily": self.daily
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "EmotionTrendAggregator":
+        aggregator = cls(data["categories"], data.get("ewma_alpha", 0.3),
+                         data.get("max_daily_rollups", 30))
+        aggregator.count = data.get("count", 0)
+        aggregator.first_seen = data.get("first_seen")
+        aggregator.last_seen = data.get("last_seen")
+        for category, stats in data.get("running", {}).items():
+            aggregator.running[category] = RunningStatistics.from_dict(stats)
+        aggregator.ewma = data.get("ewma", {})
+        aggregator.daily = data.get("daily", {})
+        return aggregator
+
+
+class SessionHistoryStore:
+    """
+    SQLite-backed store for user sessions and their precomputed trend aggregates.
+
+    Sessions and aggregates live in one database file so that every gunicorn
+    worker sees the same history. Saving a session updates the user's
+    aggregate row in the same transaction, and reading statistics is a single
+    primary-key lookup regardless of how many sessions the user has.
+    """
+
+    def __init__(self, db_path: str, emotion_categories: Dict[str, List[str]],
+                 ewma_alpha: float = 0.3, max_daily_rollups: int = 30):
+        """
+        Initialize the session history store
+
+        Args:
+            db_path: Path to the SQLite database file
+            emotion_categories: Mapping of analysis type (e.g. "shape", "doodle")
+                to the emotion categories produced by that analysis
+            ewma_alpha: Smoothing factor for the EWMA trend
+            max_daily_rollups: Number of days kept in the daily rollups
+        """
+        self.db_path = db_path
+        self.emotion_categories = emotion_categories
+        self.ewma_alpha = ewma_alpha
+        self.max_daily_rollups = max_daily_rollups
+
+        self._local = threading.local()
+
+        db_dir = os.path.dirname(os.path.abspath(self.db_path))
+        os.makedirs(db_dir, exist_ok=True)
+
+        conn = self._connection()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL UNIQUE,
+                user_id TEXT NOT NULL,
+                analysis_type TEXT,
+                timestamp REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id, id);
+            CREATE TABLE IF NOT EXISTS user_aggregates (
+                user_id TEXT NOT NULL,
+                analysis_type TEXT NOT NULL,
+                state TEXT NOT NULL,
+                PRIMARY KEY (user_id, analysis_type)
+            );
+        """)
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Get the SQLite connection of the calling thread
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _infer_analysis_type(self, emotional_state: Dict[str, float]) -> Optional[str]:
+        """
+        Guess the analysis type from the emotion categories present in a result
+        """
+        keys = set(emotional_state)
+        for analysis_type, categories in self.emotion_categories.items():
+            if keys and keys.issubset(categories):
+                return analysis_type
+        return None
+
+    def save_session(self, user_id: str, session_data: Dict[str, Any],
+                     timestamp: float = None) -> Dict[str, Any]:
+        """
+        Save a session and update the user's trend aggregates
+
+        Args:
+            user_id: User identifier
+            session_data: Session data; an "emotional_state" entry is folded
+                into the aggregates of its "analysis_type"
+            timestamp: Unix timestamp of the session (defaults to now)
+
+        Returns:
+            Dictionary with the new session ID
+        """
+        timestamp = timestamp if timestamp is not None else time.time()
+        session_id = str(uuid.uuid4())
+
+        emotional_state = session_data.get("emotional_state") or {}
+        analysis_type = session_data.get("analysis_type") or self._infer_analysis_type(emotional_state)
+
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO sessions (session_id, user_id, analysis_type, timestamp, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (session_id, user_id, analysis_type, timestamp, json.dumps(session_data))
+            )
+
+            if emotional_state and analysis_type in self.emotion_categories:
+                row = conn.execute(
+                    "SELECT state FROM user_aggregates WHERE user_id = ? AND analysis_type = ?",
+                    (user_id, analysis_type)
+                ).fetchone()
+
+                if row:
+                    aggregator = EmotionTrendAggregator.from_dict(json.loads(row[0]))
+                else:
+                    aggregator = EmotionTrendAggregator(
+                        self.emotion_categories[analysis_type],
+                        self.ewma_alpha,
+                        self.max_daily_rollups
+                    )
+                aggregator.update(emotional_state, timestamp)
+
+                conn.execute(
+                    "INSERT OR REPLACE INTO user_aggregates (user_id, analysis_type, state) "
+                    "VALUES (?, ?, ?)",
+                    (user_id, analysis_type, json.dumps(aggregator.to_dict()))
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        return {"success": True, "session_id": session_id, "timestamp": timestamp}
+
+    def get_statistics(self, user_id: str) -> Dict[str, Any]:
+        """
+        Get the precomputed trend statistics of a user
+
+        Args:
+            user_id: User identifier
+
+        Returns:
+            Dictionary mapping analysis type to its statistics
+        """
+        rows = self._connection().execute(
+            "SELECT analysis_type, state FROM user_aggregates WHERE user_id = ?",
+            (user_id,)
+        ).fetchall()
+
+        statistics = {}
+        for analysis_type, state in rows:
+            statistics[analysis_type] = EmotionTrendAggregator.from_dict(json.loads(state)).summary()
+        return statistics
+
+    def get_history(self, user_id: str, limit: int = 10, offset: int = 0) -> Dict[str, Any]:
+        """
+        Get a page of a user's sessions together with their statistics
+
+        Args:
+            user_id: User identifier
+            limit: Maximum number of sessions to return
+            offset: Offset for pagination (newest sessions first)
+
+        Returns:
+            Dictionary with user sessions and statistics
+        """
+        conn = self._connection()
+        rows = conn.execute(
+            "SELECT session_id, analysis_type, timestamp, data FROM sessions "
+            "WHERE user_id = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+            (user_id, limit, offset)
+        ).fetchall()
+
+        sessions = [
+            {
+                "session_id": session_id,
+                "analysis_type": analysis_type,
+                "timestamp": timestamp,
+                "session_data": json.loads(data)
+            }
+            for session_id, analysis_type, timestamp, data in rows
+        ]
+
+        statistics = self.get_statistics(user_id)
+
+        return {
+            "user_id": user_id,
+            "sessions": sessions,
+            "limit": limit,
+            "offset": offset,
+            "statistics": statistics
+        }
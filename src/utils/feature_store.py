@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Feature Store for AI-PsychDoodle-Analyzer
+Columnar, memory-mapped storage of extracted drawing features
+
+Features are kept in one table per feature extractor and version (e.g.
+"drawing" / "v1-224px"), with a row per input keyed by a content hash of
+the input and one .npy file per feature, so a whole corpus can be
+re-scored from memory-mapped arrays without decoding a single image.
+
+Layout:
+    <root>/<extractor>/<version>/
+        columns.json        feature names (nested names joined with ".")
+        seg-<id>/keys.npy   row keys (32 hex digits); segment ids sort
+                            by creation time
+        seg-<id>/<feature>.npy
+                            float64 values of one feature
+
+Rows are added as immutable segments, written to a temporary directory and
+renamed into place, so several processes can add rows to a table at once.
+compact() merges the segments and drops duplicate keys.
+
+Usage:
+    python feature_store.py inspect data/features
+    python feature_store.py compact data/features drawing v1-224px
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import argparse
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Row keys: hex digest of 16 bytes
+KEY_DTYPE = np.dtype("S32")
+
+SEGMENT_PREFIX = "seg-"
+
+
+def content_key(*parts: Any) -> str:
+    """
+    Row key of an input, from everything the features depend on
+
+    Args:
+        parts: Encoded image bytes and other inputs (e.g. the shape type);
+            non-bytes parts are hashed by their repr
+
+    Returns:
+        32 hex digits
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        data = part if isinstance(part, (bytes, bytearray, memoryview)) else repr(part).encode("utf-8")
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def flatten_features(features: Dict[str, Any], prefix: str = "") -> "OrderedDict[str, float]":
+    """
+    Flatten nested feature dictionaries into named scalars
+
+    Example:
+        {"complexity": 0.1, "composition": {"top": {"brightness": 0.5}}}
+        -> {"complexity": 0.1, "composition.top.brightness": 0.5}
+    """
+    flat = OrderedDict()
+    for name, value in features.items():
+        if isinstance(value, dict):
+            flat.update(flatten_features(value, f"{prefix}{name}."))
+        else:
+            flat[f"{prefix}{name}"] = float(value)
+    return flat
+
+
+def unflatten_features(columns: Iterable[str], values: Iterable[float]) -> Dict[str, Any]:
+    """
+    Rebuild the nested feature dictionary of one row (inverse of flatten_features)
+    """
+    features: Dict[str, Any] = {}
+    for column, value in zip(columns, values):
+        *parents, name = column.split(".")
+        node = features
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[name] = float(value)
+    return features
+
+
+class FeatureTable:
+    """
+    Features of one extractor version.
+
+    Lookups use a snapshot of the segments present when the table was
+    first read; call refresh() to see rows added since.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open a table (created on the first put)
+
+        Args:
+            path: Table directory
+        """
+        self.path = path
+        self.columns: Optional[List[str]] = None
+        columns_path = os.path.join(path, "columns.json")
+        if os.path.exists(columns_path):
+            with open(columns_path) as f:
+                self.columns = json.load(f)
+        self._segments: Optional[List[str]] = None
+        self._keys = None
+        self._sorted_keys = None
+        self._order = None
+        self._values: Dict[str, np.ndarray] = {}
+
+    def segments(self) -> List[str]:
+        """
+        Segment directories, oldest first
+        """
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(os.path.join(self.path, name) for name in os.listdir(self.path)
+                      if name.startswith(SEGMENT_PREFIX))
+
+    def refresh(self):
+        """
+        Drop the snapshot, so the next lookup sees all current segments
+        """
+        self._segments = None
+        self._values = {}
+
+    def _load(self):
+        if self._segments is not None:
+            return
+        self._segments = self.segments()
+        keys = [np.load(os.path.join(segment, "keys.npy"), mmap_mode="r") for segment in self._segments]
+        self._keys = np.concatenate(keys) if keys else np.empty(0, dtype=KEY_DTYPE)
+        # Stable sort: among duplicate keys the newest row comes last
+        self._order = np.argsort(self._keys, kind="stable")
+        self._sorted_keys = self._keys[self._order]
+
+    def __len__(self) -> int:
+        self._load()
+        return len(self._keys)
+
+    def keys(self) -> np.ndarray:
+        """
+        Keys of all rows, in row order
+        """
+        self._load()
+        return self._keys
+
+    def lookup(self, keys: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rows of a batch of keys (the newest row for duplicate keys)
+
+        Returns:
+            Row indices and a mask of the keys that were found (the indices
+            of missing keys are meaningless)
+        """
+        self._load()
+        keys = np.asarray(list(keys), dtype=KEY_DTYPE)
+        if len(self._sorted_keys) == 0:
+            return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=bool)
+        positions = np.searchsorted(self._sorted_keys, keys, side="right") - 1
+        found = (positions >= 0) & (self._sorted_keys[np.maximum(positions, 0)] == keys)
+        return self._order[np.maximum(positions, 0)], found
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        All values of one feature, in row order (memory-mapped for a
+        single segment, e.g. after compact())
+        """
+        self._load()
+        if name not in (self.columns or []):
+            raise KeyError(f"Unknown feature {name}")
+        if name not in self._values:
+            arrays = [np.load(os.path.join(segment, f"{name}.npy"), mmap_mode="r") for segment in self._segments]
+            if len(arrays) == 1:
+                self._values[name] = arrays[0]
+            else:
+                self._values[name] = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.float64)
+        return self._values[name]
+
+    def matrix(self, columns: Optional[List[str]] = None, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Feature matrix of shape (rows, columns)
+
+        Args:
+            columns: Features to include (default: all, in table order)
+            rows: Row indices to include (default: all)
+        """
+        columns = columns or self.columns or []
+        data = np.empty((len(self) if rows is None else len(rows), len(columns)), dtype=np.float64)
+        for index, name in enumerate(columns):
+            values = self.column(name)
+            data[:, index] = values if rows is None else values[rows]
+        return data
+
+    def get_many(self, keys: Iterable[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Nested feature dictionaries of a batch of keys (None where missing)
+        """
+        keys = list(keys)
+        rows, found = self.lookup(keys)
+        if not found.any():
+            return [None] * len(keys)
+        values = self.matrix(rows=rows[found])
+        features = iter(unflatten_features(self.columns, row) for row in values)
+        return [next(features) if hit else None for hit in found]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.get_many([key])[0]
+
+    def put(self, keys: List[str], features: List[Dict[str, Any]]):
+        """
+        Add rows as a new segment
+
+        Args:
+            keys: Row keys (see content_key)
+            features: Feature dictionaries as returned by the extractor
+
+        Raises:
+            ValueError: If the features do not match the table's columns
+        """
+        if not keys:
+            return
+        rows = [flatten_features(row) for row in features]
+        columns = list(rows[0].keys())
+        if self.columns is None:
+            os.makedirs(self.path, exist_ok=True)
+            _write_json(os.path.join(self.path, "columns.json"), columns)
+            self.columns = columns
+        if any(list(row.keys()) != self.columns for row in rows):
+            raise ValueError(f"Features do not match the columns of {self.path}")
+
+        values = np.array([list(row.values()) for row in rows], dtype=np.float64)
+        self._write_segment(np.asarray(keys, dtype=KEY_DTYPE), values)
+
+    def _write_segment(self, keys: np.ndarray, values: np.ndarray, name: Optional[str] = None):
+        # Segment names sort by creation time
+        name = name or f"{SEGMENT_PREFIX}{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        temp_path = os.path.join(self.path, f".tmp-{name}")
+        os.makedirs(temp_path)
+        try:
+            np.save(os.path.join(temp_path, "keys.npy"), keys)
+            for index, column in enumerate(self.columns):
+                np.save(os.path.join(temp_path, f"{column}.npy"), np.ascontiguousarray(values[:, index]))
+            os.rename(temp_path, os.path.join(self.path, name))
+        except Exception:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+
+    def compact(self) -> int:
+        """
+        Merge all segments into one, keeping the newest row of each key
+
+        Returns:
+            Number of rows after compaction
+        """
+        self.refresh()
+        self._load()
+        old_segments = list(self._segments)
+        if len(old_segments) <= 1 and len(np.unique(self._keys)) == len(self._keys):
+            return len(self._keys)
+        # Last row of each run of equal keys in the sorted order
+        last = np.ones(len(self._sorted_keys), dtype=bool)
+        last[:-1] = self._sorted_keys[:-1] != self._sorted_keys[1:]
+        rows = np.sort(self._order[last])
+        # Named after the newest merged segment, so it sorts right after it and
+        # before segments added meanwhile, whose rows must stay the newest
+        name = f"{os.path.basename(old_segments[-1])}-{uuid.uuid4().hex[:8]}"
+        self._write_segment(self._keys[rows], self.matrix(rows=rows), name=name)
+        for segment in old_segments:
+            shutil.rmtree(segment, ignore_errors=True)
+        self.refresh()
+        return len(rows)
+
+
+class FeatureStore:
+    """
+    Feature tables under one root directory
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._tables: Dict[Tuple[str, str], FeatureTable] = {}
+
+    def table(self, extractor: str, version: str) -> FeatureTable:
+        """
+        Table of one feature extractor version
+
+        Args:
+            extractor: Extractor name (e.g. "shape", "drawing")
+            version: Extractor version, including any setting the features
+                depend on (e.g. "v1-224px")
+        """
+        if (extractor, version) not in self._tables:
+            self._tables[(extractor, version)] = FeatureTable(os.path.join(self.root, extractor, version))
+        return self._tables[(extractor, version)]
+
+    def tables(self) -> List[Tuple[str, str]]:
+        """
+        (extractor, version) of every table in the store
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted((extractor, version)
+                      for extractor in os.listdir(self.root)
+                      if os.path.isdir(os.path.join(self.root, extractor))
+                      for version in os.listdir(os.path.join(self.root, extractor))
+                      if os.path.isdir(os.path.join(self.root, extractor, version)))
+
+
+def _write_json(path: str, content: Any):
+    temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(content, f)
+    os.replace(temp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and compact a feature store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    inspect_parser = subparsers.add_parser("inspect", help="List the tables of a store")
+    inspect_parser.add_argument("root")
+
+    compact_parser = subparsers.add_parser("compact", help="Merge the segments of a table")
+    compact_parser.add_argument("root")
+    compact_parser.add_argument("extractor")
+    compact_parser.add_argument("version")
+
+    args = parser.parse_args()
+    store = FeatureStore(args.root)
+    if args.command == "inspect":
+        for extractor, version in store.tables():
+            table = store.table(extractor, version)
+            print(f"{extractor}/{version}: {len(table)} rows, {len(table.segments())} segments, "
+                  f"{len(table.columns or [])} features")
+    else:
+        rows = store.table(args.extractor, args.version).compact()
+        print(f"Compacted {args.extractor}/{args.version}: {rows} rows")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
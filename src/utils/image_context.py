@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Image Context for AI-PsychDoodle-Analyzer
+Per-request cache of derived image representations shared by the analyzers and utilities
+"""
+
+import numpy as np
+import cv2
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+from utils.buffer_pool import BufferPool
+
+
+class ImageContext:
+    """
+    Wraps one image and lazily computes and memoizes the representations
+    derived from it (grayscale, binary, resized, RGB, HSV, edges, contours),
+    so each transformation runs at most once per request.
+
+    Derived arrays are shared between callers and are returned read-only.
+    A context is meant to live for a single request and is not thread-safe.
+    When given a BufferPool, derived arrays are written into pooled buffers
+    that release() returns once the request is done with them.
+    """
+
+    def __init__(self, image: np.ndarray, pool: Optional[BufferPool] = None):
+        """
+        Initialize the context
+
+        Args:
+            image: Source image (BGR or single-channel grayscale)
+            pool: Buffer pool for derived arrays (optional)
+        """
+        self.image = image
+        self.pool = pool
+        self._cache: Dict[Hashable, Any] = {}
+        self._buffers: List[np.ndarray] = []
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def of(cls, image: Union[np.ndarray, "ImageContext"]) -> "ImageContext":
+        """
+        Return the image's context, wrapping plain arrays in a new one
+        """
+        return image if isinstance(image, ImageContext) else cls(image)
+
+    def __enter__(self) -> "ImageContext":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.image.shape
+
+    @property
+    def is_color(self) -> bool:
+        return len(self.image.shape) == 3 and self.image.shape[2] > 1
+
+    def _memoize(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        if key in self._cache:
+            self.hits += 1
+            return self._cache[key]
+        self.misses += 1
+        value = compute()
+        if isinstance(value, np.ndarray) and value is not self.image:
+            value.flags.writeable = False
+        self._cache[key] = value
+        return value
+
+    def _buffer(self, shape: Tuple[int, ...]) -> Optional[np.ndarray]:
+        """
+        Pooled uint8 output buffer for a derived array (None without a pool)
+        """
+        if self.pool is None:
+            return None
+        buffer = self.pool.acquire(shape, np.uint8)
+        self._buffers.append(buffer)
+        return buffer
+
+    def _color_shape(self) -> Tuple[int, int, int]:
+        return (self.image.shape[0], self.image.shape[1], 3)
+
+    def bgr(self) -> np.ndarray:
+        """
+        BGR image (grayscale sources are expanded to three channels)
+        """
+        if self.is_color:
+            return self.image
+        return self._memoize("bgr", lambda: cv2.cvtColor(
+            self.image, cv2.COLOR_GRAY2BGR, dst=self._buffer(self._color_shape())))
+
+    def gray(self) -> np.ndarray:
+        """
+        Grayscale image
+        """
+        if not self.is_color:
+            return self.image
+        return self._memoize("gray", lambda: cv2.cvtColor(
+            self.image, cv2.COLOR_BGR2GRAY, dst=self._buffer(self.image.shape[:2])))
+
+    def rgb(self) -> np.ndarray:
+        """
+        RGB image
+        """
+        return self._memoize("rgb", lambda: cv2.cvtColor(
+            self.bgr(), cv2.COLOR_BGR2RGB, dst=self._buffer(self._color_shape())))
+
+    def hsv(self) -> np.ndarray:
+        """
+        HSV image (OpenCV ranges: H 0-180, S and V 0-255)
+        """
+        return self._memoize("hsv", lambda: cv2.cvtColor(
+            self.bgr(), cv2.COLOR_BGR2HSV, dst=self._buffer(self._color_shape())))
+
+    def binary(self, threshold: int = 127) -> np.ndarray:
+        """
+        Binary image (0/255) of the grayscale image at a threshold
+
+        Args:
+            threshold: Pixels above this value become 255
+        """
+        def compute():
+            gray = self.gray()
+            _, binary = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY,
+                                      dst=self._buffer(gray.shape))
+            return binary
+        return self._memoize(("binary", threshold), compute)
+
+    def edges(self, low: int = 100, high: int = 200) -> np.ndarray:
+        """
+        Canny edge map of the grayscale image
+
+        Args:
+            low: Lower hysteresis threshold
+            high: Upper hysteresis threshold
+        """
+        def compute():
+            gray = self.gray()
+            return cv2.Canny(gray, low, high, edges=self._buffer(gray.shape))
+        return self._memoize(("edges", low, high), compute)
+
+    def contours(self, threshold: int = 127, mode: int = cv2.RETR_EXTERNAL,
+                 method: int = cv2.CHAIN_APPROX_SIMPLE) -> tuple:
+        """
+        Contours of the binary image
+
+        Args:
+            threshold: Threshold used for the binary image
+            mode: OpenCV contour retrieval mode
+            method: OpenCV contour approximation method
+        """
+        def compute():
+            contours, _ = cv2.findContours(self.binary(threshold), mode, method)
+            return tuple(contours)
+        return self._memoize(("contours", threshold, mode, method), compute)
+
+    def resized(self, size: Tuple[int, int],
+                interpolation: int = cv2.INTER_LINEAR) -> "ImageContext":
+        """
+        Context for the image resized (stretched) to a size
+
+        The child context has its own cache, so e.g. resized((224, 224)).hsv()
+        is also computed only once.
+
+        Args:
+            size: Target size as (width, height)
+            interpolation: OpenCV interpolation flag
+        """
+        size = (int(size[0]), int(size[1]))
+        if (self.image.shape[1], self.image.shape[0]) == size:
+            return self
+
+        def compute():
+            shape = (size[1], size[0]) + tuple(self.image.shape[2:])
+            resized = cv2.resize(self.image, size, dst=self._buffer(shape), interpolation=interpolation)
+            resized.flags.writeable = False
+            return ImageContext(resized, self.pool)
+        return self._memoize(("resized", size, interpolation), compute)
+
+    def release(self):
+        """
+        Drop the cached representations and return pooled buffers to the pool
+        """
+        for value in self._cache.values():
+            if isinstance(value, ImageContext):
+                value.release()
+        self._cache.clear()
+        if self.pool is not None and self._buffers:
+            self.pool.release(*self._buffers)
+        self._buffers = []
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Cache hits and misses, including those of resized child contexts
+        """
+        hits, misses = self.hits, self.misses
+        for value in self._cache.values():
+            if isinstance(value, ImageContext):
+                child = value.stats()
+                hits += child["hits"]
+                misses += child["misses"]
+        return {"hits": hits, "misses": misses}
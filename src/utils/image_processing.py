@@ -8,25 +8,61 @@ import io
 import numpy as np
 import cv2
 from PIL import Image
-from typing import Union, Tuple
+from typing import Union, Tuple, List, Optional
 
-def decode_base64_image(base64_str: str) -> np.ndarray:
+from utils.image_context import ImageContext
+from utils.buffer_pool import get_buffer_pool
+
+# Output formats supported by encode_image and their file extensions
+IMAGE_FORMATS = {
+    'jpeg': '.jpg',
+    'webp': '.webp',
+    'avif': '.avif',
+    'png': '.png'
+}
+
+# Encoder settings per quality tier
+# (JPEG chroma subsampling: '420' halves color resolution, '444' keeps it)
+QUALITY_TIERS = {
+    'low': {'jpeg': 60, 'webp': 50, 'avif': 40, 'chroma_subsampling': '420'},
+    'medium': {'jpeg': 75, 'webp': 75, 'avif': 60, 'chroma_subsampling': '420'},
+    'high': {'jpeg': 90, 'webp': 90, 'avif': 80, 'chroma_subsampling': '444'}
+}
+
+# Zlib compression level used for PNG output (lossless, so not tiered)
+PNG_COMPRESSION = 3
+
+# Dominant color detection: bits kept per channel for the color histogram
+# (5 bits = 32x32x32 bins) and maximum number of pixels counted per image
+DOMINANT_COLOR_BITS = 5
+DOMINANT_COLOR_SAMPLES = 262144
+
+def decode_base64_bytes(base64_str: str) -> bytes:
     """
-    Decode a base64 string into a numpy image array
+    Decode a base64 string (optionally a data URI) into raw image bytes
     
     Args:
         base64_str: The base64 encoded image string
         
     Returns:
-        Numpy array containing the image
+        The encoded image file contents
     """
     # Strip the data URI prefix if present
     if base64_str.startswith('data:image'):
         base64_str = base64_str.split(',')[1]
     
-    # Decode base64 string
-    image_bytes = base64.b64decode(base64_str)
+    return base64.b64decode(base64_str)
+
+def decode_image_bytes(image_bytes: bytes) -> np.ndarray:
+    """
+    Decode encoded image file contents into a numpy image array
     
+    Args:
+        image_bytes: The encoded image (PNG, JPEG, ...)
+        
+    Returns:
+        Numpy array containing the image
+    """
     # Convert to numpy array
     try:
         # Try using PIL first
@@ -44,32 +80,136 @@ def decode_base64_image(base64_str: str) -> np.ndarray:
         image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         return image
 
-def encode_base64_image(image: np.ndarray, format: str = 'jpeg') -> str:
+def decode_base64_image(base64_str: str) -> np.ndarray:
+    """
+    Decode a base64 string into a numpy image array
+    
+    Args:
+        base64_str: The base64 encoded image string
+        
+    Returns:
+        Numpy array containing the image
+    """
+    return decode_image_bytes(decode_base64_bytes(base64_str))
+
+def _normalize_format(format: str) -> str:
+    format = format.lower()
+    if format.startswith('image/'):
+        format = format[len('image/'):]
+    return 'jpeg' if format == 'jpg' else format
+
+def supported_image_formats() -> List[str]:
+    """
+    List the output formats the installed OpenCV build can encode
+    
+    Returns:
+        Format names (e.g. ['jpeg', 'webp', 'png'])
+    """
+    formats = []
+    for format, extension in IMAGE_FORMATS.items():
+        try:
+            if cv2.haveImageWriter(extension):
+                formats.append(format)
+        except (AttributeError, cv2.error):
+            if format in ('jpeg', 'png'):
+                formats.append(format)
+    return formats
+
+def negotiate_image_format(accept: Optional[str], default: str = 'jpeg') -> str:
+    """
+    Choose an output format from an Accept-style list of image types
+    
+    Args:
+        accept: e.g. "image/avif,image/webp;q=0.9,image/jpeg;q=0.8" (optional)
+        default: Format used when nothing acceptable is supported
+        
+    Returns:
+        The supported format with the highest q-value (earliest listed on ties)
+    """
+    if not accept:
+        return default
+    
+    supported = supported_image_formats()
+    best_format = None
+    best_q = 0.0
+    for entry in accept.split(','):
+        parts = [p.strip() for p in entry.split(';')]
+        media_type = parts[0].lower()
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        
+        if media_type in ('*/*', 'image/*'):
+            candidate = default
+        else:
+            candidate = _normalize_format(media_type)
+        
+        if candidate in supported and q > best_q:
+            best_format = candidate
+            best_q = q
+    
+    return best_format or default
+
+def encode_image(image: np.ndarray, format: str = 'jpeg', quality: str = 'medium') -> bytes:
+    """
+    Encode a numpy image array into image file contents
+    
+    The image is encoded directly from BGR with cv2.imencode, without color
+    conversion or intermediate PIL/BytesIO copies.
+    
+    Args:
+        image: The image as a numpy array (BGR or grayscale)
+        format: The image format: 'jpeg', 'webp', 'avif' or 'png' (default: 'jpeg')
+        quality: Quality tier: 'low', 'medium' or 'high' (default: 'medium')
+        
+    Returns:
+        The encoded image bytes
+    """
+    format = _normalize_format(format)
+    if format not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format: {format}")
+    tier = QUALITY_TIERS.get(quality, QUALITY_TIERS['medium'])
+    
+    params = []
+    if format == 'jpeg':
+        params += [cv2.IMWRITE_JPEG_QUALITY, tier['jpeg']]
+        sampling_flag = getattr(cv2, f"IMWRITE_JPEG_SAMPLING_FACTOR_{tier['chroma_subsampling']}", None)
+        if sampling_flag is not None:
+            params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, sampling_flag]
+    elif format == 'webp':
+        params += [cv2.IMWRITE_WEBP_QUALITY, tier['webp']]
+    elif format == 'avif':
+        if hasattr(cv2, 'IMWRITE_AVIF_QUALITY'):
+            params += [cv2.IMWRITE_AVIF_QUALITY, tier['avif']]
+    elif format == 'png':
+        params += [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    
+    success, buffer = cv2.imencode(IMAGE_FORMATS[format], image, params)
+    if not success:
+        raise ValueError(f"Could not encode image as {format}")
+    
+    return buffer.tobytes()
+
+def encode_base64_image(image: np.ndarray, format: str = 'jpeg', quality: str = 'medium') -> str:
     """
     Encode a numpy image array as a base64 string
     
     Args:
         image: The image as a numpy array
         format: The image format (default: 'jpeg')
+        quality: Quality tier: 'low', 'medium' or 'high' (default: 'medium')
         
     Returns:
         Base64 encoded image string
     """
-    # Convert BGR to RGB if needed
-    if len(image.shape) == 3 and image.shape[2] == 3:
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    else:
-        image_rgb = image
-    
-    # Convert to PIL Image
-    pil_image = Image.fromarray(image_rgb)
-    
-    # Save to bytes buffer
-    buffer = io.BytesIO()
-    pil_image.save(buffer, format=format)
+    format = _normalize_format(format)
     
     # Encode as base64
-    img_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    img_str = base64.b64encode(encode_image(image, format, quality)).decode('utf-8')
     
     # Add data URI prefix
     mime_type = f"image/{format}"
@@ -77,16 +217,19 @@ def encode_base64_image(image: np.ndarray, format: str = 'jpeg') -> str:
     
     return data_uri
 
-def resize_image(image: np.ndarray, target_size: Tuple[int, int]) -> np.ndarray:
+def resize_image(image: np.ndarray, target_size: Tuple[int, int],
+                 dst: Optional[np.ndarray] = None) -> np.ndarray:
     """
     Resize an image to the target size while preserving aspect ratio
     
     Args:
         image: The image to resize
         target_size: The target size as (width, height)
+        dst: Output canvas of shape (height, width, 3) to write into (optional,
+            e.g. a buffer borrowed from a BufferPool)
         
     Returns:
-        Resized image
+        Resized image (dst if given)
     """
     h, w = image.shape[:2]
     target_w, target_h = target_size
@@ -105,18 +248,21 @@ def resize_image(image: np.ndarray, target_size: Tuple[int, int]) -> np.ndarray:
         new_h = target_h
         new_w = int(target_h * aspect_original)
     
-    # Resize the image
-    resized = cv2.resize(image, (new_w, new_h))
-    
     # Create a black canvas of the target size
-    canvas = np.zeros((target_h, target_w, 3), dtype=np.uint8)
+    if dst is None:
+        canvas = np.zeros((target_h, target_w, 3), dtype=np.uint8)
+    else:
+        canvas = dst
+        canvas.fill(0)
     
     # Calculate position to paste the resized image
     x_offset = (target_w - new_w) // 2
     y_offset = (target_h - new_h) // 2
     
-    # Paste the resized image
-    canvas[y_offset:y_offset+new_h, x_offset:x_offset+new_w] = resized
+    # Resize into a pooled temporary and paste it into the canvas
+    with get_buffer_pool().borrow((new_h, new_w) + image.shape[2:], image.dtype) as resized:
+        cv2.resize(image, (new_w, new_h), dst=resized)
+        canvas[y_offset:y_offset+new_h, x_offset:x_offset+new_w] = resized
     
     return canvas
 
@@ -138,17 +284,20 @@ def normalize_image(image: np.ndarray) -> np.ndarray:
     
     return normalized
 
-def apply_threshold(image: np.ndarray, threshold: int = 127) -> np.ndarray:
+def apply_threshold(image: Union[np.ndarray, ImageContext], threshold: int = 127) -> np.ndarray:
     """
     Apply thresholding to create a binary image
     
     Args:
-        image: The input image
+        image: The input image or its ImageContext
         threshold: Threshold value (default: 127)
         
     Returns:
         Binary image
     """
+    if isinstance(image, ImageContext):
+        return image.binary(threshold)
+    
     # Convert to grayscale if needed
     if len(image.shape) == 3:
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
@@ -160,16 +309,19 @@ def apply_threshold(image: np.ndarray, threshold: int = 127) -> np.ndarray:
     
     return binary
 
-def extract_contours(image: np.ndarray) -> list:
+def extract_contours(image: Union[np.ndarray, ImageContext]) -> list:
     """
     Extract contours from a binary image
     
     Args:
-        image: The input binary image
+        image: The input binary image, or an ImageContext (thresholded at 127)
         
     Returns:
         List of contours
     """
+    if isinstance(image, ImageContext):
+        return list(image.contours())
+    
     # Ensure image is binary
     if len(image.shape) == 3:
         binary = apply_threshold(image)
@@ -181,20 +333,21 @@ def extract_contours(image: np.ndarray) -> list:
     
     return contours
 
-def calculate_iou(image1: np.ndarray, image2: np.ndarray) -> float:
+def calculate_iou(image1: Union[np.ndarray, ImageContext],
+                  image2: Union[np.ndarray, ImageContext]) -> float:
     """
     Calculate Intersection over Union (IoU) between two binary images
     
     Args:
-        image1: First binary image
-        image2: Second binary image
+        image1: First binary image, or an ImageContext (thresholded at 127)
+        image2: Second binary image, or an ImageContext (thresholded at 127)
         
     Returns:
         IoU score (0.0 to 1.0)
     """
     # Ensure both images are binary
-    binary1 = apply_threshold(image1) if len(image1.shape) == 3 else image1
-    binary2 = apply_threshold(image2) if len(image2.shape) == 3 else image2
+    binary1 = _binary_view(image1)
+    binary2 = _binary_view(image2)
     
     # Calculate intersection and union
     intersection = cv2.bitwise_and(binary1, binary2)
@@ -212,19 +365,29 @@ def calculate_iou(image1: np.ndarray, image2: np.ndarray) -> float:
     
     return iou
 
-def calculate_color_histogram(image: np.ndarray, bins: int = 8) -> np.ndarray:
+def _binary_view(image: Union[np.ndarray, ImageContext]) -> np.ndarray:
+    """
+    Binary image used by calculate_iou (single-channel arrays are assumed binary)
+    """
+    if isinstance(image, ImageContext):
+        return image.binary()
+    return apply_threshold(image) if len(image.shape) == 3 else image
+
+def calculate_color_histogram(image: Union[np.ndarray, ImageContext], bins: int = 8) -> np.ndarray:
     """
     Calculate color histogram for an image
     
     Args:
-        image: The input image
+        image: The input image or its ImageContext
         bins: Number of bins per channel
         
     Returns:
         Flattened color histogram
     """
     # Convert to RGB if needed
-    if len(image.shape) == 3 and image.shape[2] == 3:
+    if isinstance(image, ImageContext):
+        rgb = image.rgb() if image.is_color else image.image
+    elif len(image.shape) == 3 and image.shape[2] == 3:
         rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
     else:
         rgb = image
@@ -240,17 +403,190 @@ def calculate_color_histogram(image: np.ndarray, bins: int = 8) -> np.ndarray:
     
     return hist
 
-def detect_dominant_colors(image: np.ndarray, k: int = 5) -> list:
+def detect_dominant_colors(image: Union[np.ndarray, ImageContext], k: int = 5, method: str = 'histogram',
+                           max_samples: int = DOMINANT_COLOR_SAMPLES, seed: int = 0) -> list:
     """
-    Detect dominant colors in an image using K-means clustering
+    Detect dominant colors in an image
+    
+    The default 'histogram' method counts pixels into a 32x32x32 color
+    histogram and runs weighted k-means on the occupied bins, so the
+    clustering cost no longer grows with the image size. 'median_cut' splits
+    the same histogram instead of clustering it, and 'kmeans' is the original
+    full-image cv2.kmeans.
     
     Args:
-        image: The input image
+        image: The input image or its ImageContext
         k: Number of dominant colors to detect
+        method: 'histogram', 'median_cut' or 'kmeans'
+        max_samples: Maximum number of pixels counted (larger images are sampled)
+        seed: Random seed for sampling and cluster initialization
         
     Returns:
         List of (color, percentage) tuples
     """
+    if isinstance(image, ImageContext):
+        image = image.bgr()
+    if method == 'kmeans':
+        return _dominant_colors_kmeans(image, k)
+    if method not in ('histogram', 'median_cut'):
+        raise ValueError(f"Unknown dominant color method: {method}")
+    
+    colors, weights = _color_histogram_bins(image, max_samples, seed)
+    if method == 'median_cut':
+        centers, counts = _median_cut(colors, weights, k)
+    else:
+        centers, counts = _weighted_kmeans(colors, weights, k, seed)
+    
+    total = counts.sum()
+    dominant_colors = [
+        (np.clip(np.round(center), 0, 255).astype(np.uint8).tolist(), float(count / total))
+        for center, count in zip(centers, counts) if count > 0
+    ]
+    dominant_colors.sort(key=lambda x: x[1], reverse=True)
+    
+    return dominant_colors
+
+def detect_dominant_colors_batch(images: List[np.ndarray], k: int = 5, method: str = 'histogram',
+                                 max_samples: int = DOMINANT_COLOR_SAMPLES, seed: int = 0,
+                                 max_workers: int = 1) -> List[list]:
+    """
+    Detect dominant colors in many images
+    
+    Args:
+        images: Input images
+        k: Number of dominant colors per image
+        method: 'histogram', 'median_cut' or 'kmeans'
+        max_samples: Maximum number of pixels counted per image
+        seed: Random seed (the same for every image, so results do not depend on batch order)
+        max_workers: Number of threads (OpenCV and numpy release the GIL for most of the work)
+        
+    Returns:
+        List with one list of (color, percentage) tuples per image
+    """
+    def detect(image):
+        return detect_dominant_colors(image, k, method, max_samples, seed)
+    
+    if max_workers <= 1 or len(images) <= 1:
+        return [detect(image) for image in images]
+    
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(detect, images))
+
+def _color_histogram_bins(image: np.ndarray, max_samples: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count pixels into a 3-D color histogram
+    
+    Returns:
+        Mean color of each occupied bin (float64, shape (n, 3)) and its pixel count
+    """
+    if len(image.shape) == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    pixels = image.reshape(-1, 3)
+    
+    if max_samples and len(pixels) > max_samples:
+        rng = np.random.RandomState(seed)
+        pixels = pixels[rng.randint(0, len(pixels), max_samples)]
+    
+    shift = 8 - DOMINANT_COLOR_BITS
+    quantized = (pixels >> shift).astype(np.int32)
+    bins = (quantized[:, 0] << (2 * DOMINANT_COLOR_BITS)) | (quantized[:, 1] << DOMINANT_COLOR_BITS) | quantized[:, 2]
+    
+    num_bins = 1 << (3 * DOMINANT_COLOR_BITS)
+    counts = np.bincount(bins, minlength=num_bins)
+    occupied = np.nonzero(counts)[0]
+    weights = counts[occupied].astype(np.float64)
+    
+    # Use the mean color of the pixels in each bin rather than the bin center
+    colors = np.empty((len(occupied), 3), dtype=np.float64)
+    for channel in range(3):
+        sums = np.bincount(bins, weights=pixels[:, channel], minlength=num_bins)
+        colors[:, channel] = sums[occupied] / weights
+    
+    return colors, weights
+
+def _weighted_kmeans(colors: np.ndarray, weights: np.ndarray, k: int, seed: int,
+                     max_iter: int = 30, tol: float = 0.2) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Weighted k-means with k-means++ initialization
+    
+    Returns:
+        Cluster centers and the total weight assigned to each
+    """
+    k = min(k, len(colors))
+    rng = np.random.RandomState(seed)
+    
+    # k-means++ seeding, with each candidate weighted by its pixel count
+    centers = np.empty((k, 3), dtype=np.float64)
+    centers[0] = colors[rng.choice(len(colors), p=weights / weights.sum())]
+    distances = ((colors - centers[0]) ** 2).sum(axis=1)
+    for i in range(1, k):
+        probabilities = distances * weights
+        if probabilities.sum() <= 0:
+            centers = centers[:i]
+            break
+        centers[i] = colors[rng.choice(len(colors), p=probabilities / probabilities.sum())]
+        distances = np.minimum(distances, ((colors - centers[i]) ** 2).sum(axis=1))
+    
+    for _ in range(max_iter):
+        labels = ((colors[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        totals = np.bincount(labels, weights=weights, minlength=len(centers))
+        new_centers = centers.copy()
+        for channel in range(3):
+            sums = np.bincount(labels, weights=weights * colors[:, channel], minlength=len(centers))
+            occupied = totals > 0
+            new_centers[occupied, channel] = sums[occupied] / totals[occupied]
+        shift = np.abs(new_centers - centers).max()
+        centers = new_centers
+        if shift < tol:
+            break
+    
+    labels = ((colors[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+    totals = np.bincount(labels, weights=weights, minlength=len(centers))
+    
+    return centers, totals
+
+def _median_cut(colors: np.ndarray, weights: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Weighted median cut: repeatedly split the box with the largest squared
+    error at the weighted median of its widest-spread channel
+    
+    Returns:
+        Box mean colors and the total weight of each box
+    """
+    boxes = [np.arange(len(colors))]
+    while len(boxes) < k:
+        # Pick the splittable box with the largest weighted squared error
+        best, best_score, best_channel = None, 0.0, 0
+        for i, box in enumerate(boxes):
+            if len(box) < 2:
+                continue
+            box_colors, box_weights = colors[box], weights[box]
+            mean = np.average(box_colors, axis=0, weights=box_weights)
+            errors = (box_weights[:, None] * (box_colors - mean) ** 2).sum(axis=0)
+            channel = int(errors.argmax())
+            score = errors.sum()
+            if score > best_score:
+                best, best_score, best_channel = i, score, channel
+        if best is None:
+            break
+        
+        box = boxes.pop(best)
+        box = box[np.argsort(colors[box, best_channel], kind='stable')]
+        cumulative = np.cumsum(weights[box])
+        split = int(np.searchsorted(cumulative, cumulative[-1] / 2.0)) + 1
+        split = min(max(split, 1), len(box) - 1)
+        boxes.extend([box[:split], box[split:]])
+    
+    totals = np.array([weights[box].sum() for box in boxes])
+    centers = np.array([np.average(colors[box], axis=0, weights=weights[box]) for box in boxes])
+    
+    return centers, totals
+
+def _dominant_colors_kmeans(image: np.ndarray, k: int) -> list:
+    """
+    Detect dominant colors with full-image cv2.kmeans (the original method)
+    """
     # Reshape image
     pixels = image.reshape(-1, 3)
     
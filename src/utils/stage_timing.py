@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Pipeline Stage Timing for AI-PsychDoodle-Analyzer
+Lightweight instrumentation points shared by the models, utilities and server
+"""
+
+import time
+from contextlib import contextmanager
+from typing import List
+
+# Registered stage observers (see add_stage_observer)
+_observers: List = []
+
+
+class StageObserver:
+    """
+    Base class for objects notified about pipeline stages.
+
+    Observers are called on the thread that runs the stage, so they can use
+    thread-local or context-local state to associate stages with requests.
+    """
+
+    def on_stage_start(self, name: str):
+        """
+        Called when a stage starts
+
+        Args:
+            name: Stage name (e.g. "decode", "segmentation")
+        """
+        pass
+
+    def on_stage_end(self, name: str, duration: float, error: bool = False):
+        """
+        Called when a stage finishes
+
+        Args:
+            name: Stage name
+            duration: Wall-clock duration of the stage (seconds)
+            error: Whether the stage raised an exception
+        """
+        pass
+
+
+def add_stage_observer(observer: StageObserver):
+    """
+    Register an observer for all pipeline stages
+
+    Args:
+        observer: The observer to register
+    """
+    if observer not in _observers:
+        _observers.append(observer)
+
+
+def remove_stage_observer(observer: StageObserver):
+    """
+    Unregister a previously registered observer
+    """
+    if observer in _observers:
+        _observers.remove(observer)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Mark a block of code as a named pipeline stage
+
+    Without registered observers this adds only a list check, so models can
+    be instrumented unconditionally.
+
+    Args:
+        name: Stage name
+    """
+    if not _observers:
+        yield
+        return
+
+    observers = list(_observers)
+    for observer in observers:
+        observer.on_stage_start(name)
+
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        for observer in reversed(observers):
+            observer.on_stage_end(name, duration, error)
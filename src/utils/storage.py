@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Blob Storage for AI-PsychDoodle-Analyzer
+Persists uploaded doodles and generated images in content-addressed storage
+"""
+
+import os
+import re
+import time
+import hashlib
+import tempfile
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Valid content-addressed keys: "<sha256 hex>.<extension>"
+KEY_PATTERN = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]+$")
+
+# File extensions and their MIME types
+CONTENT_TYPES = {
+    "jpeg": "image/jpeg",
+    "jpg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "avif": "image/avif",
+    "bin": "application/octet-stream"
+}
+
+
+def content_key(data: bytes, extension: str) -> str:
+    """
+    Compute the content-addressed key of a blob
+
+    Args:
+        data: Blob contents
+        extension: File extension (e.g. "jpeg", "png")
+
+    Returns:
+        Key of the form "<sha256>.<extension>"
+    """
+    return f"{hashlib.sha256(data).hexdigest()}.{extension}"
+
+
+def is_valid_key(key: str) -> bool:
+    """
+    Check that a key has the content-addressed form produced by content_key
+    """
+    return bool(KEY_PATTERN.match(key))
+
+
+def extension_for_bytes(data: bytes) -> str:
+    """
+    Guess the file extension of encoded image bytes from their signature
+    """
+    if data.startswith(b"\x89PNG"):
+        return "png"
+    if data.startswith(b"\xff\xd8"):
+        return "jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[4:12] in (b"ftypavif", b"ftypavis"):
+        return "avif"
+    return "bin"
+
+
+def content_type_for_key(key: str) -> str:
+    """
+    Get the MIME type of a blob from its key
+    """
+    extension = key.rsplit(".", 1)[-1].lower()
+    return CONTENT_TYPES.get(extension, CONTENT_TYPES["bin"])
+
+
+class BlobStorage:
+    """
+    Base class for blob storage backends.
+
+    Keys are content hashes, so writing the same bytes twice is a no-op and
+    blobs never change once written.
+    """
+
+    def put(self, key: str, data: bytes) -> str:
+        """
+        Store a blob under the given key
+
+        Args:
+            key: Content-addressed key (see content_key)
+            data: Blob contents
+
+        Returns:
+            The key
+        """
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Load a blob
+
+        Args:
+            key: Blob key
+
+        Returns:
+            Blob contents, or None if the blob does not exist
+        """
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        """
+        Check whether a blob exists
+        """
+        raise NotImplementedError
+
+    def prune(self, max_age: float) -> int:
+        """
+        Delete blobs that were written more than max_age seconds ago
+
+        Args:
+            max_age: Retention period in seconds
+
+        Returns:
+            Number of deleted blobs
+        """
+        raise NotImplementedError
+
+
+class LocalBlobStorage(BlobStorage):
+    """
+    Stores blobs on the local filesystem in a sharded directory layout:
+    <root>/ab/cd/abcd...<sha256>.<ext>
+    """
+
+    def __init__(self, root: str):
+        """
+        Initialize local storage
+
+        Args:
+            root: Root directory for stored blobs
+        """
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, key: str, data: bytes) -> str:
+        path = self._path(key)
+        if os.path.exists(path):
+            # Restart the retention period of re-uploaded blobs
+            os.utime(path)
+            return key
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first so readers never see partial blobs
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return key
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def prune(self, max_age: float) -> int:
+        cutoff = time.time() - max_age
+        deleted = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if is_valid_key(name) and os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        deleted += 1
+                except FileNotFoundError:
+                    # Pruned concurrently by another worker
+                    continue
+        return deleted
+
+
+class S3BlobStorage(BlobStorage):
+    """
+    Stores blobs in an S3 bucket. Any S3-compatible service (e.g. a local
+    MinIO instance) can be used by setting endpoint_url.
+    """
+
+    def __init__(self, bucket: str, region: str = None, endpoint_url: str = None,
+                 prefix: str = "blobs/"):
+        """
+        Initialize S3 storage
+
+        Args:
+            bucket: Bucket name
+            region: AWS region (optional)
+            endpoint_url: Endpoint of an S3-compatible service (optional)
+            prefix: Key prefix inside the bucket
+        """
+        import boto3
+        from botocore.exceptions import ClientError
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client_error = ClientError
+        self.client = boto3.client(
+            "s3",
+            region_name=region or None,
+            endpoint_url=endpoint_url or None
+        )
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}{key[:2]}/{key[2:4]}/{key}"
+
+    def put(self, key: str, data: bytes) -> str:
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._object_key(key),
+            Body=data,
+            ContentType=content_type_for_key(key)
+        )
+        return key
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except self._client_error:
+            return None
+        return response["Body"].read()
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except self._client_error:
+            return False
+
+    def prune(self, max_age: float) -> int:
+        cutoff = time.time() - max_age
+        deleted = 0
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix):
+            expired = [{"Key": item["Key"]} for item in page.get("Contents", [])
+                       if item["LastModified"].timestamp() < cutoff]
+            if expired:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": expired, "Quiet": True})
+                deleted += len(expired)
+        return deleted
+
+
+class AzureBlobStorage(BlobStorage):
+    """
+    Stores blobs in an Azure Blob Storage container
+    """
+
+    def __init__(self, container: str, connection_string: str, prefix: str = "blobs/"):
+        """
+        Initialize Azure storage
+
+        Args:
+            container: Container name
+            connection_string: Azure storage connection string
+            prefix: Blob name prefix inside the container
+        """
+        from azure.storage.blob import BlobServiceClient
+
+        self.prefix = prefix
+        service = BlobServiceClient.from_connection_string(connection_string)
+        self.container = service.get_container_client(container)
+
+    def _blob_name(self, key: str) -> str:
+        return f"{self.prefix}{key[:2]}/{key[2:4]}/{key}"
+
+    def put(self, key: str, data: bytes) -> str:
+        self.container.upload_blob(self._blob_name(key), data, overwrite=True)
+        return key
+
+    def get(self, key: str) -> Optional[bytes]:
+        blob = self.container.get_blob_client(self._blob_name(key))
+        if not blob.exists():
+            return None
+        return blob.download_blob().readall()
+
+    def exists(self, key: str) -> bool:
+        return self.container.get_blob_client(self._blob_name(key)).exists()
+
+    def prune(self, max_age: float) -> int:
+        cutoff = time.time() - max_age
+        deleted = 0
+        for blob in self.container.list_blobs(name_starts_with=self.prefix):
+            if blob.last_modified.timestamp() < cutoff:
+                self.container.delete_blob(blob.name)
+                deleted += 1
+        return deleted
+
+
+class AsyncBlobWriter:
+    """
+    Writes blobs to a storage backend on background threads.
+
+    The key is computed on the caller's thread and returned immediately, so
+    request handlers can hand out references without waiting for the write.
+    Blobs that are still being written are served from memory by get(), and
+    at most max_pending of them are held: beyond that, blobs are not stored,
+    so a slow backend cannot exhaust the memory.
+
+    Recently written keys are only remembered for recent_seconds: a blob
+    submitted again after that is written again, which restarts its
+    retention period (see prune) and restores it if another process pruned
+    it meanwhile. Keep recent_seconds well below the retention period.
+    """
+
+    def __init__(self, storage: BlobStorage, max_workers: int = 2,
+                 recent_keys: int = 4096, on_lookup: Callable[[bool], None] = None,
+                 max_pending: int = 256, recent_seconds: float = 3600):
+        """
+        Initialize the writer
+
+        Args:
+            storage: Storage backend to write to
+            max_workers: Number of background writer threads
+            recent_keys: Number of recently written keys remembered to skip
+                duplicate writes without touching the backend
+            on_lookup: Optional callback receiving True when a submitted blob
+                was already pending or recently written
+            max_pending: Maximum number of blobs waiting to be written
+            recent_seconds: How long written keys are remembered
+        """
+        self.storage = storage
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="blob-writer")
+        self._pending = {}
+        self._recent = OrderedDict()
+        self._recent_keys = recent_keys
+        self._on_lookup = on_lookup
+        self._max_pending = max_pending
+        self._recent_seconds = recent_seconds
+        self._lock = threading.Lock()
+
+    def submit(self, data: bytes, extension: str) -> Optional[str]:
+        """
+        Schedule a blob for writing
+
+        Args:
+            data: Blob contents
+            extension: File extension (e.g. "jpeg", "png")
+
+        Returns:
+            Content-addressed key of the blob, or None if max_pending blobs
+            are already waiting and the blob was not stored
+        """
+        key = content_key(data, extension)
+
+        with self._lock:
+            written = self._recent.get(key)
+            if written is not None and time.monotonic() - written > self._recent_seconds:
+                del self._recent[key]
+                written = None
+            known = key in self._pending or written is not None
+            full = not known and len(self._pending) >= self._max_pending
+            if not known and not full:
+                self._pending[key] = data
+
+        if full:
+            logger.warning(f"Not storing blob {key}: {self._max_pending} writes pending")
+            return None
+        if self._on_lookup is not None:
+            self._on_lookup(known)
+        if known:
+            return key
+
+        self._executor.submit(self._write, key, data)
+        return key
+
+    def _write(self, key: str, data: bytes):
+        stored = False
+        try:
+            self.storage.put(key, data)
+            stored = True
+        except Exception as e:
+            logger.error(f"Failed to store blob {key}: {e}")
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+                if stored:
+                    self._recent[key] = time.monotonic()
+                    self._recent.move_to_end(key)
+                    if len(self._recent) > self._recent_keys:
+                        self._recent.popitem(last=False)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Load a blob, including blobs whose write has not finished yet
+        """
+        with self._lock:
+            data = self._pending.get(key)
+        if data is not None:
+            return data
+        return self.storage.get(key)
+
+    def prune(self, max_age: float) -> int:
+        """
+        Delete stored blobs older than max_age seconds (see BlobStorage.prune)
+        """
+        deleted = self.storage.prune(max_age)
+        if deleted:
+            # Pruned blobs must be written again when they are resubmitted
+            with self._lock:
+                self._recent.clear()
+        return deleted
+
+    def close(self, wait: bool = True):
+        """
+        Stop the writer threads
+
+        Args:
+            wait: Wait for pending writes to finish
+        """
+        self._executor.shutdown(wait=wait)
+
+
+def create_storage(storage_config: Dict[str, Any]) -> BlobStorage:
+    """
+    Create a storage backend from the server's storage configuration
+
+    Args:
+        storage_config: The "storage" section of the server configuration
+
+    Returns:
+        Storage backend instance
+    """
+    storage_type = storage_config.get("type", "local")
+
+    if storage_type == "local":
+        return LocalBlobStorage(os.path.join(storage_config.get("path", "data/"), "blobs"))
+
+    if storage_type == "s3":
+        return S3BlobStorage(
+            bucket=storage_config["s3_bucket"],
+            region=storage_config.get("s3_region"),
+            endpoint_url=storage_config.get("s3_endpoint_url")
+        )
+
+    if storage_type == "azure":
+        return AzureBlobStorage(
+            container=storage_config["azure_container"],
+            connection_string=storage_config["azure_connection_string"]
+        )
+
+    raise ValueError(f"Unsupported storage type: {storage_type}")
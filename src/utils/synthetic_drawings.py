@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Synthetic Drawing Generators for AI-PsychDoodle-Analyzer
+Procedurally generates shape tracings and palette doodles for benchmarks and warm-up
+"""
+
+import base64
+import numpy as np
+import cv2
+from typing import Dict, Any, List, Tuple
+
+# Shapes the tracing generator can draw
+SHAPE_TYPES = ["triangle", "circle", "square"]
+
+
+def _shape_outline(shape_type: str, size: int, scale: float = 0.7,
+                   num_points: int = 360) -> np.ndarray:
+    """
+    Sample points along the outline of a shape centered in the canvas
+
+    Args:
+        shape_type: "triangle", "circle" or "square"
+        size: Canvas size in pixels
+        scale: Shape size relative to the canvas
+        num_points: Number of outline points
+
+    Returns:
+        Array of (x, y) points with shape (num_points, 2)
+    """
+    center = size / 2.0
+    radius = size * scale / 2.0
+    t = np.linspace(0.0, 1.0, num_points, endpoint=False)
+
+    if shape_type == "circle":
+        angles = 2 * np.pi * t
+        return np.stack([center + radius * np.cos(angles),
+                         center + radius * np.sin(angles)], axis=1)
+
+    if shape_type == "triangle":
+        angles = -np.pi / 2 + 2 * np.pi * np.arange(3) / 3
+    else:
+        angles = np.pi / 4 + 2 * np.pi * np.arange(4) / 4
+    corners = np.stack([center + radius * np.cos(angles),
+                        center + radius * np.sin(angles)], axis=1)
+
+    # Walk the polygon edges at constant speed
+    num_corners = len(corners)
+    position = t * num_corners
+    edge = np.floor(position).astype(int)
+    fraction = (position - edge)[:, None]
+    start = corners[edge % num_corners]
+    end = corners[(edge + 1) % num_corners]
+    return start + (end - start) * fraction
+
+
+def generate_shape_image(shape_type: str, size: int = 256, thickness: int = 3,
+                         scale: float = 0.7) -> np.ndarray:
+    """
+    Draw the original (reference) shape
+
+    Args:
+        shape_type: "triangle", "circle" or "square"
+        size: Canvas size in pixels
+        thickness: Line thickness in pixels
+        scale: Shape size relative to the canvas
+
+    Returns:
+        BGR image with a white outline on black
+    """
+    image = np.zeros((size, size, 3), dtype=np.uint8)
+    points = _shape_outline(shape_type, size, scale).round().astype(np.int32)
+    cv2.polylines(image, [points], True, (255, 255, 255), thickness)
+    return image
+
+
+def generate_traced_shape(shape_type: str, size: int = 256, jitter: float = 0.01,
+                          completion: float = 1.0, thickness: int = 3,
+                          scale: float = 0.7, seed: int = None) -> np.ndarray:
+    """
+    Simulate a user's tracing of a shape
+
+    Args:
+        shape_type: "triangle", "circle" or "square"
+        size: Canvas size in pixels
+        jitter: Hand tremor as a fraction of the canvas size
+        completion: Fraction of the outline that was traced (0.0-1.0)
+        thickness: Line thickness in pixels
+        scale: Shape size relative to the canvas
+        seed: Random seed for reproducible tracings
+
+    Returns:
+        BGR image of the traced stroke
+    """
+    rng = np.random.RandomState(seed)
+    points = _shape_outline(shape_type, size, scale)
+
+    # Low-frequency wobble plus per-point tremor
+    wobble = np.cumsum(rng.normal(0.0, jitter * size * 0.2, points.shape), axis=0)
+    wobble -= np.linspace(0.0, 1.0, len(points))[:, None] * wobble[-1]
+    tremor = rng.normal(0.0, jitter * size * 0.3, points.shape)
+    points = points + wobble + tremor
+
+    traced_points = max(2, int(round(len(points) * min(1.0, max(0.0, completion)))))
+    stroke = points[:traced_points].round().astype(np.int32)
+
+    image = np.zeros((size, size, 3), dtype=np.uint8)
+    cv2.polylines(image, [stroke], completion >= 1.0, (255, 255, 255), thickness)
+    return image
+
+
+def generate_doodle(palette: List[Tuple[int, int, int]], size: int = 256,
+                    num_strokes: int = 12, seed: int = None) -> np.ndarray:
+    """
+    Generate a palette doodle like those drawn for the GauGAN transform
+
+    Args:
+        palette: BGR colors to paint with (e.g. the keys of GauGANAdapter.color_map)
+        size: Canvas size in pixels
+        num_strokes: Number of filled regions and brush strokes
+        seed: Random seed for reproducible doodles
+
+    Returns:
+        BGR doodle image
+    """
+    rng = np.random.RandomState(seed)
+    palette = [tuple(int(c) for c in color) for color in palette]
+    image = np.zeros((size, size, 3), dtype=np.uint8)
+
+    # Sky/ground style horizontal bands
+    horizon = int(size * rng.uniform(0.3, 0.6))
+    image[:horizon] = palette[rng.randint(len(palette))]
+    image[horizon:] = palette[rng.randint(len(palette))]
+
+    for _ in range(num_strokes):
+        color = palette[rng.randint(len(palette))]
+        kind = rng.randint(3)
+        if kind == 0:
+            # Filled polygon (mountains, buildings)
+            num_vertices = rng.randint(3, 7)
+            vertices = rng.randint(0, size, (num_vertices, 2)).astype(np.int32)
+            cv2.fillPoly(image, [vertices], color)
+        elif kind == 1:
+            # Filled ellipse (trees, clouds, lakes)
+            center = (int(rng.randint(size)), int(rng.randint(size)))
+            axes = (int(rng.randint(size // 16, size // 4) + 1),
+                    int(rng.randint(size // 16, size // 4) + 1))
+            cv2.ellipse(image, center, axes, float(rng.uniform(0, 180)), 0, 360, color, -1)
+        else:
+            # Thick brush stroke (roads, rivers)
+            points = np.cumsum(rng.randint(-size // 8, size // 8 + 1, (8, 2)), axis=0)
+            points += rng.randint(0, size, 2)
+            points = np.clip(points, 0, size - 1).astype(np.int32)
+            cv2.polylines(image, [points], False, color, int(max(2, size // 40)))
+
+    return image
+
+
+def to_base64_png(image: np.ndarray) -> str:
+    """
+    Encode an image as a PNG data URI as sent by the mobile app
+    """
+    ok, buffer = cv2.imencode(".png", image)
+    if not ok:
+        raise ValueError("Could not encode image")
+    return "data:image/png;base64," + base64.b64encode(buffer.tobytes()).decode("utf-8")
+
+
+def generate_shape_request(size: int = 256, seed: int = None) -> Dict[str, Any]:
+    """
+    Generate a random /shape-analysis request body
+
+    Args:
+        size: Canvas size in pixels
+        seed: Random seed
+
+    Returns:
+        Request body as a dictionary
+    """
+    rng = np.random.RandomState(seed)
+    shape_type = SHAPE_TYPES[rng.randint(len(SHAPE_TYPES))]
+    traced = generate_traced_shape(
+        shape_type, size,
+        jitter=float(rng.uniform(0.0, 0.03)),
+        completion=float(rng.uniform(0.6, 1.0)),
+        seed=int(rng.randint(2 ** 31))
+    )
+    return {
+        "original_image": to_base64_png(generate_shape_image(shape_type, size)),
+        "traced_image": to_base64_png(traced),
+        "response_time": float(rng.uniform(0.5, 6.0)),
+        "shape_type": shape_type
+    }
+
+
+def generate_doodle_request(palette: List[Tuple[int, int, int]], size: int = 256,
+                            seed: int = None) -> Dict[str, Any]:
+    """
+    Generate a random /doodle-analysis request body
+
+    Args:
+        palette: BGR colors to paint with
+        size: Canvas size in pixels
+        seed: Random seed
+
+    Returns:
+        Request body as a dictionary
+    """
+    return {"doodle_image": to_base64_png(generate_doodle(palette, size, seed=seed))}
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+Distributed Tracing for AI-PsychDoodle-Analyzer
+W3C trace context propagation and spans exported as OTLP/JSON
+
+The app client and the API server share this module: the client sends a
+"traceparent" header with every call and the server continues the trace,
+so one trace shows the client call, the server request, the time spent
+queued for a pipeline thread and every pipeline stage. Spans are exported
+in the OTLP/JSON encoding, either to a local JSON-lines file (one export
+request per line, which can be replayed to a collector) or over HTTP to
+an OTLP-compatible collector.
+"""
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+import contextvars
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from utils.stage_timing import StageObserver, add_stage_observer
+
+logger = logging.getLogger(__name__)
+
+# Span kinds (OTLP numbering)
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+# Span status codes (OTLP numbering)
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+TRACEPARENT_HEADER = "traceparent"
+
+# Span of the code currently running (None outside any trace)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class SpanContext:
+    """
+    Identity of a span as propagated between processes
+    """
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool = True):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    """
+    Parse a W3C traceparent header ("00-<trace id>-<parent id>-<flags>")
+
+    Returns:
+        The remote span context, or None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    parts = value.strip().lower().split("-")
+    if len(parts) < 4 or len(parts[0]) != 2 or parts[0] == "ff":
+        return None
+    version, trace_id, span_id, flags = parts[:4]
+    if version == "00" and len(parts) != 4:
+        return None
+    if len(trace_id) != 32 or len(span_id) != 16 or len(flags) != 2:
+        return None
+    try:
+        int(trace_id, 16), int(span_id, 16)
+        sampled = bool(int(flags, 16) & 1)
+    except ValueError:
+        return None
+    if trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return SpanContext(trace_id, span_id, sampled)
+
+
+def format_traceparent(context) -> str:
+    """
+    traceparent header value of a span (or span context)
+    """
+    return f"00-{context.trace_id}-{context.span_id}-{'01' if context.sampled else '00'}"
+
+
+def parse_server_timing(value: Optional[str]) -> Dict[str, float]:
+    """
+    Parse a Server-Timing header
+
+    Returns:
+        Duration in milliseconds by metric name (metrics without a duration
+        are left out)
+    """
+    durations: Dict[str, float] = {}
+    for metric in (value or "").split(","):
+        name, *params = [part.strip() for part in metric.split(";")]
+        for param in params:
+            key, _, duration = param.partition("=")
+            if name and key.strip() == "dur":
+                try:
+                    durations[name] = float(duration.strip().strip('"'))
+                except ValueError:
+                    pass
+    return durations
+
+
+class Span:
+    """
+    A timed operation within a trace.
+
+    Unsampled spans carry the trace identity for propagation but are not
+    exported.
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, span_id: str,
+                 parent_id: Optional[str] = None, kind: int = SPAN_KIND_INTERNAL,
+                 sampled: bool = True, attributes: Optional[Dict[str, Any]] = None,
+                 start_ns: Optional[int] = None, parent: Optional["Span"] = None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.parent = parent
+        self.kind = kind
+        self.sampled = sampled
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = STATUS_UNSET
+        self.status_message = ""
+        self.stage = False
+
+    def set_attribute(self, key: str, value: Any):
+        if self.sampled:
+            self.attributes[key] = value
+
+    def set_error(self, message: str = ""):
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def traceparent(self) -> str:
+        return format_traceparent(self)
+
+    def end(self, end_ns: Optional[int] = None):
+        """
+        Finish the span and hand it to the tracer's exporter (only once)
+        """
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns if end_ns is not None else time.time_ns()
+        self.tracer._on_end(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """
+        The span in the OTLP/JSON encoding
+        """
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns if self.end_ns is not None else self.start_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": self.status}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def otlp_request(spans: List[Span], service_name: str,
+                 resource: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    OTLP/JSON ExportTraceServiceRequest for a batch of spans
+    """
+    attributes = dict({"service.name": service_name}, **(resource or {}))
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes(attributes)},
+            "scopeSpans": [{
+                "scope": {"name": "psychdoodle.tracing"},
+                "spans": [span.to_otlp() for span in spans]
+            }]
+        }]
+    }
+
+
+class FileSpanExporter:
+    """
+    Appends each batch of spans as one OTLP/JSON line to a file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, request: Dict[str, Any]):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        line = (json.dumps(request, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            # A single append keeps the lines of several processes intact
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+
+class OTLPHttpSpanExporter:
+    """
+    Sends batches of spans to an OTLP/HTTP collector (JSON encoding)
+    """
+
+    def __init__(self, endpoint: str, headers: Optional[Dict[str, str]] = None, timeout: float = 5.0):
+        """
+        Args:
+            endpoint: Traces endpoint (e.g. "http://localhost:4318/v1/traces")
+            headers: Additional request headers (e.g. authentication)
+            timeout: Request timeout in seconds
+        """
+        self.endpoint = endpoint
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+
+    def export(self, request: Dict[str, Any]):
+        body = json.dumps(request, separators=(",", ":")).encode("utf-8")
+        http_request = urllib.request.Request(
+            self.endpoint, data=body, method="POST",
+            headers=dict({"Content-Type": "application/json"}, **self.headers))
+        with urllib.request.urlopen(http_request, timeout=self.timeout) as response:
+            response.read()
+
+
+class BatchSpanProcessor:
+    """
+    Exports finished spans in batches on a background thread.
+
+    Ending a span only appends it to a bounded queue; when the queue is
+    full (the exporter cannot keep up) further spans are dropped and
+    counted rather than slowing down requests.
+    """
+
+    def __init__(self, exporter, service_name: str, resource: Optional[Dict[str, Any]] = None,
+                 max_queue: int = 4096, batch_size: int = 512, interval: float = 2.0):
+        """
+        Args:
+            exporter: FileSpanExporter or OTLPHttpSpanExporter
+            service_name: Name of the service the spans belong to
+            resource: Additional resource attributes (e.g. the process id)
+            max_queue: Most spans held for export
+            batch_size: Most spans per export request
+            interval: Seconds between exports
+        """
+        self.exporter = exporter
+        self.service_name = service_name
+        self.resource = dict(resource or {})
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self._queue = deque()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._export_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def on_end(self, span: Span):
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._queue.append(span)
+        if len(self._queue) >= self.batch_size:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Export all queued spans
+        """
+        with self._export_lock:
+            while self._queue:
+                batch = []
+                while self._queue and len(batch) < self.batch_size:
+                    batch.append(self._queue.popleft())
+                try:
+                    self.exporter.export(otlp_request(batch, self.service_name, self.resource))
+                except Exception as e:
+                    self.dropped += len(batch)
+                    logger.warning(f"Could not export {len(batch)} spans: {e}")
+
+    def shutdown(self):
+        """
+        Stop the export thread after exporting the remaining spans
+        """
+        self._stopped = True
+        self._wake.set()
+        self._thread.join(timeout=self.interval + 5)
+        self.flush()
+
+
+class Tracer:
+    """
+    Creates spans for one service and hands finished, sampled spans to a
+    batch processor.
+
+    Without a processor spans are only propagated: the sampled flag still
+    asks downstream services to record their part of the trace.
+    """
+
+    def __init__(self, service_name: str, processor: Optional[BatchSpanProcessor] = None,
+                 sample_ratio: float = 1.0):
+        """
+        Args:
+            service_name: Name of the service (e.g. "psychdoodle-api")
+            processor: Exports finished spans
+            sample_ratio: Fraction of new traces that are recorded; traces
+                continued from a remote parent follow its sampled flag
+        """
+        self.service_name = service_name
+        self.processor = processor
+        self.sample_ratio = sample_ratio
+
+    def start_span(self, name: str, parent=None, kind: int = SPAN_KIND_INTERNAL,
+                   attributes: Optional[Dict[str, Any]] = None, start_ns: Optional[int] = None) -> Span:
+        """
+        Start a span (ended by calling its end())
+
+        Args:
+            name: Span name
+            parent: Parent Span or remote SpanContext (default: the current span)
+            kind: SPAN_KIND_INTERNAL, SPAN_KIND_SERVER or SPAN_KIND_CLIENT
+            attributes: Initial attributes
+            start_ns: Start time in nanoseconds since the epoch (default: now)
+
+        Returns:
+            The started span
+        """
+        if parent is None:
+            parent = _current_span.get()
+        if parent is not None:
+            trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+        else:
+            trace_id, parent_id = _random_id(16), None
+            sampled = random.random() < self.sample_ratio
+        return Span(self, name, trace_id, _random_id(8), parent_id, kind, sampled,
+                    attributes if sampled else None, start_ns,
+                    parent if isinstance(parent, Span) else None)
+
+    @contextmanager
+    def span(self, name: str, parent=None, kind: int = SPAN_KIND_INTERNAL,
+             attributes: Optional[Dict[str, Any]] = None):
+        """
+        Run a block of code in a new span, which is the current span meanwhile
+        """
+        span = self.start_span(name, parent, kind, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def _on_end(self, span: Span):
+        if span.sampled and self.processor is not None:
+            self.processor.on_end(span)
+
+    def shutdown(self):
+        """
+        Export the remaining spans
+        """
+        if self.processor is not None:
+            self.processor.shutdown()
+
+
+def _random_id(num_bytes: int) -> str:
+    return random.getrandbits(num_bytes * 8).to_bytes(num_bytes, "big").hex()
+
+
+def create_tracer(service_name: str, config: Optional[Dict[str, Any]] = None) -> Tracer:
+    """
+    Create a tracer from a tracing configuration
+
+    Args:
+        service_name: Default service name (overridden by config["service_name"])
+        config: Tracing settings: "enabled", "exporter" ("file", "otlp" or
+            "none"), "file_path", "otlp_endpoint", "otlp_headers" and
+            "sample_ratio"
+
+    Returns:
+        The tracer; without an exporter it still propagates trace context
+    """
+    config = config or {}
+    service_name = config.get("service_name") or service_name
+    exporter_name = config.get("exporter", "none") if config.get("enabled", True) else "none"
+    exporter = None
+    if exporter_name == "file":
+        exporter = FileSpanExporter(config.get("file_path", "logs/traces.jsonl"))
+    elif exporter_name == "otlp":
+        exporter = OTLPHttpSpanExporter(config.get("otlp_endpoint", "http://localhost:4318/v1/traces"),
+                                        headers=config.get("otlp_headers"))
+    elif exporter_name != "none":
+        raise ValueError(f"Unknown trace exporter: {exporter_name}")
+    processor = None
+    if exporter is not None:
+        processor = BatchSpanProcessor(exporter, service_name, resource={"process.pid": os.getpid()})
+    return Tracer(service_name, processor, sample_ratio=float(config.get("sample_ratio", 1.0)))
+
+
+def current_span() -> Optional[Span]:
+    """
+    The span of the code currently running (None outside any trace)
+    """
+    return _current_span.get()
+
+
+def set_span_attribute(key: str, value: Any):
+    """
+    Set an attribute on the current span (if any)
+    """
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+def record_span(name: str, start_ns: int, end_ns: Optional[int] = None,
+                attributes: Optional[Dict[str, Any]] = None):
+    """
+    Record an already finished child of the current span (e.g. time spent
+    waiting in a queue, measured from outside the waiting code)
+    """
+    parent = _current_span.get()
+    if parent is None or not parent.sampled:
+        return
+    span = parent.tracer.start_span(name, parent, attributes=_inherited(parent, attributes),
+                                    start_ns=start_ns)
+    span.end(end_ns)
+
+
+def _inherited(parent: Span, attributes: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # Stage spans carry the analysis they belong to
+    inherited = {"analysis_id": parent.attributes["analysis_id"]} if "analysis_id" in parent.attributes else {}
+    inherited.update(attributes or {})
+    return inherited
+
+
+class TracingStageObserver(StageObserver):
+    """
+    Records every pipeline stage as a child span of the current span
+    """
+
+    def on_stage_start(self, name: str):
+        parent = _current_span.get()
+        if parent is None or not parent.sampled:
+            return
+        span = parent.tracer.start_span(name, parent, attributes=_inherited(parent))
+        span.stage = True
+        _current_span.set(span)
+
+    def on_stage_end(self, name: str, duration: float, error: bool = False):
+        span = _current_span.get()
+        if span is None or not span.stage or span.name != name:
+            return
+        if error:
+            span.set_error()
+        _current_span.set(span.parent)
+        span.end()
+
+
+_stage_observer = TracingStageObserver()
+
+
+def trace_stages():
+    """
+    Record pipeline stages (utils.stage_timing) as spans
+    """
+    add_stage_observer(_stage_observer)